@@ -0,0 +1,90 @@
+"""
+In-memory, per-location cache of the location-wide lookups that nearly
+every page makes through /api/attrs: media types and genres.
+
+It's stale-while-revalidate. An entry younger than its soft TTL is just
+served. One that's older than that, but younger than its hard TTL, is
+still served straight away, but also gets one refresh started in the
+background, for whoever asks next. Past the hard TTL (or with nothing
+cached at all) the caller has to wait for a fresh lookup.
+
+What keeps it correct is that each entry remembers which version of its
+data it was fetched at (see versions.py): add_media(), rename_genre(),
+remove_genre() and the media-type edits all bump that version already,
+here and, over the bus, on every other worker, so an entry whose version
+isn't current any more is never served, however young it is.
+
+Lookups of the same entry are coalesced (see singleflight.py), so a
+stampede of misses for a location is still just the one query.
+"""
+import asyncio
+import time
+
+from . import metrics
+from .singleflight import SingleFlight
+
+SOFT_TTL = 30.0  # s
+HARD_TTL = 600.0  # s
+
+
+class AttrCache:
+    """
+    soft (float): Seconds an entry's served as-is
+    hard (float): Seconds an entry's served at all
+    """
+    def __init__(self, app, *, soft=SOFT_TTL, hard=HARD_TTL):
+        self._app = app
+        self.soft = soft
+        self.hard = hard
+        self._entries = {}  # (lid, kind) -> (value, version, fetched)
+        self._flights = SingleFlight('attrs')
+    
+    @classmethod
+    def from_config(cls, app):
+        config = app.config
+        return cls(
+          app,
+          soft=float(config.get('ATTR_CACHE_SOFT_S') or SOFT_TTL),
+          hard=float(config.get('ATTR_CACHE_HARD_S') or HARD_TTL),
+          )
+    
+    async def get(self, lid, kind, fetch):
+        """
+        Location `lid`'s `kind` of data (the kind of versions.py's that
+        it's bumped under), fetched if need be by awaiting fetch().
+        What's returned is shared, so it mustn't be changed.
+        """
+        key = lid, kind
+        try:
+            value, version, fetched = self._entries[key]
+        except KeyError:
+            pass
+        else:
+            age = time.monotonic() - fetched
+            if version == self._app.versions.get(lid, kind) and age < self.hard:
+                if age < self.soft:
+                    metrics.ATTR_CACHE.inc(kind, 'fresh')
+                elif key not in self._flights:
+                    metrics.ATTR_CACHE.inc(kind, 'stale')
+                    asyncio.ensure_future(self._revalidate(key, fetch))
+                return value
+        metrics.ATTR_CACHE.inc(kind, 'miss')
+        return await self._load(key, fetch)
+    
+    def _load(self, key, fetch):
+        async def load():
+            # Noted down before the lookup, so a bump in the middle of it
+            # leaves the entry out of date rather than wrongly current
+            version = self._app.versions.get(*key)
+            value = await fetch()
+            self._entries[key] = value, version, time.monotonic()
+            return value
+        return self._flights.do(key, load)
+    
+    async def _revalidate(self, key, fetch):
+        try:
+            await self._load(key, fetch)
+        except Exception:
+            # The stale entry's kept until its hard TTL's up, and the next
+            # request to be served it will start another try meanwhile
+            pass
@@ -1,10 +1,12 @@
 from sanic import Blueprint
 
-from .. import email_verify
+from .. import context, email_verify, events, jobs, streaming
 from ..typedef import Location, Role, MediaType, MediaItem, User
-from ..deco import uid_get, rqst_get
+from ..attributes import Perms
+from ..deco import uid_get, rqst_get, conditional, rate_limited, priority, admin_only
 
 from .api import api
 from .stock import stock
+from .admin import admin
 
-bp = Blueprint.group(api, stock)
+bp = Blueprint.group(api, stock, admin)
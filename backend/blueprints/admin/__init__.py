@@ -0,0 +1,9 @@
+from sanic import Blueprint
+
+from .. import admin_only
+
+from .metrics import metrics
+from .pool import pool
+from .queries import queries
+
+admin = Blueprint.group(metrics, pool, queries, url_prefix='')
@@ -0,0 +1,16 @@
+import sanic
+
+from . import admin_only
+from ... import metrics as m
+
+metrics = sanic.Blueprint('admin_metrics', url_prefix='')
+
+
+@metrics.get('/metrics')
+@admin_only
+async def serve_metrics(rqst):
+    """
+    Everything backend/metrics.py keeps track of, for Prometheus
+    to scrape.
+    """
+    return sanic.response.text(m.render(rqst.app), headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
@@ -0,0 +1,18 @@
+import sanic
+
+from . import admin_only
+
+pool = sanic.Blueprint('admin_pool', url_prefix='/admin')
+
+
+@pool.get('/pool')
+@admin_only
+async def serve_pool_state(rqst):
+    """
+    How the Postgres pool's being shared out between locations right
+    now, and which locations have spent the longest queued for it. See
+    backend/fairpool.py.
+    """
+    if rqst.app.pg_pool.scheduler is None:
+        sanic.exceptions.abort(404, 'Fair scheduling is off. (PG_FAIR_POOL is set to 0.)')
+    return sanic.response.json(rqst.app.pg_pool.scheduler.dump(), status=200)
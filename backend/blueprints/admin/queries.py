@@ -0,0 +1,18 @@
+import sanic
+
+from . import admin_only
+
+queries = sanic.Blueprint('admin_queries', url_prefix='/admin')
+
+
+@queries.get('/slow-queries')
+@admin_only
+async def serve_slow_queries(rqst):
+    """
+    The query tracer's ring buffer of slow statements, with their
+    EXPLAIN output, plus the statements that have taken up the most DB
+    time overall. See backend/tracer.py.
+    """
+    if rqst.app.pg_pool.tracer is None:
+        sanic.exceptions.abort(404, 'Query tracing is off. (Set SLOW_QUERY_MS to turn it on.)')
+    return sanic.response.json(rqst.app.pg_pool.tracer.dump(), status=200)
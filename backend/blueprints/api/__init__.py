@@ -1,10 +1,12 @@
 from sanic import Blueprint
 
-from .. import Location, Role, MediaType, MediaItem, User
-from .. import uid_get, rqst_get
-from .. import email_verify
+from .. import Location, Role, MediaType, MediaItem, User, Perms
+from .. import uid_get, rqst_get, conditional, rate_limited, priority
+from .. import context, email_verify, events, jobs, streaming
 
+from .bootstrap import bootstrap
 from .help import help
+from .jobs import jobs_api
 from .location import location
 from .media import media
 from .member import mbr as member
@@ -12,4 +14,4 @@ from .member import mbr as member
 from .roles import roles
 from .root import root
 
-api = Blueprint.group(help, location, media, member, roles, root, url_prefix='/api')
+api = Blueprint.group(bootstrap, help, jobs_api, location, media, member, roles, root, url_prefix='/api')
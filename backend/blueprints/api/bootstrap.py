@@ -0,0 +1,43 @@
+"""/api/bootstrap"""
+import sanic
+from sanic_jwt import decorators as jwtdec
+
+from . import context, uid_get
+from .member import perms_payload
+from .root import attr_names
+from ..stock.buttons import MAIN_HEADER, home_sidebar, mgmt_header
+
+bootstrap = sanic.Blueprint('bootstrap_api', url_prefix='')
+
+
+@bootstrap.get('/bootstrap')
+@uid_get('user')
+@jwtdec.protected()
+async def serve_bootstrap(rqst, user):
+    """
+    Everything the client used to fetch separately on signing in --
+    the three button sets, /api/attrs, /api/roles/me,
+    /api/member/check-perms and /api/member/notifications -- in one
+    request, so the user's only looked up the once, and the queries
+    that don't depend on each other are run side by side.
+    """
+    location = user.location
+    types, genres, notifs = await context.gather(location.media_types(), location.genres(), user.notifs())
+    perms = user.perms.raw
+    resp = {
+      'buttons': {
+        'main_header': MAIN_HEADER,
+        'home_sidebar': home_sidebar(perms, user.is_checkout),
+        'mgmt_header': None if user.is_checkout else mgmt_header(perms),
+        },
+      'attrs': {
+        'types': types,
+        'genres': genres,
+        'color': location.color,
+        'names': attr_names(user.perms.can_manage_location),
+        },
+      'me': {i: getattr(user, i).props for i in ('perms', 'limits', 'locks')},
+      'perms': perms_payload(perms),
+      'notifications': notifs,
+      }
+    return sanic.response.json(resp, status=200)
@@ -1,37 +1,48 @@
-# Note, this is the only one of these route-handler files that uses
-# straight Postgres instead of outsourcing it to the classes in typedef.
+# Note, this is the only one of these route-handler files that doesn't
+# go through the classes in typedef -- help articles are instead served
+# straight from an in-memory copy of the help table (see helpcache.py).
 import sanic
 
-from . import rqst_get
+from . import rqst_get, conditional, priority
 
 help = sanic.Blueprint('api_help', url_prefix='/help')
 
 
+def _article(rqst, ID):
+    try:
+        return rqst.app.help[int(ID)]
+    except (KeyError, ValueError):
+        sanic.exceptions.abort(404, 'Help article does not exist.')
+
+
 @help.get('/titles')
+@priority('low')
+@conditional('help', per_user=False)
 async def serve_help_titles(rqst):
     """
     These can be cached because they won't change
     """
-    titles = await rqst.app.pg_pool.fetch('''SELECT id, title FROM help WHERE true''')
-    return sanic.response.json({'articles': [{'id': i['id'], 'title': i['title']} for i in titles]}, status=200)
+    return sanic.response.json({'articles': rqst.app.help.titles}, status=200)
 
 
 @help.get('/content')
+@priority('low')
 @rqst_get('ID')
 async def serve_help_article(rqst, *, ID):
     """
     These should never be cached.
     """
-    title, content = await rqst.app.pg_pool.fetchrow('''SELECT title, content FROM help WHERE id = $1::bigint''', int(ID))
-    return sanic.response.json({'help': {'title': title, 'content': content}}, status=200)
+    article = _article(rqst, ID)
+    return sanic.response.json({'help': {'title': article['title'], 'content': article['content']}}, status=200)
 
 
 @help.get('/brief')
+@priority('low')
 @rqst_get('ID')
 async def give_brief(rqst, *, ID):
     """
     For the "What's this?" tooltips; serves a brief explanation
     of whatever's on the page and links to its full help article.
     """
-    resp = await rqst.app.pg_pool.fetchrow('''SELECT title, brief FROM help WHERE id = $1::bigint''', int(ID))
-    return sanic.response.json({'help': {'title': resp['title'], 'brief': resp['brief']}})
+    article = _article(rqst, ID)
+    return sanic.response.json({'help': {'title': article['title'], 'brief': article['brief']}})
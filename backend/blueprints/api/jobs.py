@@ -0,0 +1,24 @@
+"""/api/jobs"""
+import sanic
+from sanic_jwt import decorators as jwtdec
+
+from . import uid_get
+from . import jobs
+
+jobs_api = sanic.Blueprint('jobs_api', url_prefix='/jobs')
+
+
+@jobs_api.get('/<jid:int>')
+@uid_get('location')
+@jwtdec.protected()
+async def serve_job(rqst, location, *, jid):
+    """
+    Where a background job (see backend/jobs.py) is at: its state
+    ('queued', 'running', 'done' or 'failed'), progress from 0 to 1,
+    and its result or error once it has one. Polled by the client after
+    a 202 from the endpoint that queued it.
+    """
+    job = await jobs.fetch(rqst.app, jid, location.lid)
+    if job is None:
+        sanic.exceptions.abort(404, 'Job does not exist.')
+    return sanic.response.json(job, status=200)
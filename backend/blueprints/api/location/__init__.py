@@ -1,8 +1,8 @@
 from sanic import Blueprint
 
 from .. import Location, Role, MediaType, MediaItem, User
-from .. import uid_get, rqst_get
-from .. import email_verify
+from .. import uid_get, rqst_get, conditional, rate_limited, priority
+from .. import email_verify, jobs, streaming
 
 from .media import media
 from .root import root
@@ -2,7 +2,8 @@
 from sanic import Blueprint
 
 from .. import Location, Role, MediaType, MediaItem, User
-from .. import uid_get, rqst_get
+from .. import uid_get, rqst_get, conditional, rate_limited, priority
+from .. import streaming
 
 from .root import root
 from .genres import genres
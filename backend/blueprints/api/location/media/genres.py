@@ -1,14 +1,15 @@
 import sanic
 from sanic_jwt import decorators as jwtdec
 
-from . import uid_get, rqst_get
+from . import uid_get, rqst_get, conditional
 
 genres = sanic.Blueprint('location_media_genres', url_prefix='/genres')
 
 
 @genres.get('/')
-@uid_get('location')
 @jwtdec.protected()
+@conditional('genres')
+@uid_get('location')
 async def get_location_genres(rqst, location):
     """Serves all genres in a location."""
     return sanic.response.json(await location.genres(), status=200)
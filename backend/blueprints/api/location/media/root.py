@@ -1,13 +1,14 @@
 import sanic
 from sanic_jwt import decorators as jwtdec
 
-from . import uid_get, rqst_get
-from . import MediaType
+from . import uid_get, rqst_get, rate_limited, priority
+from . import MediaType, streaming
 
 root = sanic.Blueprint('location_media_api', url_prefix='')
 
 
 @root.get('/')
+@priority('low')
 @uid_get('location')
 @rqst_get('cont')
 @jwtdec.protected()
@@ -16,10 +17,24 @@ async def all_location_items(rqst, location, *, cont):
     Serves all media items, in groups of 5 (paginated according to 'cont', i.e. what
     page to continue from).
     """
-    return sanic.response.json({'items': await location.items(cont=int(cont))}, status=200)
+    return sanic.response.raw(await location.items(cont=int(cont)), content_type='application/json')
+
+
+@root.get('/export')
+@priority('low')
+@rate_limited('exports')
+@uid_get('location')
+@jwtdec.protected()
+async def export_location_items(rqst, location):
+    """
+    Streams all media items, unpaginated; as for /location/members/export.
+    """
+    return streaming.rows(rqst.app, *location.items_export(), ndjson=streaming.wants_ndjson(rqst))
 
 
 @root.get('/search')
+@priority('low')
+@rate_limited('search')
 @rqst_get('title', 'genre', 'media_type', 'author', 'cont')
 @uid_get('location')
 @jwtdec.protected()
@@ -29,7 +44,7 @@ async def search_location_media(rqst, location, *, title, genre, media_type, aut
     that match the given search query.
     Also in groups of 5.
     """
-    return sanic.response.json(
+    return sanic.response.raw(
       await location.search(
         title=None if title == 'null' else title,
         genre=None if genre == 'null' else genre,
@@ -37,7 +52,7 @@ async def search_location_media(rqst, location, *, title, genre, media_type, aut
         author=None if author == 'null' else author,
         cont=cont
         ),
-      status=200)
+      content_type='application/json')
 
 
 @root.post('/add')
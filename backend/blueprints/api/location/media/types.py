@@ -2,15 +2,16 @@ import sanic
 from asyncpg.exceptions import UniqueViolationError
 from sanic_jwt import decorators as jwtdec
 
-from . import uid_get, rqst_get
+from . import uid_get, rqst_get, conditional
 from . import MediaType
 
 types = sanic.Blueprint('location_media_types', url_prefix='/types')
 
 
 @types.get('/')
-@uid_get('location')
 @jwtdec.protected()
+@conditional('mtypes')
+@uid_get('location')
 async def get_location_media_types(rqst, location):
     """
     Serves all media types (as serialized dicts) defined on a location.
@@ -1,12 +1,12 @@
 """/location/members"""
 import asyncpg
-import io
 
 import sanic
 from sanic_jwt import decorators as jwtdec
 
-from . import uid_get, rqst_get
+from . import uid_get, rqst_get, rate_limited, priority
 from . import User
+from . import jobs, streaming
 
 mbrs = sanic.Blueprint('location_members_api', url_prefix='/members')
 
@@ -20,10 +20,27 @@ async def serve_location_members(rqst, location, *, cont: 'where to continue sea
     Serves all a location's members, in page determined by cont.
     (Output is not paginated in the actual application)
     """
-    return sanic.response.json(await location.members(cont=int(cont)))
+    return sanic.response.raw(await location.members(cont=int(cont)), content_type='application/json')
+
+
+@mbrs.get('/export')
+@priority('low')
+@rate_limited('exports')
+@uid_get('location', 'perms')
+@jwtdec.protected()
+async def export_location_members(rqst, location, perms):
+    """
+    Streams every one of a location's members (see backend/streaming.py),
+    as NDJSON if asked for with Accept: application/x-ndjson, else as
+    a JSON array.
+    """
+    if not perms.can_manage_accounts:
+        sanic.exceptions.abort(403, "You aren't allowed to view member info.")
+    return streaming.rows(rqst.app, *location.members_export(), ndjson=streaming.wants_ndjson(rqst))
 
 
 @mbrs.get('/info')
+@priority('normal')
 @uid_get('perms')
 @rqst_get('check')
 @jwtdec.protected()
@@ -61,23 +78,26 @@ async def add_member_to_location(rqst, location, perms, *, member):
 
 
 @mbrs.post('/add/batch')
-@uid_get('location', 'perms')
+@priority('low')
+@rate_limited('batch')
+@uid_get('location', 'perms', 'uid')
 @rqst_get('rid', files=['csv'], form=True)
 @jwtdec.protected()
-async def add_members_from_csv(rqst, location, *, perms, rid, csv):
+async def add_members_from_csv(rqst, location, *, perms, uid, rid, csv):
     """
     Batch addition of members.
     Really hope I can implement this but probably not.
+    
+    Hashing everyone's password takes a good while, so this is done by
+    a background job (see backend/jobs.py); the response is the job's
+    ID, to poll /api/jobs/<ID> with.
     """
     if not perms.can_manage_accounts:
         sanic.exceptions.abort(401, "You aren't allowed to add members.")
     if csv is None:  # using conditional instead of try/except bc the data itself might also be null instead of just not present
         sanic.exceptions.abort(422, "No file given!")
-    try:
-        await location.add_members_batch(io.BytesIO(csv.body), rid)
-    except Exception as e:
-        sanic.exceptions.abort(422, str(e))
-    return sanic.response.json('Added members.', status=201)
+    jid = await jobs.enqueue(rqst.app, 'members.import', location.lid, uid, {'rid': int(rid)}, input=csv.body)
+    return sanic.response.json({'job': jid}, status=202, headers={'Location': f'/api/jobs/{jid}'})
 
 
 @mbrs.post('/remove')
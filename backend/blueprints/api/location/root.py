@@ -1,12 +1,12 @@
 """/api/location"""
 import sanic
 from sanic_jwt import decorators as jwtdec
-from aiosmtplib.errors import SMTPRecipientsRefused
 from asyncpg.exceptions import UniqueViolationError
 
 from . import Location
-from . import uid_get, rqst_get
+from . import uid_get, rqst_get, rate_limited, priority
 from . import email_verify as verif
+from . import jobs
 
 root = sanic.Blueprint('location_api', url_prefix='')
 
@@ -34,6 +34,7 @@ async def register_location(rqst, *, locname, color, adminname, email):
         token = await Location.prelim_signup(rqst, email, locname, color, adminname)
     except UniqueViolationError:
         sanic.exceptions.abort(409, "There's already a library being signed up with this email!")
+    from aiosmtplib.errors import SMTPRecipientsRefused  # lazy; see email_verify.py
     try:
         await verif.send_email(email, adminname, locname, token, loop=rqst.app.loop)
     except SMTPRecipientsRefused:
@@ -78,14 +79,20 @@ async def is_location_registered(rqst):
 
 
 @root.put('/reports')
+@priority('low')
+@rate_limited('reports', only_if=lambda rqst: (rqst.json or {}).get('live'))  # the weekly ones are cheap
 @rqst_get('get', 'live')
-@uid_get('location', 'perms')
+@uid_get('location', 'perms', 'uid')
 @jwtdec.protected()
-async def get_report(rqst, location, perms, *, get, live):
+async def get_report(rqst, location, perms, uid, *, get, live):
     """
     get: type of report to get
     live: whether to serve the cached weekly report or a live one
     
+    Live reports can take a while, so they're generated by a background
+    job (see backend/jobs.py) and the response is only the job's ID, to
+    poll /api/jobs/<ID> with.
+    
     Serves a generated report on whatever activity is going on in the library.
     
     Due to the multi-library nature of the app, I cannot satisfy the "weekly"
@@ -95,10 +102,14 @@ async def get_report(rqst, location, perms, *, get, live):
     """
     if not perms.can_generate_reports:
         sanic.exceptions.abort(403, "You aren't allowed to generate reports.")
+    if live:
+        jid = await jobs.enqueue(rqst.app, 'report.live', location.lid, uid, {'get': get})
+        return sanic.response.json({'job': jid}, status=202, headers={'Location': f'/api/jobs/{jid}'})
     return sanic.response.json(await location.report(live, **get))
 
 
 @root.get('/reports/last')
+@priority('low')
 @uid_get('location', 'perms')
 async def get_last_report_date(rqst, location, perms):
     """
@@ -110,7 +121,21 @@ async def get_last_report_date(rqst, location, perms):
     return sanic.response.json({'date': r_date and str(r_date)})
 
 
+@root.get('/pickup-shelf')
+@priority('normal')
+@uid_get('location', 'perms')
+@jwtdec.protected()
+async def get_pickup_shelf(rqst, location, perms):
+    """
+    Serves the items set aside for members' holds, and whom for.
+    """
+    if not perms.can_return_items:
+        sanic.exceptions.abort(403, "You aren't allowed to view the pickup shelf.")
+    return sanic.response.json({'items': await location.pickup_shelf()}, status=200)
+
+
 @root.get('/backups/<to_back_up:members|location|roles|holds|items>')
+@priority('low')
 @uid_get('location', 'perms', user=True)
 @jwtdec.protected()
 async def back_up_info(rqst):
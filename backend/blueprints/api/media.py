@@ -2,8 +2,8 @@
 import sanic
 from sanic_jwt import decorators as jwtdec
 
-from . import rqst_get
-from . import User
+from . import rqst_get, priority
+from . import MediaItem, User
 
 media = sanic.Blueprint('media_api', url_prefix='/media')
 
@@ -19,9 +19,11 @@ async def put_item_on_hold(rqst, user, *, item):
         sanic.exceptions.abort(403, "You aren't allowed to place holds.")
     if user.holds > user.limits.holds:
         sanic.exceptions.abort(403, "You aren't allowed to place any more holds.")
-    if not item._issued_uid:
+    if item.held_for == user.uid:
+        sanic.exceptions.abort(409, "This item is already waiting for you to pick up.")
+    if not item._issued_uid and item.held_for is None:
         sanic.exceptions.abort(409, "This item is already available.")
-    err = await user.hold(title=item.title, author=item.author, type_=item.type, genre=item.genre)
+    err = await user.hold(item)
     if err:  # if the user's not allowed to do this then `err` will be a truthy str, otherwise None
         sanic.exceptions.abort(403, err)
     return sanic.response.raw(b'', status=204)
@@ -63,28 +65,32 @@ async def del_item(rqst, user, *, item):
     """
     if not user.perms.can_manage_media:
         sanic.exceptions.abort(403, "You aren't allowed to delete media.")
-    await item.delete()
+    await item.remove()
+    return sanic.response.raw(b'', 204)
 
 
 @media.get('/check')
-@rqst_get('item')
-async def get_item_available(rqst, *, item):
+@priority('high')
+@rqst_get('mid')
+async def get_item_available(rqst, *, mid):
     """
     Could technically handle this 'check' by aborting
     from /check/out if the user doesn't have permissions,
     but this way I can get the frontend to show an explicit
     error before the checkout is actually attempted
+    
+    (Every kiosk scan goes through here, so it's the one query
+    rather than a whole MediaItem)
     """
-    issued_to = None
-    if item.issued_to:
-        issued_to = item.issued_to.username
-    try:
-        return sanic.response.json({'available': item.available, 'issued_to': {'name': issued_to, 'uid': item._issued_uid}}, status=200)
-    except AttributeError:
-        sanic.exceptions.abort(422, "User does not exist.")
+    found = await MediaItem.availability(mid, rqst.app)
+    if found is None:
+        sanic.exceptions.abort(404, 'Item does not exist.')
+    available, uid, username = found
+    return sanic.response.json({'available': available, 'issued_to': {'name': username, 'uid': uid}}, status=200)
 
 
 @media.post('/check/out')
+@priority('high')
 @rqst_get('item', 'username', 'location')
 @jwtdec.protected()
 async def issue_item(rqst, location, username, *, item):
@@ -103,11 +109,14 @@ async def issue_item(rqst, location, username, *, item):
         sanic.exceptions.abort(404, 'Item does not exist.')
     if user.cannot_check_out or not getattr(item.limits, 'checkout_duration', '''NO LIMITS!'''):
         sanic.exceptions.abort(403, "You aren't allowed to check this item out.")
+    if item.held_for is not None and item.held_for != user.uid:
+        sanic.exceptions.abort(409, "This item is on hold for another member.")
     await item.issue_to(user=user)
     return sanic.response.json({'checked': 'out', 'title': item.title, 'author': item.author, 'image': item.image, 'due': str(item.due_date)}, status=200)
 
 
 @media.post('/check/in')
+@priority('high')
 @rqst_get('item', 'username', 'location')
 @jwtdec.protected()
 async def return_item(rqst, location, username, *, item):
@@ -117,6 +126,10 @@ async def return_item(rqst, location, username, *, item):
     to issue_item().
     Instead I have to ask for the username+location of the member
     whose item is being checked in.
+    
+    If someone's waiting on a hold for the item, it's set aside for them
+    then and there, and who it is comes back so the operator knows to put
+    it on the pickup shelf.
     """
     try:
         user = await User.from_identifiers(username, location, app=rqst.app)
@@ -128,11 +141,17 @@ async def return_item(rqst, location, username, *, item):
         sanic.exceptions.abort(403, "You aren't allowed to return this item.")
     if item.fines:
         sanic.exceptions.abort(409, "This item's fines must be paid off before it is returned!")
-    await item.check_in()
-    return sanic.response.raw(b'', status=204)
+    held = await item.check_in()
+    if held is None:
+        return sanic.response.json({'checked': 'in', 'held_for': None}, status=200)
+    return sanic.response.json({
+      'checked': 'in',
+      'held_for': {'uid': held['uid'], 'username': held['username'], 'name': held['fullname'], 'expires': str(held['expires'])}
+      }, status=200)
 
 
 @media.get('/info')
+@priority('normal')
 @rqst_get('item')
 @jwtdec.protected()
 async def get_media_info(rqst, *, item):
@@ -1,9 +1,13 @@
 """/api/member"""
+import functools
+import time
+
 import sanic
 from sanic_jwt import decorators as jwtdec
 
-from . import uid_get, rqst_get
-from . import User
+from . import uid_get, rqst_get, priority
+from . import User, Perms
+from . import events
 
 mbr = sanic.Blueprint('member_api', url_prefix='/member')
 
@@ -20,17 +24,57 @@ async def edit_self(rqst, user, *, fullname, newpass, curpass):
 
 
 @mbr.get('/notifications')
-@rqst_get('location', 'username')
+@priority('normal')
+@rqst_get('lid', 'username')
 @jwtdec.protected()
-async def get_notifs(rqst, location, *, username):
+async def get_notifs(rqst, *, lid, username):
     """
     Serves user's notifications -- overdue items, readied holds, etc.
     """
-    user = await User.from_identifiers(username, location, app=rqst.app)
-    return sanic.response.json(await user.notifs(), status=200)
+    try:
+        notifs = await User.notifs_of(username, lid, app=rqst.app)
+    except (TypeError, ValueError):
+        sanic.exceptions.abort(422, 'Invalid location ID.')
+    if notifs is None:
+        sanic.exceptions.abort(404, 'User does not exist.')
+    return sanic.response.json(notifs, status=200)
+
+
+@mbr.get('/events')
+@rqst_get('user')
+@jwtdec.protected()
+async def stream_events(rqst, user):
+    """
+    Server-sent events: the user's notifications (as from /notifications)
+    straight away, then again every time they change. See backend/events.py.
+    """
+    app = rqst.app
+    
+    async def stream(resp):
+        resp.write(f'retry: {events.RETRY}\n\n')
+        deadline = time.monotonic() + events.MAX_AGE
+        last = None
+        with app.member_events.subscribe(user.uid) as sub:
+            changed = True
+            while not resp.transport.is_closing() and time.monotonic() < deadline:
+                if changed:
+                    notifs = await user.notifs()  # (read fresh every time; see User.notifs())
+                    if notifs != last:
+                        events.send(resp, 'notifications', notifs)
+                        last = notifs
+                else:
+                    resp.write(':\n\n')  # keepalive; also how a closed connection gets noticed
+                changed = await sub.wait(events.KEEPALIVE)
+    
+    return sanic.response.stream(
+      stream,
+      content_type='text/event-stream',
+      headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+      )
 
 
 @mbr.get('/suggest')
+@priority('low')
 @uid_get('location', 'recent')
 @jwtdec.protected()
 async def get_recent(rqst, location, *, recent):
@@ -38,10 +82,11 @@ async def get_recent(rqst, location, *, recent):
     Serves what's shown in the 'based on your most-recent checkout'
     section of the 'Find Media' page, given a genre to match for.
     """
-    return sanic.response.json({'items': await location.search(genre=recent, max_results=2)}, status=200)
+    return sanic.response.raw(b'{"items": %s}' % await location.search(genre=recent, max_results=2), content_type='application/json')
 
 
 @mbr.get('/checked-out')
+@priority('normal')
 @rqst_get('user', 'member')
 @jwtdec.protected()
 async def get_user_items(rqst, user, *, member):
@@ -51,10 +96,11 @@ async def get_user_items(rqst, user, *, member):
     member = await User(member, rqst.app)
     if not user.beats(member, and_has='manage_accounts'):
         sanic.exceptions.abort(403, "You aren't allowed to view this member's items.")
-    return sanic.response.json(await member.items(), status=200)
+    return sanic.response.raw(await member.items(), content_type='application/json')
 
 
 @mbr.get('/held')
+@priority('normal')
 @rqst_get('user', 'member')
 @jwtdec.protected()
 async def get_user_holds(rqst, user, *, member):
@@ -64,7 +110,7 @@ async def get_user_holds(rqst, user, *, member):
     member = await User(member, rqst.app)
     if not user.beats(member, and_has='manage_accounts'):
         sanic.exceptions.abort(403, "You aren't allowed to view this member's holds.")
-    return sanic.response.json(await member.held(), status=200)
+    return sanic.response.raw(await member.held(), content_type='application/json')
 
 
 @mbr.post('/clear-hold')
@@ -92,16 +138,24 @@ async def edit_member(rqst, user, *, member):
     return sanic.response.raw(b'', status=204)
 
 
+def _camel_case(inp):
+    """
+    Converts so I can access perms idiomatically in TypeScript,
+    using TS-conventional camelCase instead of Python snake_case.
+    e.g. perms.can_check_out in Python, but perms.canCheckOut in TS
+    """
+    return 'can' + ''.join(map(str.capitalize, inp.split('_')))
+
+
+@functools.lru_cache(maxsize=None)
+def perms_payload(raw):
+    """What /check-perms serves for a given perms value (memoized; don't mutate it)."""
+    props = Perms(raw).props
+    return {'perms': {**props, 'names': {_camel_case(k): v for k, v in props['names'].items()}}, 'raw': raw}
+
+
 @mbr.get('/check-perms')
 @uid_get('perms')
 @jwtdec.protected()
 async def check_perms(rqst, *, perms):
-    def toCamelCase(inp):
-        """
-        Converts so I can access perms idiomatically in TypeScript,
-        using TS-conventional camelCase instead of Python snake_case.
-        e.g. perms.can_check_out in Python, but perms.canCheckOut in TS
-        """
-        return 'can' + ''.join(map(str.capitalize, inp.split('_')))
-    perms.namemap = {toCamelCase(k): v for k, v in perms.namemap.items()}
-    return sanic.response.json({'perms': perms.props, 'raw': perms.raw}, status=200)
+    return sanic.response.json(perms_payload(perms.raw), status=200)
@@ -2,15 +2,16 @@
 import sanic
 from sanic_jwt import decorators as jwtdec
 
-from . import uid_get, rqst_get
+from . import uid_get, rqst_get, conditional
 from . import Role
 
 roles = sanic.Blueprint('roles_api', url_prefix='/roles')
 
 
 @roles.get('/me')
-@uid_get()
 @jwtdec.protected()
+@conditional('roles', 'members')
+@uid_get()
 async def provide_me_attrs(rqst, user):
     """
     Provides all attributes - permissions, limits, and lock thresholds -
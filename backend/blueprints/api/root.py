@@ -1,25 +1,18 @@
 """/api"""
+import functools
+
 import sanic
 from sanic_jwt import decorators as jwtdec
 
-from . import uid_get
+from . import context, uid_get, conditional
 
 root = sanic.Blueprint('attrs_api', url_prefix='')
 
 
-@root.get('/attrs')
-@uid_get('perms', 'location')
-@jwtdec.protected()
-async def serve_attrs(rqst, perms, location):
-    """
-    Catch-all combination of location-related attributes.
-    """
-    resp = {
-      'types': await location.media_types(),
-      'genres': await location.genres(),
-      'color': location.color,
-      }
-    resp['names'] = {
+@functools.lru_cache(maxsize=None)
+def attr_names(can_manage_location):
+    """Human-readable names of each perm/limit/lock, for the roles pages."""
+    names = {
       'perms': [
         None,  # -- line 42 --
         'Manage accounts (edit names, usernames and passwords)',
@@ -39,11 +32,29 @@ async def serve_attrs(rqst, perms, location):
         'Maximum $USD in fines allowed at a time',
         ]
       }
-    if perms.can_manage_location:  # Don't want to expose these to someone not allowed to modify them
-        resp['names']['perms'][0] = 'Manage location (edit name, info, etc.)'
-        resp['names']['perms'][4] = (
+    if can_manage_location:  # Don't want to expose these to someone not allowed to modify them
+        names['perms'][0] = 'Manage location (edit name, info, etc.)'
+        names['perms'][4] = (
           'Create administrative roles '
           '(ones that can provide other roles with '
           'the "Manage location" permission)'
           )
+    return names
+
+
+@root.get('/attrs')
+@jwtdec.protected()
+@conditional('location', 'mtypes', 'genres', 'roles', 'members')
+@uid_get('perms', 'location')
+async def serve_attrs(rqst, perms, location):
+    """
+    Catch-all combination of location-related attributes.
+    """
+    types, genres = await context.gather(location.media_types(), location.genres())
+    resp = {
+      'types': types,
+      'genres': genres,
+      'color': location.color,
+      'names': attr_names(perms.can_manage_location),
+      }
     return sanic.response.json(resp, status=200)
@@ -1,6 +1,6 @@
 from sanic import Blueprint
 
-from .. import Location, Role, MediaType, MediaItem, User
+from .. import Location, Role, MediaType, MediaItem, User, Perms
 from .. import uid_get, rqst_get
 
 from .buttons import btn
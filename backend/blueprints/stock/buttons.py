@@ -1,13 +1,58 @@
 """/stock/buttons"""
+import functools
+
 import sanic
 import sanic_jwt as jwt
 from sanic_jwt import decorators as jwtdec
 
 from . import uid_get, rqst_get
-from . import Location, Role, MediaType, MediaItem, User
+from . import Location, Role, MediaType, MediaItem, User, Perms
 
 btn = sanic.Blueprint('button_stock', url_prefix='/buttons')
 
+MAIN_HEADER = [{"text": 'home'}, {"text": 'help'}, {"text": 'about'}]
+
+
+# The button sets only depend on a user's perms (and whether they're a
+# checkout account), of which there are only 2**7 combinations, so each
+# one's worked out once and then remembered. (Don't mutate what these return!)
+@functools.lru_cache(maxsize=None)
+def home_sidebar(perms_raw, is_checkout):
+    perms = Perms(perms_raw)
+    buttons = [
+      {"text": 'checkout'},
+    ]
+    if not is_checkout:
+        buttons += [
+          {"text": 'find media', "dest": 'media/search'},
+          {"text": 'my media', "dest": 'dashboard'},
+          {"text": 'my account', "dest": 'account'},
+        ]
+        if perms.can_generate_reports: # self-documenting!
+            buttons.append({"text": 'reports', "color": '#97fb97'})
+        if perms.can_manage_media:
+            buttons.append({"text": 'manage media', "dest": 'media/manage', "color": '#ffcaca'})
+        if any(perms.seq[:5]):
+            # if has any of the following permissions:
+            # Manage Location Info, Manage Accounts, Manage Roles,
+            # Create Administrative Roles, Manage Media
+            buttons.append({"text": 'manage location', "dest": 'manage', "color": '#ffcaca'})
+    return buttons
+
+
+@functools.lru_cache(maxsize=None)
+def mgmt_header(perms_raw):
+    perms = Perms(perms_raw)
+    buttons = []
+    if perms.can_manage_location:
+        buttons.append({"text": 'location info', "dest": 'location'})
+    if perms.can_manage_accounts:
+        buttons.append({"text": 'accounts', "dest": 'accounts'})
+    if perms.can_manage_roles:
+        buttons.append({"text": 'roles and permissions', "dest": 'roles'})
+    return buttons
+
+
 @btn.get('/main-header')
 async def expose_header_buttons(rqst):
     """
@@ -19,7 +64,7 @@ async def expose_header_buttons(rqst):
     
     Requires nothing from client, as it's static.
     """
-    buttons = [{"text": 'home'}, {"text": 'help'}, {"text": 'about'}]
+    buttons = MAIN_HEADER
     # dest on home should not be necessary, but for some reason Angular
     # isn't picking up the redirect I've tried to place on the router
     # from '/home' to '/'... so instead it says
@@ -56,25 +101,7 @@ async def expose_home_sidebar_buttons(rqst, user):
     
     Requires current session's Role ID from client.
     """
-    buttons = [
-      {"text": 'checkout'},
-    ]
-    if not user.is_checkout:
-        buttons += [
-          {"text": 'find media', "dest": 'media/search'},
-          {"text": 'my media', "dest": 'dashboard'},
-          {"text": 'my account', "dest": 'account'},
-        ]
-        if user.perms.can_generate_reports: # self-documenting!
-            buttons.append({"text": 'reports', "color": '#97fb97'})
-        if user.perms.can_manage_media:
-            buttons.append({"text": 'manage media', "dest": 'media/manage', "color": '#ffcaca'})
-        if any(user.perms.seq[:5]):
-            # if has any of the following permissions:
-            # Manage Location Info, Manage Accounts, Manage Roles,
-            # Create Administrative Roles, Manage Media
-            buttons.append({"text": 'manage location', "dest": 'manage', "color": '#ffcaca'})
-    return sanic.response.json({'buttons': buttons}, status=200)
+    return sanic.response.json({'buttons': home_sidebar(user.perms.raw, user.is_checkout)}, status=200)
 
 @btn.get('/mgmt-header')
 @uid_get()
@@ -94,11 +121,4 @@ async def expose_management_buttons(rqst, user):
     """
     if user.is_checkout:
         sanic.exceptions.abort(400, 'Only available to non-checkout accounts')
-    buttons = []
-    if user.perms.can_manage_location:
-        buttons.append({"text": 'location info', "dest": 'location'})
-    if user.perms.can_manage_accounts:
-        buttons.append({"text": 'accounts', "dest": 'accounts'})
-    if user.perms.can_manage_roles:
-        buttons.append({"text": 'roles and permissions', "dest": 'roles'})
-    return sanic.response.json({'buttons': buttons}, status=200)
+    return sanic.response.json({'buttons': mgmt_header(user.perms.raw)}, status=200)
@@ -0,0 +1,122 @@
+"""
+Cross-worker cache invalidation, over Postgres LISTEN/NOTIFY.
+
+Every worker process keeps its own in-memory caches (the refresh-token
+cache, the version counters in versions.py, and so on), so when one of
+them changes something, the rest have to be told to drop their copies.
+They're told by way of small typed messages, as in
+
+    app.bus.publish('versions', lid, 'genres', 7)  # lid's genres are at version 7
+    app.bus.publish('rtoken', uid, token)           # session was revoked
+
+Publishing is fire-and-forget: messages are queued up and sent a few
+milliseconds later, all together in as few NOTIFYs as will fit, and on
+the receiving end duplicates within a burst are applied only once. Only
+exact duplicates, mind: a burst of version bumps carries a different
+number each time, so every one of those is still applied (see
+versions.py for why that matters).
+Whoever publishes a message is expected to have applied it locally
+already, so workers ignore their own.
+"""
+import json
+import os
+import time
+import uuid
+
+CHANNEL = 'booksy_invalidate'
+MAX_PAYLOAD = 7900  # Postgres caps NOTIFY payloads at 8000 bytes
+
+# Message kinds, and what the key that comes with each one is
+KINDS = {
+  'versions': '[lid, kind, version]; see versions.py',
+  'rtoken': '[uid or refresh token]; drops it from app.rtoken_cache',
+  }
+
+
+class InvalidationBus:
+    """
+    origin  (str):   Unique to this worker; stamped on what it publishes
+    delay   (float): How long (s) to hold messages for, to batch them up
+    lag     (dict):  Delay between a message being published elsewhere and
+                     being applied here, in seconds: count/total/last/max
+    """
+    def __init__(self, app, *, delay=0.01):
+        self._app = app
+        self.origin = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self.delay = delay
+        self.handlers = {}
+        self.lag = {'count': 0, 'total': 0.0, 'last': 0.0, 'max': 0.0}
+        self.sent = self.received = self.applied = 0
+        self._outbox = []
+        self._inbox = {}  # (kind, key) -> earliest publish time, for coalescing
+        self._send_handle = self._apply_handle = None
+    
+    def on(self, kind, handler):
+        """
+        Registers handler(*key) to be called for every (coalesced)
+        message of `kind` published by another worker.
+        """
+        if kind not in KINDS:
+            raise ValueError(f'unknown invalidation message kind {kind!r}')
+        self.handlers[kind] = handler
+    
+    async def listen(self, conn):
+        """Starts receiving messages on a dedicated connection."""
+        await conn.add_listener(CHANNEL, self._on_notify)
+    
+    def publish(self, kind, *key):
+        """Queues a message for every other worker."""
+        if kind not in KINDS:
+            raise ValueError(f'unknown invalidation message kind {kind!r}')
+        self._outbox.append((kind, key))
+        if self._send_handle is None:
+            self._send_handle = self._app.loop.call_later(self.delay, self._flush_outbox)
+    
+    def _flush_outbox(self):
+        self._send_handle = None
+        messages, self._outbox = list(dict.fromkeys(self._outbox)), []  # dedupe, keeping order
+        payloads, batch = [], []
+        for message in messages:
+            batch.append(message)
+            if len(self._encode(batch)) > MAX_PAYLOAD and len(batch) > 1:
+                payloads.append(self._encode(batch[:-1]))
+                batch = batch[-1:]
+        if batch:
+            payloads.append(self._encode(batch))
+        self._app.loop.create_task(self._send(payloads))
+    
+    def _encode(self, batch):
+        messages = [[kind, *key] for kind, key in batch]
+        return json.dumps({'o': self.origin, 't': time.time(), 'm': messages})
+    
+    async def _send(self, payloads):
+        async with self._app.pg_pool.acquire() as conn:
+            for payload in payloads:
+                await conn.execute('''SELECT pg_notify($1::text, $2::text)''', CHANNEL, payload)
+                self.sent += 1
+    
+    def _on_notify(self, conn, pid, channel, payload):
+        msg = json.loads(payload)
+        if msg['o'] == self.origin:
+            return
+        self.received += 1
+        for kind, *key in msg['m']:
+            key = tuple(key)
+            self._inbox[kind, key] = min(msg['t'], self._inbox.get((kind, key), msg['t']))
+        if self._apply_handle is None:
+            self._apply_handle = self._app.loop.call_later(self.delay, self._flush_inbox)
+    
+    def _flush_inbox(self):
+        self._apply_handle = None
+        inbox, self._inbox = self._inbox, {}
+        now = time.time()
+        for (kind, key), published in inbox.items():
+            handler = self.handlers.get(kind)
+            if handler is not None:
+                handler(*key)
+                self.applied += 1
+            lag = max(now - published, 0.0)
+            self.lag['count'] += 1
+            self.lag['total'] += lag
+            self.lag['last'] = lag
+            self.lag['max'] = max(self.lag['max'], lag)
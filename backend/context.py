@@ -0,0 +1,106 @@
+"""
+Per-request state that has to be reachable from places that never see
+the request itself -- mainly the DB pool (see pool.py), so that every
+query the typedef classes make can be charged to the request it was
+made for.
+
+Sanic handles each request in its own asyncio task (middleware and all),
+so the state's just stored against the current task. Python 3.6 has no
+contextvars, hence doing it by hand -- which also means tasks a handler
+starts don't get its context by themselves; gather() below sees to that.
+"""
+import asyncio
+import time
+import weakref
+
+try:
+    _current_task = asyncio.current_task
+except AttributeError:  # python < 3.7
+    _current_task = asyncio.Task.current_task
+
+_contexts = weakref.WeakKeyDictionary()
+
+# Most tasks (so pool connections) a single request can have going at
+# once through gather(), counting its own
+FANOUT = 3
+
+
+class RequestContext:
+    """
+    route        (str):   Path the request was made to
+    started      (float): perf_counter() when the request came in
+    queries      (int):   DB round trips made so far
+    query_time   (float): Total time (s) spent waiting on them
+    acquires     (int):   Connections acquired from the pool so far
+    acquire_wait (float): Total time (s) spent waiting for said connections
+    lid          (int):   Location the request's for, once known; see fairpool.py
+    spare        (int):   How many more tasks gather() can start for it right now
+    """
+    __slots__ = 'route', 'started', 'queries', 'query_time', 'acquires', 'acquire_wait', 'lid', 'spare'
+    
+    def __init__(self, route):
+        self.route = route
+        self.started = time.perf_counter()
+        self.queries = self.acquires = 0
+        self.query_time = self.acquire_wait = 0.0
+        self.lid = None
+        self.spare = FANOUT - 1
+
+
+def current():
+    """The context of the request currently being handled, or None."""
+    try:
+        task = _current_task()
+    except RuntimeError:  # no event loop running
+        return None
+    return None if task is None else _contexts.get(task)
+
+
+def bind(ctx, task=None):
+    """Attaches ctx to `task` (default: the current one)."""
+    _contexts[task or _current_task()] = ctx
+    return ctx
+
+
+def set_lid(lid):
+    """Notes down which location the current request's for, if there is one."""
+    ctx = current()
+    if ctx is not None and lid is not None:
+        ctx.lid = lid
+
+
+async def gather(*coros):
+    """
+    asyncio.gather() for independent lookups made while handling a
+    request, returning a list of their results in order. Each one that
+    gets a task of its own carries the request's context along (so its
+    queries are counted and fairly scheduled like the rest), and no more
+    than FANOUT run at once over the whole request, so one request can't
+    take over the pool. Whatever doesn't get a task -- because the
+    request's already at its limit, say from an outer gather() -- is just
+    run by the calling task itself, one after another, rather than
+    waiting for a task to free up (which could mean waiting on itself).
+    
+    If any of them fails, the others are cancelled.
+    """
+    ctx = current()
+    if ctx is None:  # not in a request; nothing to carry or limit
+        return list(await asyncio.gather(*coros))
+    n = max(0, min(ctx.spare, len(coros) - 1))  # the calling task takes one itself
+    ctx.spare -= n
+    tasks = [asyncio.ensure_future(coro) for coro in coros[:n]]
+    for task in tasks:
+        bind(ctx, task)  # before it's had a chance to start
+    rest = iter(coros[n:])
+    try:
+        inline = [await coro for coro in rest]
+        return [*await asyncio.gather(*tasks), *inline]
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        for coro in rest:  # never started
+            coro.close()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    finally:
+        ctx.spare += n
@@ -2,8 +2,18 @@
 Base classes & core functions for the rest to inherit or inherit from.
 """
 import abc
+import copy
 import struct
 from abc import abstractmethod
+from types import SimpleNamespace
+
+from .singleflight import SingleFlight
+
+# Every AsyncInit subclass registers itself here by name as it's defined
+# (see AsyncInit.__init_subclass__() below), so the typedef classes can
+# refer to one another as `typedefs.User` and so on at call time, instead
+# of importing each other circularly at the top of their files
+typedefs = SimpleNamespace()
 
 
 class AsyncInit:
@@ -13,11 +23,36 @@ class AsyncInit:
     
     (Vital to everything!)
     """
+    # Set by subclasses that only read from the DB when constructed, so
+    # that constructing the same one (by ID) more than once at the same
+    # time only looks it up the once; see singleflight.py
+    coalesce = False
+    
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        setattr(typedefs, cls.__name__, cls)
+        if cls.coalesce:
+            cls._flights = SingleFlight(cls.__name__)
+    
     async def __new__(cls, *args, **kwargs):
+        # (there's only ever the one app, so it's not part of the key)
+        if cls.coalesce and args and not kwargs.keys() - {'app'}:
+            # Everyone gets a copy of their own, since some go on to change theirs
+            return copy.copy(await cls._flights.do(str(args[0]), lambda: cls._create(*args, **kwargs)))
+        return await cls._create(*args, **kwargs)
+    
+    @classmethod
+    async def _create(cls, *args, **kwargs):
         obj = super().__new__(cls)
         await obj.__init__(*args, **kwargs)
         return obj
     
+    def __copy__(self):
+        # (copy.copy()'s default would go through the async __new__)
+        obj = object.__new__(type(self))
+        obj.__dict__.update(self.__dict__)
+        return obj
+    
     async def __init__(self):
         pass
 
@@ -1,8 +1,25 @@
+import hmac
+import math
 from functools import wraps
 
 import sanic
 
+from . import context, metrics, overload, ratelimit, sessions, static
 from .typedef import Location, Role, MediaItem, User
+from .versions import PRIVATE
+
+
+async def uid_from_rqst(rqst):
+    """
+    Gets the user ID attached to a session from its refresh token, via
+    the app's running refresh-token cache (or, failing that, Redis).
+    See user_from_rqst() below.
+    """
+    rtoken = rqst.app.auth._get_refresh_token(rqst)
+    try:
+        return rqst.app.rtoken_cache[rtoken]
+    except KeyError:
+        return await sessions.fetch(rqst.app, rtoken)
 
 
 async def user_from_rqst(rqst):
@@ -24,13 +41,153 @@ async def user_from_rqst(rqst):
     end and back-end only, and if a token doesn't exist in the in-memory
     cache it'll fetch it from the redis db
     """
-    rtoken = rqst.app.auth._get_refresh_token(rqst)
+    uid = await uid_from_rqst(rqst)
+    # Queue the lookup itself as the user's location's if it's already
+    # known, so it's fairly scheduled too (see fairpool.py)
     try:
-        uid = rqst.app.rtoken_cache[rtoken]
+        context.set_lid(rqst.app.versions.owners.get(int(uid)))
+    except (TypeError, ValueError):
+        pass
+    user = await User(uid, rqst.app)
+    rqst.app.versions.owners[user.uid] = user.lid  # see conditional() below
+    context.set_lid(user.lid)
+    return user
+
+
+async def lid_from_rqst(rqst):
+    """
+    The location of the user attached to a session, without going to
+    the DB if their location's already known (see conditional() below).
+    """
+    uid = int(await uid_from_rqst(rqst))
+    try:
+        lid = rqst.app.versions.owners[uid]
     except KeyError:
-        async with rqst.app.rd_pool.get() as conn:
-            rqst.app.rtoken_cache[rtoken] = uid = await conn.execute('get', rtoken)
-    return await User(uid, rqst.app)
+        return (await user_from_rqst(rqst)).lid
+    context.set_lid(lid)
+    return lid
+
+
+def rate_limited(cls, *, only_if=None):
+    """
+    Puts an endpoint under its location's (or session's) rate limit for
+    `cls` (see ratelimit.py), answering with a 429 once that's used up. Goes above
+    @uid_get()/@rqst_get() so that a limited request never gets as far
+    as the DB.
+    
+    only_if, if given, is called with the request to decide whether
+    it counts, e.g. so only live reports are limited.
+    """
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(rqst, *args, **kwargs):
+            if only_if is None or only_if(rqst):
+                try:
+                    lid = await lid_from_rqst(rqst)
+                except (KeyError, TypeError, ValueError):
+                    # not logged in; let the handler deal with it
+                    return await func(rqst, *args, **kwargs)
+                wait = await rqst.app.limiter.take(lid, cls, rqst.app.auth._get_refresh_token(rqst))
+                if wait:
+                    metrics.RATE_LIMITED.inc(cls)
+                    return sanic.response.text(
+                      "Error: You're making too many of these requests. Please try again shortly."
+                      if cls in ratelimit.PER_SESSION else
+                      "Error: Your library's making too many of these requests. Please try again shortly.",
+                      status=429,
+                      headers={'Retry-After': str(math.ceil(wait))}
+                      )
+            return await func(rqst, *args, **kwargs)
+        return wrapper
+    
+    return decorator
+
+
+def priority(level):
+    """
+    Declares how important an endpoint is -- 'low', 'normal' or 'high'
+    -- for when the server's overloaded and requests have to start being
+    turned away (see overload.py). Goes above everything else, so that
+    shedding a request costs next to nothing.
+    """
+    if level not in overload.SHED_AT:
+        raise ValueError(f'Unknown priority {level!r}')
+    
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(rqst, *args, **kwargs):
+            controller = getattr(rqst.app, 'overload', None)
+            if controller is not None and controller.sheds(level):
+                metrics.SHED.inc(level)
+                return sanic.response.text(
+                  "Error: The server's too busy right now. Please try again shortly.",
+                  status=503,
+                  headers={'Retry-After': str(math.ceil(overload.COOLDOWN))}
+                  )
+            return await func(rqst, *args, **kwargs)
+        return wrapper
+    
+    return decorator
+
+
+def admin_only(func):
+    """
+    For endpoints meant for whoever's running the server (me), not for
+    any location's admins: requires an `Authorization: Bearer <token>`
+    header matching the ADMIN_TOKEN config var. If that isn't set, the
+    endpoint's just off.
+    """
+    @wraps(func)
+    async def wrapper(rqst, *args, **kwargs):
+        token = rqst.app.config.get('ADMIN_TOKEN')
+        given = rqst.headers.get('Authorization', '')
+        if not token or not hmac.compare_digest(given.encode(), f'Bearer {token}'.encode()):
+            sanic.exceptions.abort(403, 'Forbidden.')
+        return await func(rqst, *args, **kwargs)
+    return wrapper
+
+
+def conditional(*kinds, per_user=True):
+    """
+    Adds ETags to a read-mostly endpoint's responses, built from the
+    current version of each kind of data (see versions.py) that the
+    endpoint serves, and answers a matching If-None-Match with a 304
+    before the handler -- and so the DB -- is ever touched.
+    
+    Has to go above @uid_get()/@rqst_get() for that reason, but below
+    @jwtdec.protected(), so that a replayed ETag can't tell someone who
+    isn't logged in whether the data's changed.
+    
+    If per_user is True, the tag is also tied to the requesting user
+    and their location; otherwise the data's assumed to be global.
+    """
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(rqst, *args, **kwargs):
+            versions = rqst.app.versions
+            uid = lid = 0
+            if per_user:
+                try:
+                    uid = int(await uid_from_rqst(rqst))
+                except (KeyError, TypeError, ValueError):
+                    # not logged in; let the handler deal with it
+                    return await func(rqst, *args, **kwargs)
+                lid = versions.owners.get(uid)
+            if lid is not None:
+                etag = versions.etag(lid, kinds, uid)
+                if etag in static.if_none_match(rqst):
+                    return sanic.response.raw(b'', status=304, headers={'ETag': etag, 'Cache-Control': PRIVATE})
+            clock = versions.clock
+            resp = await func(rqst, *args, **kwargs)
+            # Only tag the response if nothing changed while it was being
+            # built, else the tag could claim newer data than it has
+            if resp.status == 200 and versions.clock == clock and (not per_user or uid in versions.owners):
+                resp.headers['ETag'] = versions.etag(versions.owners.get(uid, lid), kinds, uid)
+                resp.headers['Cache-Control'] = PRIVATE
+            return resp
+        return wrapper
+    
+    return decorator
 
 
 def uid_get(*attrs, user=False):
@@ -57,6 +214,19 @@ def uid_get(*attrs, user=False):
     return decorator
 
 
+async def _lookup(cls, id_, app):
+    """
+    One of rqst_get()'s objects, with the errors from a bad ID turned into
+    the responses they'd get.
+    """
+    try:
+        return await cls(id_, app)
+    except KeyError:
+        sanic.exceptions.abort(422, 'Missing required attributes.')
+    except TypeError as obj:
+        sanic.exceptions.abort(404, f'{str(obj)[0].upper()+str(obj)[1:]} does not exist.')
+
+
 def rqst_get(*attrs, user=False, form=False, files=None):
     """
     Grabs the pertinent key from a request, and, if matching
@@ -84,16 +254,27 @@ def rqst_get(*attrs, user=False, form=False, files=None):
         async def wrapper(rqst, *args, **kwargs):
             maps = {'item': (MediaItem, 'mid'), 'location': (Location, 'lid'), 'role': (Role, 'rid')}
             container = rqst.raw_args if rqst.method == 'GET' else rqst.form if form else rqst.json
+            # The objects (and the user) don't depend on one another, so
+            # they're all looked up at once rather than one by one
+            objs = [i for i in attrs if i in maps]
             try:
-                vals = {i: await maps[i][0](container[maps[i][1]], rqst.app) if i in maps else None if i == 'null' else container[i] for i in attrs}
+                vals = {i: None if i == 'null' else container[i] for i in attrs if i not in maps}
+                ids = [container[maps[i][1]] for i in objs]
             except KeyError:
                 sanic.exceptions.abort(422, 'Missing required attributes.')
             except TypeError as obj:
                 sanic.exceptions.abort(404, f'{str(obj)[0].upper()+str(obj)[1:]} does not exist.')
+            # (each object's errors are turned into 422s/404s by _lookup(), but
+            # the user's are left alone, as they were before these were gathered)
+            lookups = [_lookup(maps[i][0], id_, rqst.app) for i, id_ in zip(objs, ids)]
+            if user:
+                lookups.append(user_from_rqst(rqst))
+            found = await context.gather(*lookups)
+            vals.update(zip(objs, found))
             if form:
                 vals = {k: v[0] if isinstance(v, list) and len(v) == 1 else v for k, v in vals.items()}
             if user:
-                vals['user'] = await user_from_rqst(rqst)
+                vals['user'] = found[-1]
             if files:
                 for name in files:
                     vals[name] = rqst.files.get(name, None)
@@ -1,8 +1,6 @@
 import os
 from email.mime.text import MIMEText
 
-import aiosmtplib
-
 BODY = '''
 Hello, {name}!
 
@@ -20,6 +18,7 @@ async def send_email(recipient, fullname, locname, token, *, loop):
     Constructs a verification email to send to the aspiring admin of a
     new library.
     """
+    import aiosmtplib  # only needed on the rare occasion someone signs up
     msg = MIMEText(BODY.format(name=fullname, locname=locname, token=token))
     msg['From'] = SENDER
     msg['To'] = recipient
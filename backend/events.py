@@ -0,0 +1,93 @@
+"""
+Pushes members' notifications to them as they change, over server-sent
+events (/api/member/events), instead of the client polling
+/api/member/notifications for them.
+
+Postgres does the noticing: triggers on items and holds (see
+0004_member_events.sql) NOTIFY booksy_member_events with the uIDs of
+whoever a checkout, check-in, fines update or hold just affected, from
+whichever process made the change -- a web worker, worker.py or
+scheduled_updates.py, which also sends the ones for items going
+overdue. Each web worker has one MemberEvents listening for those,
+which wakes up the streams open for just those members; each of them
+then rebuilds its member's notifications, and only sends them if they
+came out different. So a member who's only sitting there with the
+page open costs an idle coroutine and a keepalive every KEEPALIVE
+seconds, and no queries at all.
+
+Streams are closed after MAX_AGE, so that they're re-authenticated every
+so often (EventSource reconnects by itself, with the session cookie).
+"""
+import asyncio
+import json
+from collections import defaultdict
+
+from . import metrics
+
+CHANNEL = 'booksy_member_events'
+KEEPALIVE = 20.0  # s; comfortably under Heroku's 55s idle-connection timeout
+MAX_AGE = 15 * 60  # s
+RETRY = 5000  # ms; how long EventSource waits before reconnecting
+
+
+class _Subscription:
+    """One open stream's interest in one member."""
+    __slots__ = 'uid', 'changed', '_events'
+    
+    def __init__(self, events, uid):
+        self._events = events
+        self.uid = uid
+        self.changed = asyncio.Event()
+    
+    def __enter__(self):
+        self._events._subs[self.uid].add(self)
+        metrics.SSE_STREAMS.inc()
+        return self
+    
+    def __exit__(self, *exc):
+        subs = self._events._subs[self.uid]
+        subs.discard(self)
+        if not subs:
+            del self._events._subs[self.uid]
+        metrics.SSE_STREAMS.dec()
+    
+    async def wait(self, timeout):
+        """Whether the member's notifications might have changed in the next `timeout` s."""
+        try:
+            await asyncio.wait_for(self.changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self.changed.clear()
+        return True
+
+
+class MemberEvents:
+    def __init__(self, app):
+        self._app = app
+        self._subs = defaultdict(set)  # uid -> its _Subscriptions
+    
+    async def listen(self, conn):
+        await conn.add_listener(CHANNEL, self._on_notify)
+    
+    def subscribe(self, uid):
+        """with events.subscribe(uid) as sub: ... await sub.wait(timeout)"""
+        return _Subscription(self, uid)
+    
+    def wake_all(self):
+        """Tells every open stream to rebuild, e.g. after missing NOTIFYs."""
+        for subs in self._subs.values():
+            for sub in subs:
+                sub.changed.set()
+    
+    def _on_notify(self, conn, pid, channel, payload):
+        for uid in payload.split(','):
+            # (not `self._subs[int(uid)]`, which would leave an empty set behind)
+            for sub in self._subs.get(int(uid), ()):
+                sub.changed.set()
+                metrics.SSE_WAKEUPS.inc()
+
+
+def send(resp, event, data):
+    """Writes an event down a (streaming) response."""
+    resp.write(f'event: {event}\ndata: {json.dumps(data)}\n\n')
+    metrics.SSE_SENT.inc()
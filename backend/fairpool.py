@@ -0,0 +1,236 @@
+"""
+Fair sharing of the Postgres pool between locations.
+
+Every location goes through the one pool, and asyncpg hands its
+connections out first-come-first-served -- so a big district with a
+few hundred kiosks going at once can keep it drained, and a small
+library's checkouts end up queued behind all of them. FairScheduler sits
+in front of the pool (see pool.py) and decides who gets the next free
+connection instead:
+
+  - Each location has its own queue, and the queues are served by
+    start-time fair queueing: every acquisition is tagged with a virtual
+    start time of max(now, when that location's previous one finished),
+    where each one "takes" 1/weight, and the smallest tag goes next. A
+    location that's asked for a lot recently has tags far in the future,
+    so one that's asked for little gets to go ahead of it; and while
+    nobody else is waiting, anyone can have every connection.
+  - No one location can hold more than `cap` connections at a time, so
+    there are always some left over for everyone else.
+
+Which location an acquisition's for comes from the request it's made
+during (see context.py; it's filled in once the user's known, in
+deco.py). Anything else -- logging in, the bus, background jobs -- all
+goes down as location None, which is scheduled like any other but never
+capped.
+
+Time an acquisition spends queued only because its own location's at
+its cap isn't held against the pool: enter() returns how much of its
+wait that was, and oldest_wait() leaves it out, so that one location
+saturating its share doesn't look like the whole pool's overloaded (see
+overload.py) and get everyone else's requests shed.
+
+Weights default to 1 and can be set per location with PG_TENANT_WEIGHTS,
+e.g. '{"12": 3}' for location 12 to get three times the share; the cap
+is PG_TENANT_CAP, by default two thirds of the pool. PG_FAIR_POOL=0 turns
+the whole thing off and leaves it to asyncpg again.
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import time
+from collections import deque
+
+from . import metrics
+
+
+class _Tenant:
+    """
+    lid      (int):   Location ID, or None for anything outside a request
+    weight   (float): Share relative to the default of 1
+    active   (int):   Connections it's holding right now
+    waiters  (deque): Its queued acquisitions, oldest first
+    finish   (float): Virtual finish time of its last acquisition
+    queued   (bool):  Whether it's in FairScheduler._ready
+    granted  (int):   Acquisitions so far
+    waited   (float): Total time (s) they spent queued
+    max_wait (float): Longest time (s) any of them spent queued
+    capped   (float): Total time (s) it's spent at its cap, as of capped_since
+    capped_since (float): When it last reached its cap, if it's there now
+    """
+    __slots__ = 'lid', 'weight', 'active', 'waiters', 'finish', 'queued', 'granted', 'waited', 'max_wait', 'capped', 'capped_since'
+    
+    def __init__(self, lid, weight):
+        self.lid = lid
+        self.weight = weight
+        self.active = self.granted = 0
+        self.waiters = deque()
+        self.finish = self.waited = self.max_wait = self.capped = 0.0
+        self.queued = False
+        self.capped_since = None
+    
+    def capped_at(self, now):
+        """Total time (s) it's spent at its cap, as of `now`."""
+        return self.capped if self.capped_since is None else self.capped + now - self.capped_since
+
+
+class _Waiter:
+    __slots__ = 'start', 'future', 'since', 'capped'
+    
+    def __init__(self, start, future, tenant):
+        self.start = start
+        self.future = future
+        self.since = time.perf_counter()
+        self.capped = tenant.capped_at(self.since)
+    
+    def waits(self, tenant, now):
+        """(time queued, of which only for tenant's cap) as of `now`."""
+        return now - self.since, tenant.capped_at(now) - self.capped
+
+
+class FairScheduler:
+    """
+    slots   (int):  Connections to hand out at once, i.e. the pool's max_size
+    cap     (int):  Most any one location can hold at once (default: all of them)
+    weights (dict): lid -> share relative to the default of 1
+    """
+    def __init__(self, slots, *, cap=None, weights=None, loop=None):
+        self.slots = slots
+        self.cap = min(cap or slots, slots)
+        self.weights = weights or {}
+        self.in_use = 0
+        self.vtime = 0.0
+        self._tenants = {}
+        self._ready = []  # heap of (start tag of first waiter, seq, tenant), for tenants under their cap
+        self._seq = itertools.count()
+        self._loop = loop
+    
+    @classmethod
+    def from_config(cls, config, slots, *, loop=None):
+        weights = json.loads(config.get('PG_TENANT_WEIGHTS') or '{}')
+        return cls(
+          slots,
+          cap=int(config.get('PG_TENANT_CAP') or 0) or max(1, slots * 2 // 3),
+          weights={int(lid): float(weight) for lid, weight in weights.items()},
+          loop=loop
+          )
+    
+    def _tenant(self, lid):
+        try:
+            return self._tenants[lid]
+        except KeyError:
+            tenant = self._tenants[lid] = _Tenant(lid, self.weights.get(lid, 1))
+            return tenant
+    
+    def _capped(self, tenant):
+        return tenant.lid is not None and tenant.active >= self.cap
+    
+    def _tag(self, tenant):
+        start = max(self.vtime, tenant.finish)
+        tenant.finish = start + 1 / tenant.weight
+        return start
+    
+    def _push(self, tenant):
+        if tenant.waiters and not tenant.queued and not self._capped(tenant):
+            heapq.heappush(self._ready, (tenant.waiters[0].start, next(self._seq), tenant))
+            tenant.queued = True
+    
+    def _grant(self, tenant, wait, capped=0.0):
+        self.in_use += 1
+        tenant.active += 1
+        tenant.granted += 1
+        tenant.waited += wait
+        tenant.max_wait = max(tenant.max_wait, wait)
+        if self._capped(tenant) and tenant.capped_since is None:
+            tenant.capped_since = time.perf_counter()
+        metrics.PG_FAIR_WAIT.observe(wait - capped)
+    
+    def _dispatch(self):
+        while self.in_use < self.slots and self._ready:
+            _, _, tenant = heapq.heappop(self._ready)
+            tenant.queued = False
+            if self._capped(tenant):
+                continue  # pushed again once it lets one go
+            while tenant.waiters and tenant.waiters[0].future.done():
+                tenant.waiters.popleft()  # cancelled; enter() deals with the rest
+            if not tenant.waiters:
+                continue
+            waiter = tenant.waiters.popleft()
+            metrics.PG_FAIR_QUEUED.dec()
+            self.vtime = waiter.start
+            wait, capped = waiter.waits(tenant, time.perf_counter())
+            self._grant(tenant, wait, capped)
+            waiter.future.set_result(capped)
+            self._push(tenant)
+    
+    async def enter(self, lid):
+        """
+        Waits for lid's turn at a connection. Must be followed by leave(lid).
+        Returns how long (s) it was kept waiting by lid's own cap alone.
+        """
+        tenant = self._tenant(lid)
+        if self.in_use < self.slots:
+            if not self._ready and not tenant.waiters and not self._capped(tenant):
+                self.vtime = self._tag(tenant)
+                self._grant(tenant, 0.0)
+                return 0.0
+            if self._capped(tenant):
+                metrics.PG_FAIR_CAPPED.inc()
+        waiter = _Waiter(self._tag(tenant), (self._loop or asyncio.get_event_loop()).create_future(), tenant)
+        tenant.waiters.append(waiter)
+        metrics.PG_FAIR_QUEUED.inc()
+        self._push(tenant)
+        self._dispatch()
+        try:
+            return await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.leave(lid)  # was let in just as it gave up
+            else:
+                try:
+                    tenant.waiters.remove(waiter)
+                except ValueError:  # already thrown out by _dispatch()
+                    pass
+                metrics.PG_FAIR_QUEUED.dec()
+            raise
+    
+    def leave(self, lid):
+        tenant = self._tenants[lid]
+        self.in_use -= 1
+        tenant.active -= 1
+        if tenant.capped_since is not None and not self._capped(tenant):
+            tenant.capped, tenant.capped_since = tenant.capped_at(time.perf_counter()), None
+        self._push(tenant)  # might be back under its cap now
+        self._dispatch()
+    
+    def oldest_wait(self):
+        """
+        How long (s) the longest-queued acquisition has been waiting for a
+        connection, leaving out any time it was only waiting on its cap.
+        """
+        now = time.perf_counter()
+        return max((wait - capped for wait, capped in (t.waiters[0].waits(t, now) for t in self._tenants.values() if t.waiters)), default=0.0)
+    
+    def dump(self, top=25):
+        """The state of things, plus the `top` locations that've waited longest in total."""
+        tenants = sorted(self._tenants.values(), key=lambda t: t.waited, reverse=True)[:top]
+        return {
+          'slots': self.slots,
+          'cap': self.cap,
+          'in_use': self.in_use,
+          'queued': sum(len(t.waiters) for t in self._tenants.values()),
+          'tenants': [
+            {
+              'lid': t.lid,
+              'weight': t.weight,
+              'active': t.active,
+              'queued': len(t.waiters),
+              'granted': t.granted,
+              'mean_wait_ms': t.waited / t.granted * 1000 if t.granted else 0.0,
+              'max_wait_ms': t.max_wait * 1000,
+              }
+            for t in tenants
+            ],
+          }
+
@@ -0,0 +1,49 @@
+"""
+In-memory copy of the help articles.
+
+They only ever change when I edit them with help-edit.py, which sends a
+NOTIFY on the `help` channel with the edited article's ID whenever it
+saves one; every worker LISTENs for that and reloads just that article
+(or all of them, if the payload's empty). So in steady state the help
+endpoints never have to touch the DB at all.
+"""
+CHANNEL = 'help'
+
+
+class HelpCache:
+    """
+    articles (dict): ID -> {'id', 'title', 'brief', 'content'}
+    titles   (list): [{'id', 'title'}, ...], as served by /api/help/titles
+    """
+    def __init__(self, app):
+        self._app = app
+        self.articles = {}
+        self.titles = []
+    
+    def __contains__(self, ID):
+        return ID in self.articles
+    
+    def __getitem__(self, ID):
+        return self.articles[ID]
+    
+    async def load(self, ID=None):
+        """
+        (Re)loads article ID from the DB, or all of them if ID is None.
+        """
+        if ID is None:
+            rows = await self._app.pg_pool.fetch('''SELECT id, title, brief, content FROM help''')
+            self.articles = {}
+        else:
+            rows = await self._app.pg_pool.fetch('''SELECT id, title, brief, content FROM help WHERE id = $1::bigint''', ID)
+            self.articles.pop(ID, None)  # in case it was deleted
+        self.articles.update({i['id']: dict(i) for i in rows})
+        self.titles = [{'id': i['id'], 'title': i['title']} for i in sorted(self.articles.values(), key=lambda a: a['id'])]
+        self._app.versions.bump(0, 'help', publish=False)  # every worker reloads on its own
+    
+    async def listen(self, conn):
+        """Subscribes to help-edit.py's notifications on `conn`."""
+        await conn.add_listener(CHANNEL, self._on_notify)
+    
+    def _on_notify(self, conn, pid, channel, payload):
+        # asyncpg listener callbacks can't be coroutines, hence the task
+        self._app.loop.create_task(self.load(int(payload) if payload.isdigit() else None))
@@ -0,0 +1,260 @@
+"""
+Background jobs, queued up in Postgres (the jobs table) and run by
+worker.py instead of inside the request that asked for them -- so that
+a CSV of a few hundred members (bcrypt'd one by one) or a live report
+over a big location doesn't tie up a web worker, its share of the pool
+and app.ppe for however long it takes.
+
+An endpoint enqueue()s a job and answers with a 202 and the job's ID
+right away; the client then polls /api/jobs/<jid> (see fetch()) for its
+progress, and for its result once it's done.
+
+Each kind of job is a JobType, registered with @job_type() below, which
+says how many times it's tried before it's given up on, how long to wait
+between tries, and how many of it one worker process will run at once.
+Workers claim jobs with SELECT ... FOR UPDATE SKIP LOCKED, so any number
+of them can share the table without stepping on each other; a claimed
+job is leased for LEASE seconds at a time, and one whose worker stops
+renewing its lease (i.e. died) is picked up again by another.
+"""
+import asyncio
+import datetime as dt
+import io
+import json
+import time
+from decimal import Decimal
+
+from asyncpg import exceptions as pgexc
+
+from .typedef import Location
+
+CHANNEL = 'booksy_jobs'  # NOTIFYd on enqueue, so idle workers wake up straight away
+LEASE = 60  # s
+POLL = 5.0  # s; how often idle workers check for jobs anyway (e.g. retries coming due)
+
+JOB_TYPES = {}
+
+
+class Permanent(Exception):
+    """Raised by a job that'd only fail the same way if retried, e.g. over bad input."""
+
+
+class JobType:
+    """
+    name        (str):       What's stored in jobs.type
+    func        (coroutine): func(app, job) -> something JSON-able, stored as jobs.result
+    attempts    (int):       Tries before it's marked failed
+    backoff     (float):     Seconds before the first retry; doubles after every one
+    concurrency (int):       How many of these one worker runs at once
+    """
+    def __init__(self, name, func, *, attempts=3, backoff=30, concurrency=1):
+        self.name = name
+        self.func = func
+        self.attempts = attempts
+        self.backoff = backoff
+        self.concurrency = concurrency
+
+
+def job_type(name, **kwargs):
+    def decorator(func):
+        JOB_TYPES[name] = JobType(name, func, **kwargs)
+        return func
+    return decorator
+
+
+def _jsonable(obj):
+    if isinstance(obj, (Decimal, dt.date, dt.datetime)):
+        return str(obj)
+    try:
+        return dict(obj)  # asyncpg Records
+    except (TypeError, ValueError):
+        raise TypeError(f'{type(obj).__name__} is not JSON serializable')
+
+
+class Job:
+    """
+    What a job's function gets handed, along with the (worker's) app.
+    
+    jid      (int):   Job ID
+    type     (str):   See JOB_TYPES
+    lid      (int):   Location it's for
+    uid      (int):   Member who asked for it
+    payload  (dict):  Arguments from enqueue()
+    input    (bytes): Uploaded file or the like, if any
+    attempt  (int):   1 on the first try, 2 on the first retry, etc.
+    """
+    __slots__ = 'jid', 'type', 'lid', 'uid', 'payload', 'input', 'attempt', '_app', '_reported'
+    
+    def __init__(self, app, row):
+        self._app = app
+        self.jid = row['jid']
+        self.type = row['type']
+        self.lid = row['lid']
+        self.uid = row['uid']
+        self.payload = json.loads(row['payload'])
+        self.input = row['input']
+        self.attempt = row['attempts']
+        self._reported = 0.0
+    
+    async def progress(self, fraction):
+        """Records how far along the job is, for fetch(). Only writes it out once a second at most."""
+        if time.monotonic() - self._reported < 1 and fraction < 1:
+            return
+        self._reported = time.monotonic()
+        await self._app.pg_pool.execute('''UPDATE jobs SET progress = $2::real WHERE jid = $1::bigint''', self.jid, fraction)
+
+
+async def enqueue(app, type_, lid, uid, payload=None, *, input=None):
+    """Queues up a job of type `type_` (see JOB_TYPES); returns its ID."""
+    if type_ not in JOB_TYPES:
+        raise ValueError(f'unknown job type {type_!r}')
+    query = '''
+    WITH job AS (
+      INSERT INTO jobs (type, lid, uid, payload, input)
+      VALUES ($1::text, $2::bigint, $3::bigint, $4::jsonb, $5::bytea)
+      RETURNING jid, type
+    )
+    SELECT jid, pg_notify($6::text, type) FROM job
+    '''
+    return await app.pg_pool.fetchval(query, type_, lid, uid, json.dumps(payload or {}), input, CHANNEL)
+
+
+async def fetch(app, jid, lid):
+    """Job `jid`'s status as a dict, or None if it doesn't exist (at location lid)."""
+    query = '''
+    SELECT jid, type, state, progress, attempts, result, error, created, finished
+      FROM jobs
+     WHERE jid = $1::bigint AND lid = $2::bigint
+    '''
+    row = await app.pg_pool.fetchrow(query, jid, lid)
+    if row is None:
+        return None
+    job = dict(row)
+    job['result'] = job['result'] and json.loads(job['result'])
+    job['created'] = str(job['created'])
+    job['finished'] = job['finished'] and str(job['finished'])
+    return job
+
+
+class Worker:
+    """
+    Claims & runs jobs until stopped. (See worker.py for the process
+    that runs one of these.)
+    
+    app   (SimpleNamespace): Stands in for the Sanic app as far as the typedef classes are concerned
+    types (list):            Job types this worker runs; default all of them
+    """
+    def __init__(self, app, types=None):
+        self.app = app
+        self.types = list(types or JOB_TYPES)
+        self.running = dict.fromkeys(self.types, 0)
+        self._wake = asyncio.Event()
+        self._tasks = set()
+        self._stopping = False
+    
+    def wake(self, *_):
+        self._wake.set()
+    
+    async def run(self, listener):
+        """`listener` is a connection of its own, to LISTEN for new jobs on."""
+        await listener.add_listener(CHANNEL, self.wake)
+        while not self._stopping:
+            self._wake.clear()
+            free = [name for name in self.types if self.running[name] < JOB_TYPES[name].concurrency]
+            row = free and await self._claim(free)
+            if not row:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), POLL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            job = Job(self.app, row)
+            self.running[job.type] += 1
+            task = asyncio.ensure_future(self._execute(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+    
+    async def stop(self):
+        """Stops claiming new jobs and waits for the running ones to finish."""
+        self._stopping = True
+        self.wake()
+        if self._tasks:
+            await asyncio.wait(self._tasks)
+    
+    async def _claim(self, types):
+        # A running job past its lease is one whose worker died on it
+        query = '''
+        UPDATE jobs
+           SET state = 'running', attempts = attempts + 1, locked_until = now() + $2::int * interval '1 second'
+         WHERE jid = (
+                 SELECT jid
+                   FROM jobs
+                  WHERE type = ANY($1::text[])
+                    AND (state = 'queued' AND run_after <= now() OR state = 'running' AND locked_until < now())
+                  ORDER BY run_after, jid
+                  LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+               )
+        RETURNING jid, type, lid, uid, payload, input, attempts
+        '''
+        return await self.app.pg_pool.fetchrow(query, types, LEASE)
+    
+    async def _renew(self, job):
+        while True:
+            await asyncio.sleep(LEASE / 3)
+            query = '''UPDATE jobs SET locked_until = now() + $2::int * interval '1 second' WHERE jid = $1::bigint'''
+            await self.app.pg_pool.execute(query, job.jid, LEASE)
+    
+    async def _execute(self, job):
+        jtype = JOB_TYPES[job.type]
+        renewer = asyncio.ensure_future(self._renew(job))
+        try:
+            if job.attempt > jtype.attempts:  # i.e. it's been picked up after its last worker died
+                raise Permanent(f'Gave up after {jtype.attempts} attempts.')
+            result = await jtype.func(self.app, job)
+        except Exception as e:
+            retry = not isinstance(e, Permanent) and job.attempt < jtype.attempts
+            query = '''
+            UPDATE jobs
+               SET state = $2::text, error = $3::text, locked_until = NULL,
+                   run_after = now() + $4::float * interval '1 second',
+                   finished = CASE WHEN $2::text = 'failed' THEN now() END
+             WHERE jid = $1::bigint
+            '''
+            await self.app.pg_pool.execute(
+              query, job.jid, 'queued' if retry else 'failed', str(e) or type(e).__name__, jtype.backoff * 2 ** (job.attempt - 1)
+              )
+            if not isinstance(e, Permanent):
+                print(f'Job {job.jid} ({job.type}) failed on attempt {job.attempt}:', repr(e))
+        else:
+            query = '''
+            UPDATE jobs
+               SET state = 'done', result = $2::jsonb, error = NULL, progress = 1, locked_until = NULL, finished = now()
+             WHERE jid = $1::bigint
+            '''
+            await self.app.pg_pool.execute(query, job.jid, json.dumps(result, default=_jsonable))
+        finally:
+            renewer.cancel()
+            self.running[job.type] -= 1
+            self.wake()  # in case it was holding the type at its concurrency limit
+
+
+# The jobs themselves. Permission checks are done by the endpoints that
+# enqueue these, before they're enqueued.
+
+@job_type('members.import', attempts=2, concurrency=1)
+async def import_members(app, job):
+    """payload: {'rid'}; input: the CSV"""
+    location = await Location(job.lid, app)
+    try:
+        status = await location.add_members_batch(io.BytesIO(job.input), job.payload['rid'], progress=job.progress)
+    except (ValueError, KeyError, UnicodeDecodeError, pgexc.DataError, pgexc.IntegrityConstraintViolationError) as e:
+        raise Permanent(str(e)) from e  # bad CSV; it won't get any better
+    return {'status': status}
+
+
+@job_type('report.live', attempts=3, backoff=5, concurrency=2)
+async def live_report(app, job):
+    """payload: {'get'}, as for Location.report()"""
+    location = await Location(job.lid, app)
+    return await location.report(True, progress=job.progress, **job.payload['get'])
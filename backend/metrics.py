@@ -0,0 +1,241 @@
+"""
+Bare-bones Prometheus instrumentation -- just enough of the client
+library's counters/gauges/histograms to put together a /metrics page
+in its text exposition format, without pulling in the library itself.
+
+Request metrics are recorded by the middleware in server.py, DB ones
+by the pool wrapper in pool.py; everything that's really a snapshot of
+some other object's state (pool sizes, bus lag, etc.) is read off said
+object when /metrics is scraped, in collect().
+"""
+import time
+
+from . import context
+
+REGISTRY = []
+
+# Seconds
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+# Round trips per request
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _labelstr(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _num(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """
+    name   (str):   Full metric name, e.g. booksy_http_requests_total
+    doc    (str):   HELP text
+    labels (tuple): Label names; values are passed positionally, in order
+    """
+    kind = None
+    
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._values = {}
+        REGISTRY.append(self)
+    
+    def clear(self):
+        self._values.clear()
+    
+    def render(self):
+        yield f'# HELP {self.name} {self.doc}'
+        yield f'# TYPE {self.name} {self.kind}'
+        yield from self._samples()
+
+
+class Counter(_Metric):
+    kind = 'counter'
+    
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+    
+    def _samples(self):
+        for values, value in sorted(self._values.items()):
+            yield f'{self.name}{_labelstr(self.labels, values)} {_num(value)}'
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+    
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+    
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+    
+    def __init__(self, name, doc, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = (*sorted(buckets), float('inf'))
+    
+    def observe(self, value, *labels):
+        try:
+            counts = self._values[labels]
+        except KeyError:
+            counts = self._values[labels] = [0] * len(self.buckets) + [0.0]  # last one's the sum
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        counts[-1] += value
+    
+    def totals(self, *labels):
+        """(count, sum) of everything observed so far."""
+        counts = self._values.get(labels)
+        return (sum(counts[:-1]), counts[-1]) if counts else (0, 0.0)
+    
+    def _samples(self):
+        for values, counts in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f'{self.name}_bucket{_labelstr(self.labels, values, [("le", _num(bound))])} {cumulative}'
+            yield f'{self.name}_sum{_labelstr(self.labels, values)} {_num(counts[-1])}'
+            yield f'{self.name}_count{_labelstr(self.labels, values)} {cumulative}'
+
+
+# Requests
+HTTP_REQUESTS = Counter('booksy_http_requests_total', 'HTTP requests handled.', ('route', 'method', 'status'))
+HTTP_LATENCY = Histogram('booksy_http_request_duration_seconds', 'Time taken to handle a request.', ('route',))
+HTTP_IN_FLIGHT = Gauge('booksy_http_requests_in_flight', 'Requests currently being handled.')
+# Per-request DB usage
+REQUEST_QUERIES = Histogram('booksy_request_db_queries', 'DB round trips made per request.', ('route',), COUNT_BUCKETS)
+REQUEST_DB_TIME = Histogram('booksy_request_db_seconds', 'Time spent waiting on DB queries per request.', ('route',))
+REQUEST_ACQUIRES = Histogram('booksy_request_db_acquires', 'Pool connections acquired per request.', ('route',), COUNT_BUCKETS)
+RATE_LIMITED = Counter('booksy_rate_limited_total', 'Requests turned away by a rate limit.', ('class',))
+# Load shedding (see overload.py)
+LOOP_LAG = Gauge('booksy_event_loop_lag_seconds', 'How late the event loop was in waking up, as of the last sample.')
+OVERLOAD_SCORE = Gauge('booksy_overload_score', 'How overloaded the server is; 1 is at threshold.')
+SHED = Counter('booksy_shed_total', 'Requests turned away because the server was overloaded.', ('priority',))
+# Postgres
+DB_QUERIES = Counter('booksy_db_queries_total', 'DB round trips made, in or out of a request.')
+PG_ACQUIRE_WAIT = Histogram('booksy_pg_pool_acquire_wait_seconds', 'Time spent waiting for a pool connection, less any spent held back by a location cap.')
+PG_POOL_SIZE = Gauge('booksy_pg_pool_size', 'Connections currently open in the Postgres pool.')
+PG_POOL_IDLE = Gauge('booksy_pg_pool_idle', 'Idle connections in the Postgres pool.')
+PG_POOL_MAX = Gauge('booksy_pg_pool_max_size', 'Maximum size of the Postgres pool.')
+PG_FAIR_WAIT = Histogram('booksy_pg_fair_wait_seconds', 'Time spent queued for a connection behind other locations.')
+PG_FAIR_QUEUED = Gauge('booksy_pg_fair_queued', 'Acquisitions currently queued in the fair scheduler.')
+PG_FAIR_CAPPED = Counter('booksy_pg_fair_capped_total', 'Acquisitions queued only because their location was at its cap.')
+# Redis
+RD_POOL_SIZE = Gauge('booksy_redis_pool_size', 'Connections currently open in the Redis pool.')
+RD_POOL_FREE = Gauge('booksy_redis_pool_free', 'Free connections in the Redis pool.')
+# Executors
+EXECUTOR_PENDING = Gauge('booksy_executor_pending', 'Calls submitted to an executor and not yet finished.', ('executor',))
+EXECUTOR_CALLS = Counter('booksy_executor_calls_total', 'Calls submitted to an executor.', ('executor',))
+# Notification streams (see events.py)
+SSE_STREAMS = Gauge('booksy_sse_streams', 'Notification event streams currently open.')
+SSE_WAKEUPS = Counter('booksy_sse_wakeups_total', 'Times an open stream was told its member\'s notifications may have changed.')
+SSE_SENT = Counter('booksy_sse_sent_total', 'Notification updates actually sent down a stream.')
+# Single-flight (see singleflight.py); joined / (led + joined) is the coalescing ratio
+SINGLEFLIGHT = Counter('booksy_singleflight_total', 'Lookups that went through single-flight, by whether they led one or joined one already in flight.', ('kind', 'role'))
+# Location attribute cache (see attrcache.py)
+ATTR_CACHE = Counter('booksy_attr_cache_total', 'Location attribute lookups, by whether they were served fresh or stale from cache, or missed.', ('kind', 'result'))
+# Invalidation bus (see bus.py)
+BUS_MESSAGES = Gauge('booksy_bus_messages', 'Invalidation bus NOTIFYs/messages since startup.', ('direction',))
+BUS_LAG = Gauge('booksy_bus_lag_seconds', 'Delay between a bus message being published and applied here.', ('stat',))
+BUS_RECONNECTS = Counter('booksy_bus_reconnects_total', 'Times the LISTEN connection dropped and had to be reopened.')
+
+
+def start_request(rqst):
+    """Called as a request comes in; returns its RequestContext."""
+    HTTP_IN_FLIGHT.inc()
+    return context.bind(context.RequestContext(rqst.path))
+
+
+def finish_request(rqst, resp):
+    """Called on the way out, with the response to `rqst`."""
+    ctx = context.current()
+    if ctx is None:  # request middleware never ran, e.g. the request errored out before it
+        return
+    HTTP_IN_FLIGHT.dec()
+    route = route_label(rqst)
+    HTTP_REQUESTS.inc(route, rqst.method, resp.status)
+    HTTP_LATENCY.observe(time.perf_counter() - ctx.started, route)
+    REQUEST_QUERIES.observe(ctx.queries, route)
+    REQUEST_DB_TIME.observe(ctx.query_time, route)
+    REQUEST_ACQUIRES.observe(ctx.acquires, route)
+    if rqst.app.config.get('DB_ROUNDTRIP_HEADERS'):  # for bench/roundtrips.py
+        resp.headers['X-DB-Queries'] = str(ctx.queries)
+        resp.headers['X-DB-Acquires'] = str(ctx.acquires)
+        resp.headers['X-Route'] = route
+
+
+def route_label(rqst):
+    """
+    What a request's metrics are labelled with: the pattern of the route
+    it matched, as in /api/jobs/<jid>, so that each route is one series
+    however many different paths it's requested at. Requests that never
+    got as far as a handler -- redirected to Angular or turned away by
+    middleware, or not matching any route at all -- are all labelled as
+    one, so that random paths thrown at the server can't blow up the
+    number of series either. (Their status still tells them apart.)
+    """
+    return getattr(rqst, 'uri_template', None) or '<unmatched>'
+
+
+def instrument_executor(app, run_in_executor):
+    """
+    Wraps loop.run_in_executor so as to keep track of how many calls
+    are queued up in (or running in) each executor.
+    """
+    def aexec(executor, func, *args):
+        name = 'process' if executor is app.ppe else 'thread'
+        EXECUTOR_CALLS.inc(name)
+        EXECUTOR_PENDING.inc(name)
+        fut = run_in_executor(executor, func, *args)
+        fut.add_done_callback(lambda _: EXECUTOR_PENDING.dec(name))
+        return fut
+    return aexec
+
+
+def collect(app):
+    """Reads off the gauges that are just snapshots of something else."""
+    pool = getattr(app, 'pg_pool', None)
+    if pool is not None:
+        pool = getattr(pool, 'pool', pool)  # unwrap InstrumentedPool
+        if hasattr(pool, 'get_size'):  # asyncpg >= 0.25
+            PG_POOL_MAX.set(pool.get_max_size())
+            PG_POOL_SIZE.set(pool.get_size())
+            PG_POOL_IDLE.set(pool.get_idle_size())
+        else:
+            PG_POOL_MAX.set(len(pool._holders))
+            PG_POOL_SIZE.set(sum(1 for h in pool._holders if h._con is not None and not h._con.is_closed()))
+            PG_POOL_IDLE.set(pool._queue.qsize())
+    rd_pool = getattr(app, 'rd_pool', None)
+    if rd_pool is not None:
+        RD_POOL_SIZE.set(rd_pool.size)
+        RD_POOL_FREE.set(rd_pool.freesize)
+    bus = getattr(app, 'bus', None)
+    if bus is not None:
+        for direction in ('sent', 'received', 'applied'):
+            BUS_MESSAGES.set(getattr(bus, direction), direction)
+        BUS_LAG.set(bus.lag['last'], 'last')
+        BUS_LAG.set(bus.lag['max'], 'max')
+        BUS_LAG.set(bus.lag['total'] / bus.lag['count'] if bus.lag['count'] else 0.0, 'mean')
+
+
+def render(app):
+    """Everything, in Prometheus' text format."""
+    collect(app)
+    return '\n'.join(line for metric in REGISTRY for line in metric.render()) + '\n'
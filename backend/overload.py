@@ -0,0 +1,118 @@
+"""
+Load shedding, for when Postgres (or the box) slows down.
+
+Left alone, a slow DB means requests pile up waiting on pool.acquire()
+until every one of them -- checkouts included -- is taking seconds. The
+OverloadController instead keeps an eye on how overloaded things are,
+and once they are, endpoints start turning requests away up front with
+a 503 and a Retry-After, least important first, so that whatever's left
+still gets through quickly. Every so often (INTERVAL) it samples:
+
+  - event-loop lag: how late a sleep(INTERVAL) wakes up, i.e. how far
+    behind the loop is on everything it has to do
+  - pool wait: the mean time acquisitions took over the last INTERVAL
+    (see pool.py), or how long the oldest one still waiting has been
+    at it (see fairpool.py), whichever's worse -- either way, not
+    counting time spent waiting only on a location's own cap, which
+    is that location's problem and not the pool's
+
+and scores each against its threshold (OVERLOAD_LAG_MS/OVERLOAD_WAIT_MS;
+a score of 1 is right at it). Endpoints declare their priority with
+@priority() (see deco.py) and are shed once the score reaches:
+
+    low     1  reports, search, help, ...
+    normal  2
+    high    4  checking items in & out
+
+Endpoints without a @priority() are never shed. The score only comes
+back down once it's stayed down for COOLDOWN seconds, so that shedding
+doesn't flap on and off with every sample.
+
+OVERLOAD_SHEDDING=0 turns shedding off, though everything's still
+sampled for /metrics.
+"""
+import asyncio
+import time
+
+from . import metrics
+
+INTERVAL = 0.25  # s
+COOLDOWN = 5.0   # s
+
+# priority -> score at which it's shed
+SHED_AT = {'low': 1, 'normal': 2, 'high': 4}
+
+
+class OverloadController:
+    """
+    app     (Sanic): For its pg_pool
+    lag_ms  (float): Event-loop lag that counts as overloaded
+    wait_ms (float): Pool acquire wait that counts as overloaded
+    enabled (bool):  Whether to actually shed anything
+    """
+    def __init__(self, app, *, lag_ms=100, wait_ms=250, enabled=True, loop=None):
+        self.app = app
+        self.lag_threshold = lag_ms / 1000
+        self.wait_threshold = wait_ms / 1000
+        self.enabled = enabled
+        self.lag = self.wait = 0.0
+        self.score = 0.0
+        self._peak = 0.0, 0.0  # (highest score since it was last lowered, when)
+        self._acquires = 0, 0.0  # PG_ACQUIRE_WAIT's (count, sum) as of the last sample
+        self._loop = loop
+        self._task = None
+    
+    @classmethod
+    def from_config(cls, app, *, loop=None):
+        config = app.config
+        return cls(
+          app,
+          lag_ms=float(config.get('OVERLOAD_LAG_MS') or 100),
+          wait_ms=float(config.get('OVERLOAD_WAIT_MS') or 250),
+          enabled=config.get('OVERLOAD_SHEDDING', True),
+          loop=loop
+          )
+    
+    def start(self):
+        self._task = (self._loop or asyncio.get_event_loop()).create_task(self._run())
+    
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+    
+    async def _run(self):
+        loop = self._loop or asyncio.get_event_loop()
+        while True:
+            before = loop.time()
+            await asyncio.sleep(INTERVAL)
+            self.sample(max(0.0, loop.time() - before - INTERVAL))
+    
+    def _pool_wait(self):
+        """Mean acquire wait since the last sample, or the oldest still waiting."""
+        count, total = metrics.PG_ACQUIRE_WAIT.totals()
+        last_count, last_total = self._acquires
+        self._acquires = count, total
+        mean = (total - last_total) / (count - last_count) if count > last_count else 0.0
+        scheduler = getattr(getattr(self.app, 'pg_pool', None), 'scheduler', None)
+        return max(mean, scheduler.oldest_wait() if scheduler is not None else 0.0)
+    
+    def sample(self, lag):
+        self.lag = lag
+        self.wait = self._pool_wait()
+        score = max(lag / self.lag_threshold, self.wait / self.wait_threshold)
+        now = time.monotonic()
+        peak, since = self._peak
+        if score >= peak or now - since >= COOLDOWN:
+            # Straight up, but only back down after COOLDOWN of being lower
+            self._peak = score, now
+        self.score = self._peak[0]
+        metrics.LOOP_LAG.set(lag)
+        metrics.OVERLOAD_SCORE.set(self.score)
+    
+    def sheds(self, priority):
+        """Whether requests of this priority should be turned away right now."""
+        return self.enabled and self.score >= SHED_AT[priority]
@@ -0,0 +1,171 @@
+"""
+A thin wrapper around the asyncpg pool that counts and times every
+query and connection acquisition, both against the request they were
+made for (see context.py) and in the app-wide metrics (see metrics.py),
+and that queues acquisitions up fairly between locations (see
+fairpool.py).
+
+Everything else is passed straight through to the real pool/connection,
+so the typedef classes can't tell the difference.
+"""
+import asyncio
+import time
+
+from . import context, metrics
+from .tracer import caller as tracer_caller
+
+# Connection methods that make a round trip to Postgres
+QUERY_METHODS = frozenset({
+  'execute', 'executemany',
+  'fetch', 'fetchval', 'fetchrow',
+  'prepare',
+  'copy_to_table', 'copy_records_to_table', 'copy_from_query', 'copy_from_table',
+  })
+
+
+async def init_connection(conn):
+    """
+    Passed as the real pool's `init`: has `json` values (i.e. whatever a
+    query built with json_agg() and friends) come back as the bytes
+    Postgres sent, rather than being decoded to a str, so the endpoints
+    that serve those can hand them straight to sanic.response.raw().
+    json's binary format is just its text in UTF-8, so that's already
+    exactly what the client should get.
+    """
+    await conn.set_type_codec(
+      'json', schema='pg_catalog',
+      encoder=_json_bytes, decoder=_json_bytes,
+      format='binary'
+      )
+
+
+def _json_bytes(value):
+    return value.encode() if isinstance(value, str) else value
+
+
+def record_query(seconds):
+    ctx = context.current()
+    if ctx is not None:
+        ctx.queries += 1
+        ctx.query_time += seconds
+    metrics.DB_QUERIES.inc()
+
+
+class InstrumentedConnection:
+    """
+    Proxies an asyncpg connection, timing the methods in QUERY_METHODS
+    (and passing them along to the query tracer, if there is one).
+    """
+    __slots__ = '_conn', '_tracer'
+    
+    def __init__(self, conn, tracer=None):
+        self._conn = conn
+        self._tracer = tracer
+    
+    def __getattr__(self, name):
+        attr = getattr(self._conn, name)
+        if name not in QUERY_METHODS:
+            return attr
+        tracer = self._tracer
+        # Has to be looked up here, while the caller's still on the stack
+        where = tracer and tracer_caller()
+        
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await attr(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                record_query(seconds)
+                if tracer is not None:
+                    tracer.record(name, where, args, seconds)
+        return timed
+
+
+class _Acquire:
+    """What InstrumentedPool.acquire() returns; for `async with` only."""
+    __slots__ = '_pool', '_timeout', '_conn', '_lid'
+    
+    def __init__(self, pool, timeout):
+        self._pool = pool
+        self._timeout = timeout
+        self._conn = None
+        self._lid = None
+    
+    async def __aenter__(self):
+        start = time.perf_counter()
+        ctx = context.current()
+        scheduler = self._pool.scheduler
+        capped = 0.0
+        if scheduler is not None:
+            # Wait for this location's turn first (see fairpool.py), after
+            # which the pool itself should have a connection free
+            self._lid = None if ctx is None else ctx.lid
+            if self._timeout is None:
+                capped = await scheduler.enter(self._lid)
+            else:
+                capped = await asyncio.wait_for(scheduler.enter(self._lid), self._timeout)
+        try:
+            self._conn = await self._pool.pool.acquire(timeout=self._timeout)
+        except BaseException:
+            if scheduler is not None:
+                scheduler.leave(self._lid)
+            raise
+        wait = time.perf_counter() - start
+        if ctx is not None:
+            ctx.acquires += 1
+            ctx.acquire_wait += wait
+        # (the pool's not to blame for the location being at its cap)
+        metrics.PG_ACQUIRE_WAIT.observe(wait - capped)
+        return InstrumentedConnection(self._conn, self._pool.tracer)
+    
+    async def __aexit__(self, *exc):
+        try:
+            await self._pool.pool.release(self._conn)
+        finally:
+            if self._pool.scheduler is not None:
+                self._pool.scheduler.leave(self._lid)
+
+
+class InstrumentedPool:
+    """
+    pool      (asyncpg.pool.Pool): The actual pool.
+    tracer    (QueryTracer):       See tracer.py; None unless SLOW_QUERY_MS is set
+    scheduler (FairScheduler):     See fairpool.py; None to leave it to asyncpg
+    
+    As with asyncpg's own, the query methods here just acquire a
+    connection, run the query on it, and release it again.
+    """
+    def __init__(self, pool, tracer=None, scheduler=None):
+        self.pool = pool
+        self.tracer = tracer
+        self.scheduler = scheduler
+    
+    def __getattr__(self, name):
+        return getattr(self.pool, name)
+    
+    def acquire(self, *, timeout=None):
+        return _Acquire(self, timeout)
+    
+    async def execute(self, query, *args, **kwargs):
+        async with self.acquire() as conn:
+            return await conn.execute(query, *args, **kwargs)
+    
+    async def executemany(self, query, args, **kwargs):
+        async with self.acquire() as conn:
+            return await conn.executemany(query, args, **kwargs)
+    
+    async def fetch(self, query, *args, **kwargs):
+        async with self.acquire() as conn:
+            return await conn.fetch(query, *args, **kwargs)
+    
+    async def fetchval(self, query, *args, **kwargs):
+        async with self.acquire() as conn:
+            return await conn.fetchval(query, *args, **kwargs)
+    
+    async def fetchrow(self, query, *args, **kwargs):
+        async with self.acquire() as conn:
+            return await conn.fetchrow(query, *args, **kwargs)
+    
+    async def close(self):
+        await self.pool.close()
@@ -0,0 +1,137 @@
+"""
+Per-location token-bucket rate limits for the expensive endpoints, so
+that one library hammering live reports or uploading CSV after CSV
+can't tie up the whole DB pool (and app.ppe) for everyone else.
+
+Endpoints opt in by class with @rate_limited() (see deco.py), and each
+location gets its own bucket per class. A bucket holds up to `burst`
+tokens and refills at `rate` tokens/s; every request takes one, and if
+there aren't any left it's turned away with a 429 and a Retry-After.
+
+The classes in PER_SESSION get a bucket per session (login) instead, so
+per kiosk: a class visit is thirty kids at thirty kiosks all searching
+at once, which a location-wide bucket would throttle however generous
+it was, while one stuck kiosk or script still only gets its own share.
+
+Limits are DEFAULTS below, overridden by the RATE_LIMITS config var and
+then per location by RATE_LIMIT_OVERRIDES, e.g.
+
+    RATE_LIMITS='{"search": [5, 60]}'
+    RATE_LIMIT_OVERRIDES='{"12": {"reports": [0.1, 10]}, "40": {"batch": null}}'
+
+(a null limit means no limit). Buckets are kept in memory, per worker,
+unless RATE_LIMIT_BACKEND=redis, in which case they're shared by every
+worker through Redis.
+"""
+import hashlib
+import json
+import time
+
+# class -> (rate in tokens/s, burst)
+DEFAULTS = {
+  'reports': (1 / 30, 5),  # a live report every 30s, after the first 5
+  'batch': (1 / 120, 2),   # a CSV upload every 2 minutes, after the first 2
+  'search': (2, 30),       # per session; see PER_SESSION
+  'exports': (1 / 10, 3),  # each holds a DB connection for as long as it streams
+  }
+
+# Classes limited per session rather than per location
+PER_SESSION = frozenset({'search'})
+
+# How many buckets MemoryBuckets keeps before sweeping out the ones that
+# have refilled (which are no different from having no bucket at all)
+SWEEP_AT = 10000
+
+# KEYS[1]: bucket; ARGV: rate, burst, now. Returns the wait in seconds
+# (as a string, since Lua numbers get truncated to integers otherwise)
+TAKE = '''
+local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+else
+  wait = (1 - tokens) / rate
+end
+redis.call('HMSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+return tostring(wait)
+'''
+
+
+class MemoryBuckets:
+    def __init__(self):
+        self._buckets = {}  # key -> (tokens, last updated, when it'll be full again)
+        self._sweep_at = SWEEP_AT
+    
+    async def take(self, key, rate, burst):
+        now = time.monotonic()
+        if len(self._buckets) >= self._sweep_at:
+            self._sweep(now)
+        tokens, last, _ = self._buckets.get(key, (burst, now, now))
+        tokens = min(burst, tokens + (now - last) * rate)
+        wait = 0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+        self._buckets[key] = tokens, now, now + (burst - tokens) / rate
+        return wait
+    
+    def _sweep(self, now):
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if bucket[2] > now}
+        self._sweep_at = max(SWEEP_AT, 2 * len(self._buckets))
+
+
+class RedisBuckets:
+    def __init__(self, rd_pool):
+        self._pool = rd_pool
+    
+    async def take(self, key, rate, burst):
+        async with self._pool.get() as conn:
+            wait = await conn.execute('eval', TAKE, 1, f'ratelimit:{key}', rate, burst, time.time())
+        return float(wait)
+
+
+def _parse(limits):
+    return {cls: None if limit is None else tuple(limit) for cls, limit in limits.items()}
+
+
+class RateLimiter:
+    """
+    limits    (dict): class -> (rate, burst) or None
+    overrides (dict): lid -> {class -> (rate, burst) or None}
+    """
+    def __init__(self, app):
+        config = app.config
+        self.limits = {**DEFAULTS, **_parse(json.loads(config.get('RATE_LIMITS') or '{}'))}
+        self.overrides = {
+          int(lid): _parse(limits)
+          for lid, limits in json.loads(config.get('RATE_LIMIT_OVERRIDES') or '{}').items()
+          }
+        if config.get('RATE_LIMIT_BACKEND') == 'redis' and getattr(app, 'rd_pool', None) is not None:
+            self.backend = RedisBuckets(app.rd_pool)
+        else:
+            self.backend = MemoryBuckets()
+    
+    def limit(self, lid, cls):
+        return self.overrides.get(lid, {}).get(cls, self.limits.get(cls))
+    
+    async def take(self, lid, cls, session=None):
+        """
+        Takes a token from location lid's `cls` bucket -- or session's
+        own, if cls is one of PER_SESSION. Returns 0 if there was one,
+        else how long (s) until there will be.
+        """
+        limit = self.limit(lid, cls)
+        if limit is None:
+            return 0
+        rate, burst = limit
+        key = f'{lid}:{cls}'
+        if cls in PER_SESSION and session is not None:
+            # (hashed so that refresh tokens don't end up in Redis keys)
+            key += ':' + hashlib.sha1(session.encode()).hexdigest()[:16]
+        return await self.backend.take(key, rate, burst)
@@ -0,0 +1,159 @@
+"""
+Refresh-token ("session") storage, in Redis.
+
+Each session is a pair of keys pointing at each other, uID -> refresh
+token and refresh token -> uID, both of which expire after TTL seconds
+(the REFRESH_TOKEN_TTL config var) so that Redis doesn't hold on to every
+token ever issued. Every operation here is a single round trip: storing
+is one MULTI/EXEC, and revoking (of any number of sessions at once) is
+one Lua script call that does the lookups server-side.
+
+Each worker also keeps its own copy of the keys in app.rtoken_cache (a
+TokenCache), which the invalidation bus keeps in step; see bus.py.
+"""
+import asyncio
+import time
+
+DEFAULT_TTL = 30 * 24 * 60 * 60  # 30 days
+
+# KEYS: uIDs. Deletes each one and the refresh token it points to, and
+# returns said tokens so the in-memory caches can be cleared out as well
+REVOKE = '''
+local tokens = {}
+for _, uid in ipairs(KEYS) do
+  local token = redis.call('GET', uid)
+  if token then
+    redis.call('DEL', token)
+    tokens[#tokens + 1] = token
+  end
+  redis.call('DEL', uid)
+end
+return tokens
+'''
+
+# How many keys to send over the bus per message, to stay under its
+# payload limit on big revocations
+BUS_CHUNK = 50
+
+
+class TokenCache(dict):
+    """
+    A dict whose entries disappear after `ttl` seconds, so that this
+    worker can't keep honouring a token that Redis has since expired.
+    (Expired entries are only actually thrown away when looked up, or
+    every so often as new ones come in.) Entries copied from Redis should
+    go in with put() instead, so they go when Redis's copy does.
+    """
+    def __init__(self, ttl=DEFAULT_TTL):
+        super().__init__()
+        self.ttl = ttl
+        self._expiry = {}
+        self._sets = 0
+    
+    def __setitem__(self, key, value):
+        self.put(key, value)
+    
+    def put(self, key, value, ttl=None):
+        """Sets key, to disappear after `ttl` seconds at most (default: self.ttl)."""
+        super().__setitem__(key, value)
+        self._expiry[key] = time.monotonic() + (self.ttl if ttl is None else min(ttl, self.ttl))
+        self._sets += 1
+        if self._sets % 1000 == 0:
+            self.purge()
+    
+    def __getitem__(self, key):
+        if self._expiry.get(key, float('inf')) < time.monotonic():
+            self.pop(key, None)
+            raise KeyError(key)
+        return super().__getitem__(key)
+    
+    def pop(self, key, *default):
+        self._expiry.pop(key, None)
+        return super().pop(key, *default)
+    
+    def clear(self):
+        super().clear()
+        self._expiry.clear()
+    
+    def purge(self):
+        now = time.monotonic()
+        for key in [k for k, t in self._expiry.items() if t < now]:
+            self.pop(key, None)
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def forget(app, *keys):
+    """Drops uIDs/refresh tokens from this worker's cache."""
+    for key in keys:
+        app.rtoken_cache.pop(key, None)
+
+
+def _publish(app, keys):
+    for i in range(0, len(keys), BUS_CHUNK):
+        app.bus.publish('rtoken', *keys[i:i+BUS_CHUNK])
+
+
+async def store(app, user_id, refresh_token):
+    ttl = app.config.REFRESH_TOKEN_TTL
+    async with app.rd_pool.get() as conn:
+        # aioredis pipelines commands issued without awaiting in between,
+        # so this is all one round trip
+        await asyncio.gather(
+          conn.execute('multi'),
+          conn.execute('set', user_id, refresh_token, 'ex', ttl),
+          conn.execute('set', refresh_token, user_id, 'ex', ttl),  # for retrieving user from refresh token
+          conn.execute('exec'),
+          )
+    app.rtoken_cache[refresh_token] = user_id
+    app.rtoken_cache[user_id] = refresh_token
+
+
+async def fetch(app, key):
+    """
+    Gets a uID/refresh token from Redis and caches it for as long as
+    Redis has left on it -- not a whole TTL from now, or this worker
+    would carry on honouring a session for up to that long after it ran
+    out. Missing ones aren't cached, so a later login still gets through.
+    """
+    async with app.rd_pool.get() as conn:
+        # (pipelined as in store())
+        value, pttl = await asyncio.gather(conn.execute('get', key), conn.execute('pttl', key))
+    if value is not None:
+        # pttl is -1 for a key that never expires (i.e. one set by hand)
+        app.rtoken_cache.put(key, value, pttl / 1000 if pttl >= 0 else None)
+    return value
+
+
+async def retrieve(app, user_id):
+    try:
+        return app.rtoken_cache[user_id]
+    except KeyError:
+        return await fetch(app, user_id)
+
+
+async def revoke_users(app, uids):
+    """
+    Ends every session belonging to any of `uids`, in this and every
+    other worker.
+    """
+    if not uids or getattr(app, 'rd_pool', None) is None:  # no Redis, no sessions
+        return
+    async with app.rd_pool.get() as conn:
+        tokens = await conn.execute('eval', REVOKE, len(uids), *uids)
+    keys = [*uids, *map(_decode, tokens)]
+    forget(app, *keys)
+    # Other workers have their own caches that need clearing out too
+    _publish(app, keys)
+
+
+async def revoke_location(app, lid, *, type_=None):
+    """
+    Ends every session at location `lid` -- or only those of its members
+    of a certain type, e.g. type_=1 for its checkout accounts.
+    """
+    query = '''SELECT uid FROM members WHERE lid = $1::bigint AND ($2::smallint IS NULL OR type = $2::smallint)'''
+    uids = [row['uid'] for row in await app.pg_pool.fetch(query, lid, type_)]
+    await revoke_users(app, uids)
@@ -0,0 +1,58 @@
+"""
+Single-flight: when a whole class's worth of kiosks all load the same
+location or item, or run the same search, within a few ms of each other,
+only the first of them actually goes to the DB, and everyone else that
+asks while it's still in flight waits for and gets its result instead.
+
+Lookups are keyed by whoever's using this -- by typedef class & ID (see
+AsyncInit.coalesce in core.py), or by a search's normalized terms (see
+Location.search()). Nothing's kept once a lookup's done; this isn't a
+cache, it only ever merges lookups that overlap.
+
+The lookup runs in a task of its own, which everyone waiting on it
+(the first caller included) only waits on through a shield, so if the
+request that started it goes away and gets cancelled, the others still
+get their result.
+"""
+import asyncio
+
+from . import context, metrics
+
+
+class SingleFlight:
+    """
+    kind (str): What's being looked up, for the metrics
+    """
+    def __init__(self, kind):
+        self.kind = kind
+        self._flights = {}  # key -> task
+    
+    def __len__(self):
+        return len(self._flights)
+    
+    def __contains__(self, key):
+        """Whether there's a lookup for `key` in flight right now."""
+        return key in self._flights
+    
+    async def do(self, key, fn):
+        """
+        The result of `await fn()`, shared with every other do() with
+        the same key that's running at the same time.
+        """
+        task = self._flights.get(key)
+        if task is None:
+            metrics.SINGLEFLIGHT.inc(self.kind, 'led')
+            task = self._flights[key] = asyncio.ensure_future(fn())
+            ctx = context.current()
+            if ctx is not None:
+                context.bind(ctx, task)  # its queries are the first caller's
+            task.add_done_callback(lambda t: self._landed(key, t))
+        else:
+            metrics.SINGLEFLIGHT.inc(self.kind, 'joined')
+        return await asyncio.shield(task)
+    
+    def _landed(self, key, task):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        if not task.cancelled():
+            task.exception()  # retrieved, even if everyone waiting on it's been cancelled since
@@ -0,0 +1,21 @@
+-- Background jobs; see backend/jobs.py and worker.py
+CREATE TABLE IF NOT EXISTS jobs (
+  jid          bigserial PRIMARY KEY,
+  type         text NOT NULL, -- one of backend/jobs.py's JOB_TYPES
+  lid          bigint REFERENCES locations ON DELETE CASCADE,
+  uid          bigint REFERENCES members ON DELETE SET NULL, -- who asked for it
+  state        text NOT NULL DEFAULT 'queued', -- 'queued', 'running', 'done' or 'failed'
+  payload      jsonb NOT NULL DEFAULT '{}',
+  input        bytea, -- e.g. an uploaded CSV
+  result       jsonb,
+  error        text,
+  progress     real NOT NULL DEFAULT 0, -- 0 to 1
+  attempts     int NOT NULL DEFAULT 0,
+  run_after    timestamptz NOT NULL DEFAULT now(), -- pushed back between retries
+  locked_until timestamptz, -- a running job whose worker's gone quiet past this is up for grabs again
+  created      timestamptz NOT NULL DEFAULT now(),
+  finished     timestamptz
+);
+-- What workers claim from; finished jobs drop out of it
+CREATE INDEX IF NOT EXISTS jobs_pending_idx ON jobs (run_after, jid) WHERE state IN ('queued', 'running');
+CREATE INDEX IF NOT EXISTS jobs_lid_idx ON jobs (lid, created);
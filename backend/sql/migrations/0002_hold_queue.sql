@@ -0,0 +1,55 @@
+-- Holds as a FIFO queue per work, rather than loose (uid, mid) pairs;
+-- see User.hold() and MediaItem.check_in()
+
+-- What counts as "the same work" for holds: any copy at the location
+-- with the same title, author and type, whichever one was asked for
+CREATE OR REPLACE FUNCTION hold_work_key(title text, author text, type text) RETURNS text AS $$
+  SELECT lower(title) || chr(31) || lower(coalesce(author, '')) || chr(31) || lower(coalesce(type, ''))
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE SEQUENCE IF NOT EXISTS holds_seq;
+
+ALTER TABLE holds
+  ADD COLUMN IF NOT EXISTS seq         bigint,
+  ADD COLUMN IF NOT EXISTS lid         bigint REFERENCES locations ON DELETE CASCADE,
+  ADD COLUMN IF NOT EXISTS work_key    text,
+  ADD COLUMN IF NOT EXISTS state       text NOT NULL DEFAULT 'waiting', -- 'waiting' or 'ready' (on the pickup shelf)
+  ADD COLUMN IF NOT EXISTS ready_mid   bigint REFERENCES items ON DELETE SET NULL, -- the copy set aside, once ready
+  ADD COLUMN IF NOT EXISTS ready_since timestamptz,
+  ADD COLUMN IF NOT EXISTS expires     date; -- last day to pick it up
+
+-- Existing holds keep the order they were placed in
+UPDATE holds
+   SET seq = ordered.n,
+       lid = items.lid,
+       work_key = hold_work_key(items.title, items.author, items.type)
+  FROM (SELECT uid, mid, row_number() OVER (ORDER BY created, uid, mid) AS n FROM holds) AS ordered, items
+ WHERE holds.seq IS NULL
+   AND holds.uid = ordered.uid AND holds.mid = ordered.mid
+   AND items.mid = holds.mid;
+
+SELECT setval('holds_seq', coalesce((SELECT max(seq) FROM holds), 0) + 1, false);
+ALTER SEQUENCE holds_seq OWNED BY holds.seq;
+ALTER TABLE holds
+  ALTER COLUMN seq SET DEFAULT nextval('holds_seq'),
+  ALTER COLUMN seq SET NOT NULL;
+
+-- Copies that are already back on the shelf go to whoever's first in line for them
+UPDATE holds
+   SET state = 'ready', ready_mid = first.mid, ready_since = now(), expires = current_date + 7
+  FROM (
+         SELECT DISTINCT ON (holds.mid) holds.uid, holds.mid
+           FROM holds JOIN items ON items.mid = holds.mid
+          WHERE items.issued_to IS NULL
+            AND holds.state = 'waiting'
+          ORDER BY holds.mid, holds.created, holds.seq
+       ) AS first
+ WHERE holds.uid = first.uid AND holds.mid = first.mid
+   AND NOT EXISTS (SELECT 1 FROM holds AS taken WHERE taken.ready_mid = first.mid);
+
+-- Who's next for a work
+CREATE INDEX IF NOT EXISTS holds_queue_idx ON holds (lid, work_key, created, seq) WHERE state = 'waiting';
+-- A location's pickup shelf, soonest to expire first
+CREATE INDEX IF NOT EXISTS holds_shelf_idx ON holds (lid, expires) WHERE state = 'ready';
+-- Whom a copy's been set aside for; a copy can only be on the shelf for one member
+CREATE UNIQUE INDEX IF NOT EXISTS holds_ready_mid_idx ON holds (ready_mid) WHERE state = 'ready';
@@ -0,0 +1,150 @@
+-- Works: the copies (items) of a title/author/type at a location, grouped
+-- together with running counts, so that search can show "3 of 5
+-- available" and holds can check a work's availability by its key
+
+CREATE OR REPLACE FUNCTION work_key(title text, author text, type text) RETURNS text AS $$
+  SELECT lower(title) || chr(31) || lower(coalesce(author, '')) || chr(31) || lower(coalesce(type, ''))
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE TABLE IF NOT EXISTS works (
+  wid       bigserial PRIMARY KEY,
+  lid       bigint NOT NULL REFERENCES locations ON DELETE CASCADE,
+  key       text NOT NULL, -- work_key(title, author, type)
+  title     text,
+  author    text,
+  type      text,
+  copies    int NOT NULL DEFAULT 0, -- items
+  available int NOT NULL DEFAULT 0, -- items not checked out...
+  on_shelf  int NOT NULL DEFAULT 0, -- ...of which these are set aside for holds
+  UNIQUE (lid, key)
+);
+CREATE INDEX IF NOT EXISTS works_title_idx ON works (lid, lower(title));
+
+ALTER TABLE items ADD COLUMN IF NOT EXISTS wid bigint REFERENCES works ON DELETE SET NULL;
+CREATE INDEX IF NOT EXISTS items_wid_idx ON items (wid);
+ALTER TABLE holds ADD COLUMN IF NOT EXISTS wid bigint REFERENCES works ON DELETE CASCADE;
+
+-- The counts are kept up by statement-level triggers, which see every
+-- row a statement changed at once -- so a COPY of a million items or the
+-- nightly fines UPDATE is one pass over them, not a million little ones.
+-- Each adds what's in new_rows and takes away what was in old_rows, so
+-- rows whose wid and availability didn't change cancel out
+
+CREATE OR REPLACE FUNCTION works_count_items() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    UPDATE works
+       SET copies = copies + d.copies, available = available + d.available
+      FROM (
+             SELECT wid, count(*) AS copies, count(*) FILTER (WHERE issued_to IS NULL) AS available
+               FROM new_rows WHERE wid IS NOT NULL GROUP BY wid
+           ) AS d
+     WHERE works.wid = d.wid;
+  ELSIF TG_OP = 'DELETE' THEN
+    UPDATE works
+       SET copies = copies - d.copies, available = available - d.available
+      FROM (
+             SELECT wid, count(*) AS copies, count(*) FILTER (WHERE issued_to IS NULL) AS available
+               FROM old_rows WHERE wid IS NOT NULL GROUP BY wid
+           ) AS d
+     WHERE works.wid = d.wid;
+  ELSE
+    UPDATE works
+       SET copies = copies + d.copies, available = available + d.available
+      FROM (
+             SELECT wid, sum(copies) AS copies, sum(available) AS available
+               FROM (
+                      SELECT wid, 1 AS copies, (issued_to IS NULL)::int AS available FROM new_rows
+                      UNION ALL
+                      SELECT wid, -1, -(issued_to IS NULL)::int FROM old_rows
+                    ) AS changes
+              WHERE wid IS NOT NULL
+              GROUP BY wid
+           ) AS d
+     WHERE works.wid = d.wid
+       AND (d.copies <> 0 OR d.available <> 0);
+  END IF;
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION works_count_holds() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    UPDATE works SET on_shelf = on_shelf + d.n
+      FROM (SELECT wid, count(*) AS n FROM new_rows WHERE state = 'ready' GROUP BY wid) AS d
+     WHERE works.wid = d.wid;
+  ELSIF TG_OP = 'DELETE' THEN
+    UPDATE works SET on_shelf = on_shelf - d.n
+      FROM (SELECT wid, count(*) AS n FROM old_rows WHERE state = 'ready' GROUP BY wid) AS d
+     WHERE works.wid = d.wid;
+  ELSE
+    UPDATE works SET on_shelf = on_shelf + d.n
+      FROM (
+             SELECT wid, sum(n) AS n
+               FROM (
+                      SELECT wid, 1 AS n FROM new_rows WHERE state = 'ready'
+                      UNION ALL
+                      SELECT wid, -1 FROM old_rows WHERE state = 'ready'
+                    ) AS changes
+              GROUP BY wid
+           ) AS d
+     WHERE works.wid = d.wid
+       AND d.n <> 0;
+  END IF;
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS works_items_ins ON items;
+DROP TRIGGER IF EXISTS works_items_upd ON items;
+DROP TRIGGER IF EXISTS works_items_del ON items;
+CREATE TRIGGER works_items_ins AFTER INSERT ON items REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE PROCEDURE works_count_items();
+CREATE TRIGGER works_items_upd AFTER UPDATE ON items REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE PROCEDURE works_count_items();
+CREATE TRIGGER works_items_del AFTER DELETE ON items REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT EXECUTE PROCEDURE works_count_items();
+
+DROP TRIGGER IF EXISTS works_holds_ins ON holds;
+DROP TRIGGER IF EXISTS works_holds_upd ON holds;
+DROP TRIGGER IF EXISTS works_holds_del ON holds;
+CREATE TRIGGER works_holds_ins AFTER INSERT ON holds REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE PROCEDURE works_count_holds();
+CREATE TRIGGER works_holds_upd AFTER UPDATE ON holds REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE PROCEDURE works_count_holds();
+CREATE TRIGGER works_holds_del AFTER DELETE ON holds REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT EXECUTE PROCEDURE works_count_holds();
+
+-- Files a location's items that aren't in a work yet (and their holds)
+-- under their works, creating whichever works don't exist. For bulk
+-- loads, which COPY items in without a wid; see bench/dataset.py
+CREATE OR REPLACE FUNCTION works_refresh(loc bigint) RETURNS void AS $$
+  INSERT INTO works (lid, key, title, author, type)
+  SELECT DISTINCT ON (work_key(title, author, type)) lid, work_key(title, author, type), title, author, type
+    FROM items
+   WHERE lid = loc AND wid IS NULL
+   ORDER BY work_key(title, author, type), mid
+      ON CONFLICT (lid, key) DO NOTHING;
+
+  UPDATE items
+     SET wid = works.wid
+    FROM works
+   WHERE items.lid = loc AND items.wid IS NULL
+     AND works.lid = loc AND works.key = work_key(items.title, items.author, items.type);
+
+  UPDATE holds
+     SET lid = items.lid, wid = items.wid
+    FROM items
+   WHERE holds.wid IS NULL
+     AND items.mid = holds.mid AND items.lid = loc;
+$$ LANGUAGE sql;
+
+SELECT works_refresh(lid) FROM locations;
+
+-- Holds are now queued by work rather than by 0002's work_key
+DROP INDEX IF EXISTS holds_queue_idx;
+ALTER TABLE holds DROP COLUMN IF EXISTS work_key;
+DROP FUNCTION IF EXISTS hold_work_key(text, text, text);
+CREATE INDEX IF NOT EXISTS holds_queue_idx ON holds (wid, created, seq) WHERE state = 'waiting';
+CREATE INDEX IF NOT EXISTS holds_uid_wid_idx ON holds (uid, wid); -- (unique as of 0006)
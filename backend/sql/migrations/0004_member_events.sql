@@ -0,0 +1,59 @@
+-- Tells the web workers whose notifications might have changed, for
+-- /api/member/events (see backend/events.py): a NOTIFY on
+-- booksy_member_events carrying a comma-separated list of uIDs whenever
+-- a checkout, check-in, fines update or hold changes what theirs say.
+-- Statement-level like the works counters (0003_works.sql), so the
+-- nightly fines update sends a handful of NOTIFYs rather than one per item
+
+CREATE OR REPLACE FUNCTION member_events_notify(uids bigint[]) RETURNS void AS $$
+  -- 300 uIDs at a time keeps each payload well under NOTIFY's 8000 bytes
+  SELECT pg_notify('booksy_member_events', string_agg(uid::text, ','))
+    FROM (SELECT uid, (row_number() OVER () - 1) / 300 AS batch FROM unnest(uids) AS uid WHERE uid IS NOT NULL) AS numbered
+   GROUP BY batch
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION member_events_items() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'UPDATE' THEN
+    PERFORM member_events_notify(array(
+      SELECT DISTINCT unnest(ARRAY[old_rows.issued_to, new_rows.issued_to])
+        FROM old_rows JOIN new_rows ON new_rows.mid = old_rows.mid
+       WHERE (old_rows.issued_to, old_rows.due_date, old_rows.fines) IS DISTINCT FROM (new_rows.issued_to, new_rows.due_date, new_rows.fines)
+    ));
+  ELSIF TG_OP = 'DELETE' THEN
+    PERFORM member_events_notify(array(SELECT DISTINCT issued_to FROM old_rows));
+  END IF;
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION member_events_holds() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'UPDATE' THEN
+    PERFORM member_events_notify(array(
+      SELECT DISTINCT new_rows.uid
+        FROM old_rows JOIN new_rows ON new_rows.uid = old_rows.uid AND new_rows.mid = old_rows.mid
+       WHERE old_rows.state IS DISTINCT FROM new_rows.state
+    ));
+  ELSIF TG_OP = 'DELETE' THEN
+    PERFORM member_events_notify(array(SELECT DISTINCT uid FROM old_rows WHERE state = 'ready'));
+  END IF;
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+-- (New items aren't checked out and new holds aren't ready, so only
+-- updates & deletes can change anyone's notifications)
+DROP TRIGGER IF EXISTS member_events_items_upd ON items;
+DROP TRIGGER IF EXISTS member_events_items_del ON items;
+CREATE TRIGGER member_events_items_upd AFTER UPDATE ON items REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE PROCEDURE member_events_items();
+CREATE TRIGGER member_events_items_del AFTER DELETE ON items REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT EXECUTE PROCEDURE member_events_items();
+
+DROP TRIGGER IF EXISTS member_events_holds_upd ON holds;
+DROP TRIGGER IF EXISTS member_events_holds_del ON holds;
+CREATE TRIGGER member_events_holds_upd AFTER UPDATE ON holds REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE PROCEDURE member_events_holds();
+CREATE TRIGGER member_events_holds_del AFTER DELETE ON holds REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT EXECUTE PROCEDURE member_events_holds();
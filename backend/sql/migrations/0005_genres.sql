@@ -0,0 +1,64 @@
+-- Genres: a table of each location's, which items refer to by ID, rather
+-- than every item carrying its genre's name. Listing a location's genres
+-- doesn't have to go through all its items, renaming one is one row,
+-- and items are found by genre through an integer index
+
+CREATE TABLE IF NOT EXISTS genres (
+  lid  bigint NOT NULL REFERENCES locations ON DELETE CASCADE,
+  id   serial,
+  name text NOT NULL, -- always lowercase
+  PRIMARY KEY (lid, id),
+  UNIQUE (lid, name)
+);
+
+ALTER TABLE items ADD COLUMN IF NOT EXISTS gid int;
+DO $$
+BEGIN
+  -- (with the constraint, a genre can only ever be one of its own location's)
+  IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'items_genre_fkey') THEN
+    ALTER TABLE items ADD CONSTRAINT items_genre_fkey FOREIGN KEY (lid, gid) REFERENCES genres (lid, id);
+  END IF;
+END
+$$;
+CREATE INDEX IF NOT EXISTS items_gid_idx ON items (lid, gid);
+
+-- The ID of location `loc`'s genre named `genre`, which is created if it
+-- doesn't exist yet; NULL for no genre. See Location.add_media()
+CREATE OR REPLACE FUNCTION genre_id(loc bigint, genre text) RETURNS int AS $$
+DECLARE
+  found_id int;
+BEGIN
+  IF coalesce(genre, '') = '' THEN
+    RETURN NULL;
+  END IF;
+  SELECT id INTO found_id FROM genres WHERE lid = loc AND name = lower(genre);
+  IF found_id IS NULL THEN
+    INSERT INTO genres (lid, name) VALUES (loc, lower(genre))
+        ON CONFLICT (lid, name) DO NOTHING
+    RETURNING id INTO found_id;
+    IF found_id IS NULL THEN  -- someone else just made it
+      SELECT id INTO found_id FROM genres WHERE lid = loc AND name = lower(genre);
+    END IF;
+  END IF;
+  RETURN found_id;
+END
+$$ LANGUAGE plpgsql;
+
+-- Existing items' genres move over, and then their names go
+DO $$
+BEGIN
+  IF EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'items' AND column_name = 'genre') THEN
+    INSERT INTO genres (lid, name)
+    SELECT DISTINCT lid, lower(genre) FROM items WHERE coalesce(genre, '') <> ''
+        ON CONFLICT (lid, name) DO NOTHING;
+
+    UPDATE items
+       SET gid = genres.id
+      FROM genres
+     WHERE items.gid IS NULL
+       AND genres.lid = items.lid AND genres.name = lower(items.genre);
+
+    ALTER TABLE items DROP COLUMN genre;
+  END IF;
+END
+$$;
@@ -0,0 +1,80 @@
+-- A member holds a work at most once. 0003 only indexed (uid, wid), so
+-- two copies of a title filed under one work could leave someone with
+-- two holds on it; keep whichever's on the pickup shelf, or else the
+-- first placed, and make the index unique so that User.hold() can lean
+-- on it when two requests race
+DELETE FROM holds
+ USING (
+        SELECT uid, mid, row_number() OVER (PARTITION BY uid, wid ORDER BY state <> 'ready', created, seq) AS n
+          FROM holds
+         WHERE wid IS NOT NULL
+       ) AS ranked
+ WHERE holds.uid = ranked.uid AND holds.mid = ranked.mid
+   AND ranked.n > 1;
+
+DROP INDEX IF EXISTS holds_uid_wid_idx;
+CREATE UNIQUE INDEX holds_uid_wid_idx ON holds (uid, wid);
+
+-- Refiles location `loc`'s items of media type `cur_type` as `new_type`
+-- (NULL for none, i.e. the type was removed). The type's part of each
+-- work's key, so its works are swapped for the ones with the new type,
+-- merging into any that exist already -- holds and all. Call it in the
+-- same transaction as whatever changes mtypes; see MediaType.edit() and
+-- Location.remove_media_type()
+CREATE OR REPLACE FUNCTION works_retype(loc bigint, cur_type text, new_type text) RETURNS void AS $$
+BEGIN
+  IF lower(coalesce(cur_type, '')) = lower(coalesce(new_type, '')) THEN
+    RETURN;  -- (same keys)
+  END IF;
+
+  INSERT INTO works (lid, key, title, author, type)
+  SELECT DISTINCT ON (work_key(title, author, new_type)) lid, work_key(title, author, new_type), title, author, new_type
+    FROM works
+   WHERE lid = loc AND type = cur_type
+   ORDER BY work_key(title, author, new_type), wid
+      ON CONFLICT (lid, key) DO NOTHING;
+
+  -- Someone holding both a work and the one it's merging into keeps
+  -- just one of the two holds, as above
+  WITH moves AS (
+    SELECT old.wid AS old_wid, work.wid AS new_wid
+      FROM works AS old
+      JOIN works AS work ON work.lid = loc AND work.key = work_key(old.title, old.author, new_type)
+     WHERE old.lid = loc AND old.type = cur_type
+  ),
+  ranked AS (
+    SELECT holds.uid, holds.mid,
+           row_number() OVER (PARTITION BY holds.uid, coalesce(moves.new_wid, holds.wid) ORDER BY holds.state <> 'ready', holds.created, holds.seq) AS n
+      FROM holds
+      LEFT JOIN moves ON moves.old_wid = holds.wid
+     WHERE holds.wid IN (SELECT old_wid FROM moves UNION ALL SELECT new_wid FROM moves)
+  )
+  DELETE FROM holds
+   USING ranked
+   WHERE holds.uid = ranked.uid AND holds.mid = ranked.mid
+     AND ranked.n > 1;
+
+  -- (the triggers from 0003 move the counts along with the rows)
+  UPDATE holds
+     SET wid = work.wid
+    FROM works AS old, works AS work
+   WHERE holds.wid = old.wid
+     AND old.lid = loc AND old.type = cur_type
+     AND work.lid = loc AND work.key = work_key(old.title, old.author, new_type);
+
+  UPDATE items
+     SET type = new_type, wid = work.wid
+    FROM works AS old, works AS work
+   WHERE items.wid = old.wid
+     AND old.lid = loc AND old.type = cur_type
+     AND work.lid = loc AND work.key = work_key(old.title, old.author, new_type);
+
+  -- Anything not filed under a work yet (see works_refresh())
+  UPDATE items
+     SET type = new_type
+   WHERE lid = loc AND type = cur_type;
+
+  DELETE FROM works
+   WHERE lid = loc AND type = cur_type;
+END
+$$ LANGUAGE plpgsql;
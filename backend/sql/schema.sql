@@ -0,0 +1,113 @@
+-- The tables the typedef classes (and scheduled_updates.py, and
+-- help-edit.py) expect, for setting up a local DB from scratch -- e.g.
+-- with bench/dataset.py. Changes to these go in migrations, not here.
+
+CREATE TABLE IF NOT EXISTS locations (
+  lid              bigserial PRIMARY KEY,
+  name             text NOT NULL,
+  ip               text,
+  color            int,
+  fine_amt         numeric NOT NULL DEFAULT 0.10,
+  fine_interval    int NOT NULL DEFAULT 1,
+  report_day       text NOT NULL DEFAULT 'monday',
+  last_report_date date
+);
+
+CREATE TABLE IF NOT EXISTS roles (
+  rid         bigserial PRIMARY KEY,
+  lid         bigint NOT NULL REFERENCES locations ON DELETE CASCADE,
+  name        text NOT NULL,
+  isdefault   boolean NOT NULL DEFAULT false,
+  permissions smallint NOT NULL DEFAULT 0, -- Perms
+  limits      bigint, -- Limits
+  locks       bigint  -- Locks
+);
+
+CREATE TABLE IF NOT EXISTS members (
+  uid      bigserial PRIMARY KEY,
+  lid      bigint NOT NULL REFERENCES locations ON DELETE CASCADE,
+  rid      bigint REFERENCES roles ON DELETE SET NULL,
+  username text NOT NULL,
+  pwhash   bytea NOT NULL,
+  fullname text,
+  email    text,
+  phone    text,
+  manages  boolean NOT NULL DEFAULT false,
+  type     smallint NOT NULL DEFAULT 0, -- 1 for checkout accounts
+  recent   text, -- genre of most-recent checkout
+  perms    smallint, -- per-member overrides of the role's; NULL if none
+  limits   bigint,
+  locks    bigint,
+  UNIQUE (lid, username)
+);
+
+CREATE TABLE IF NOT EXISTS mtypes (
+  lid    bigint NOT NULL REFERENCES locations ON DELETE CASCADE,
+  name   text NOT NULL,
+  unit   text,
+  limits bigint,
+  UNIQUE (lid, name)
+);
+
+CREATE TABLE IF NOT EXISTS items (
+  mid       bigserial PRIMARY KEY,
+  lid       bigint NOT NULL REFERENCES locations ON DELETE CASCADE,
+  type      text,
+  isbn      text,
+  title     text NOT NULL,
+  author    text,
+  genre     text,
+  published int,
+  price     numeric,
+  length    int,
+  acquired  date,
+  image     text,
+  limits    bigint,
+  issued_to bigint REFERENCES members ON DELETE SET NULL,
+  due_date  date,
+  fines     numeric
+);
+CREATE INDEX IF NOT EXISTS items_lid_idx ON items (lid);
+CREATE INDEX IF NOT EXISTS items_issued_to_idx ON items (issued_to);
+
+CREATE TABLE IF NOT EXISTS holds (
+  uid     bigint NOT NULL REFERENCES members ON DELETE CASCADE,
+  mid     bigint NOT NULL REFERENCES items ON DELETE CASCADE,
+  created date NOT NULL DEFAULT current_date,
+  UNIQUE (uid, mid)
+);
+
+CREATE TABLE IF NOT EXISTS signups (
+  key         text PRIMARY KEY,
+  date        date NOT NULL DEFAULT current_date,
+  email       text,
+  name        text,
+  color       int,
+  username    text,
+  pwhash      bytea,
+  adminname   text,
+  adminuser   text,
+  adminpwhash bytea
+);
+
+-- Snapshots taken by scheduled_updates.py for the non-live reports
+CREATE TABLE IF NOT EXISTS weeklies (
+  type       text NOT NULL, -- 'item', 'member' or 'hold'
+  lid        bigint,
+  mid        bigint,
+  uid        bigint,
+  rid        bigint,
+  title      text,
+  username   text,
+  issued_to  bigint,
+  due_date   date,
+  fines      numeric,
+  report_day text
+);
+
+CREATE TABLE IF NOT EXISTS help (
+  id      serial PRIMARY KEY,
+  title   text,
+  brief   text,
+  content text
+);
@@ -0,0 +1,145 @@
+"""
+Serves the files generated by Angular's AOT build (./dist on Heroku).
+
+Everything but index.html has a content hash stamped into its filename
+by the build (main.<hash>.bundle.js and so on), meaning a given URL's
+contents can never change -- so those get cached by browsers for good,
+and only index.html (which points to the current bundles) has to be
+revalidated each time. Every file is read and gzipped (plus brotli'd,
+if the brotli module is installed) once at startup rather than per
+request, and conditional GETs are answered with a bodiless 304.
+
+This module also decides which requests are let through to a route
+handler and which are redirected to the Angular app; see classify().
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from glob import glob
+
+import sanic
+
+try:
+    import brotli
+except ImportError:  # optional -- gzip on its own is most of the win anyway
+    brotli = None
+
+DIST = os.getenv('ANGULAR_DIST', '/app/dist')
+FILENAMES = 'index.html', 'favicon.ico', 'styles*.css', 'inline*.js', 'main*.js', 'polyfills*.js', 'scripts*.js'
+HASHED = re.compile(r'\.[0-9a-f]{16,}\.')  # e.g. the .e0f5ea3bb2bac0b3a3b0. in main.e0f5ea3bb2bac0b3a3b0.bundle.js
+COMPRESSIBLE = '.html', '.css', '.js'
+
+IMMUTABLE = 'public, max-age=31536000, immutable'  # a year, i.e. forever as far as browsers care
+REVALIDATE = 'no-cache'  # may be stored, but has to be checked with us (via ETag) before reuse
+NO_STORE = 'no-cache, no-store, must-revalidate'  # default for everything else; see server.py
+
+# First path segments that always go straight to a route handler.
+# Filled out with the names of the static files themselves by register()
+PASSTHROUGH = {'api', 'stock', 'auth', 'verify', 'register', 'metrics', 'admin'}
+# Anything else that looks like a file is let through as well, so that a
+# stale bundle name 404s instead of being redirected to index.html
+PASSTHROUGH_SUFFIXES = '.html', '.css', '.js', '.ts', '.map', '.ico'
+
+
+class Asset:
+    """
+    A single static file, with all its encoded variants held in memory.
+    
+    variants maps a content-coding ('identity', 'gzip', 'br') to a
+    tuple of (body, ETag) for that representation.
+    """
+    __slots__ = 'path', 'content_type', 'cache_control', 'variants'
+    
+    def __init__(self, path):
+        self.path = path
+        self.content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.cache_control = IMMUTABLE if HASHED.search(os.path.basename(path)) else REVALIDATE
+        self.variants = {}
+    
+    def build(self):
+        """
+        Reads & precompresses the file. Blocking, so this is run in an
+        executor at startup.
+        """
+        with open(self.path, 'rb') as f:
+            body = f.read()
+        digest = hashlib.sha1(body).hexdigest()[:20]
+        variants = {'identity': (body, f'"{digest}"')}
+        if self.path.endswith(COMPRESSIBLE):
+            compressed = [('gzip', gzip.compress(body, 9), 'gz')]
+            if brotli is not None:
+                compressed.append(('br', brotli.compress(body), 'br'))
+            for coding, data, suffix in compressed:
+                if len(data) < len(body):
+                    variants[coding] = data, f'"{digest}-{suffix}"'
+        self.variants = variants
+    
+    def negotiate(self, accept_encoding):
+        """
+        Picks the smallest variant the client will take.
+        (Just checks for the codings' presence; nobody sends q=0.)
+        """
+        accepted = {i.split(';')[0].strip() for i in accept_encoding.lower().split(',')}
+        for coding in ('br', 'gzip'):
+            if coding in accepted and coding in self.variants:
+                return coding
+        return 'identity'
+    
+    async def serve(self, rqst):
+        coding = self.negotiate(rqst.headers.get('Accept-Encoding', ''))
+        body, etag = self.variants[coding]
+        headers = {'ETag': etag, 'Cache-Control': self.cache_control, 'Vary': 'Accept-Encoding'}
+        if etag in if_none_match(rqst):
+            return sanic.response.raw(b'', status=304, headers=headers)
+        if coding != 'identity':
+            headers['Content-Encoding'] = coding
+        return sanic.response.raw(body, headers=headers, content_type=self.content_type)
+
+
+def if_none_match(rqst):
+    """
+    Returns the set of ETags a request's If-None-Match header lists.
+    (Weak tags are compared as though they were strong, which is
+    what a GET is supposed to do anyway.)
+    """
+    header = rqst.headers.get('If-None-Match')
+    if not header:
+        return set()
+    return {i.strip().lstrip('W/') for i in header.split(',')}
+
+
+def register(app, dist=DIST):
+    """
+    Routes /<filename> to each of Angular's generated files. Only globs
+    the filenames -- building the assets themselves is left to build()
+    once the server's starting up.
+    """
+    app.static_assets = []
+    for pattern in FILENAMES:
+        for path in glob(os.path.join(dist, pattern)):
+            asset = Asset(path)
+            name = os.path.basename(path)
+            app.add_route(asset.serve, '/' + name, methods=['GET'])
+            app.static_assets.append(asset)
+            PASSTHROUGH.add(name)
+
+
+async def build(app, loop):
+    """Reads and compresses every registered asset in the background."""
+    for asset in app.static_assets:
+        await loop.run_in_executor(None, asset.build)
+
+
+def classify(path):
+    """
+    Whether a request for `path` should be let through to the app's
+    route handlers (True) or redirected to the Angular app (False).
+    This is just a set lookup on its first segment, as in:
+    
+    '/api/roles/me' -> 'api' -> True
+    '/manage/roles' -> 'manage' -> False
+    """
+    segment = path.split('/', 2)[1]
+    return segment in PASSTHROUGH or segment.endswith(PASSTHROUGH_SUFFIXES)
@@ -0,0 +1,76 @@
+"""
+Streams big listings (a whole location's members or items) out as they
+come off a server-side cursor, instead of fetching every row into a list
+and serializing that in one go -- so a library with 500,000 members costs
+the same memory to list as one with 500.
+
+Each row's JSON is built by Postgres (row_to_json(); comes back as bytes,
+see init_connection() in pool.py), and a batch at a time is written to
+the response either as NDJSON (one object per line) or as one JSON array.
+Writing waits whenever the client's falling behind (see drain()), and
+stops altogether if they go away, which also closes the cursor.
+
+The connection's held for as long as the stream is, though, which is
+what the `exports` rate limit is for.
+"""
+import asyncio
+
+import sanic
+
+BATCH = 500  # rows fetched from the cursor at a time
+HIGH_WATER = 256 * 1024  # bytes buffered for the client before waiting on them...
+LOW_WATER = 64 * 1024    # ...until it's back down to this
+DRAIN_POLL = 0.05  # s
+
+NDJSON = 'application/x-ndjson'
+
+
+def wants_ndjson(rqst):
+    return NDJSON in rqst.headers.get('Accept', '')
+
+
+async def drain(resp):
+    """
+    Sanic doesn't wait on the transport when writing, so this does: if
+    what's been written hasn't gone out yet, waits for most of it to.
+    Returns whether the client's still there.
+    """
+    transport = resp.transport
+    if transport.get_write_buffer_size() > HIGH_WATER:
+        while not transport.is_closing() and transport.get_write_buffer_size() > LOW_WATER:
+            await asyncio.sleep(DRAIN_POLL)
+    return not transport.is_closing()
+
+
+def rows(app, query, *args, ndjson=False, headers=None):
+    """
+    A streaming response of `query`'s results, which have to be a single
+    json column per row (i.e. `SELECT row_to_json(x) FROM (...) AS x`).
+    """
+    async def stream(resp):
+        first = True
+        async with app.pg_pool.acquire() as conn, conn.transaction(readonly=True):
+            cursor = await conn.cursor(query, *args)
+            if not ndjson:
+                resp.write(b'[')
+            while True:
+                batch = await cursor.fetch(BATCH)
+                if not batch:
+                    break
+                chunk = (b'\n' if ndjson else b',').join(row[0] for row in batch)
+                if ndjson:
+                    chunk += b'\n'
+                elif not first:
+                    chunk = b',' + chunk
+                first = False
+                resp.write(chunk)
+                if not await drain(resp):
+                    return
+            if not ndjson:
+                resp.write(b']')
+    
+    return sanic.response.stream(
+      stream,
+      content_type=NDJSON if ndjson else 'application/json',
+      headers=headers
+      )
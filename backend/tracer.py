@@ -0,0 +1,167 @@
+"""
+Opt-in query tracer for the DB pool (see pool.py), turned on by setting
+SLOW_QUERY_MS.
+
+Every statement run through the pool is tallied up against the typedef
+method (or whatever else) that ran it. Any that take SLOW_QUERY_MS or
+longer are also logged to a ring buffer, and get EXPLAINed in the
+background on a connection of the tracer's own -- with ANALYZE and
+BUFFERS if it's a plain read, and inside a transaction that's always
+rolled back regardless. The lot is served at /admin/slow-queries.
+
+Parameter values are never stored, only their types (and lengths, for
+strings and arrays), since half of them are names or password hashes.
+Neither are literals in the SQL itself (like the lids Location.report()
+formats in): statements are tallied with those taken out, so that each
+one's a single entry however many locations run it, and only the
+MAX_STATEMENTS that have taken the most time overall are kept.
+"""
+import asyncio
+import os
+import re
+import sys
+import time
+from collections import deque
+
+import asyncpg
+
+BACKEND = os.path.dirname(os.path.abspath(__file__))
+IGNORE = {os.path.join(BACKEND, 'pool.py'), os.path.join(BACKEND, 'tracer.py')}
+TRACED = frozenset({'execute', 'executemany', 'fetch', 'fetchval', 'fetchrow'})
+
+EXPLAINABLE = re.compile(r'^\s*(SELECT|WITH|INSERT|UPDATE|DELETE)\b', re.IGNORECASE)
+WRITES = re.compile(r'\b(INSERT|UPDATE|DELETE|pg_notify|nextval|setval)\b', re.IGNORECASE)
+# Quoted strings and numbers, but not $1-style placeholders or digits in names
+LITERALS = re.compile(r"'(?:[^']|'')*'|(?<![\w$])\d+(?:\.\d+)?\b")
+
+MAX_STATEMENTS = 1000
+
+
+def caller(depth=2):
+    """
+    Name of the nearest function up the stack that belongs to the app
+    (rather than to the pool wrapper, asyncpg, or the stdlib), as
+    "Class.method" if it's a method and "module.function" otherwise.
+    """
+    frame = sys._getframe(depth)
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if filename not in IGNORE and (filename.startswith(BACKEND) or filename.endswith('server.py')):
+            owner = frame.f_locals.get('self', frame.f_locals.get('cls'))
+            if owner is None:
+                prefix = os.path.splitext(os.path.basename(filename))[0]
+            else:
+                prefix = (owner if isinstance(owner, type) else type(owner)).__name__
+            return f'{prefix}.{frame.f_code.co_name}'
+        frame = frame.f_back
+    return '<unknown>'
+
+
+def normalize(query):
+    """`query` with its literals swapped out, e.g. "lid = 12" -> "lid = ?"."""
+    return LITERALS.sub('?', query)
+
+
+def shape(args):
+    """e.g. ('int', 'str[12]', 'list[40]') for (5, 'fred@foo.com', [...])"""
+    def describe(arg):
+        name = type(arg).__name__
+        return f'{name}[{len(arg)}]' if isinstance(arg, (str, bytes, list, tuple)) else name
+    return tuple(map(describe, args))
+
+
+class QueryTracer:
+    """
+    threshold  (float): Seconds; statements taking this long or longer are logged
+    slow       (deque): Ring buffer of the last `size` slow statements, newest last
+    statements (dict):  (caller, normalized query) -> [count, total seconds, max seconds],
+                        for at most MAX_STATEMENTS statements
+    """
+    def __init__(self, dsn, threshold_ms, *, size=100, explain_interval=60, explain_timeout=10, loop=None):
+        self.dsn = dsn
+        self.threshold = threshold_ms / 1000
+        self.slow = deque(maxlen=size)
+        self.statements = {}
+        self.explain_interval = explain_interval  # don't re-EXPLAIN a statement more often than this (s)
+        self.explain_timeout = explain_timeout
+        self._loop = loop or asyncio.get_event_loop()
+        self._conn = None
+        self._lock = asyncio.Lock(loop=self._loop)
+        self._last_explained = {}
+    
+    def record(self, method, where, args, seconds):
+        """Called by the pool wrapper after every statement it runs."""
+        if method not in TRACED or not args:
+            return
+        query, params = args[0], args[1:]
+        if method == 'executemany':
+            params = next(iter(params[0]), ()) if params else ()
+        key = where, normalize(query)
+        try:
+            stats = self.statements[key]
+        except KeyError:
+            if len(self.statements) >= MAX_STATEMENTS:
+                # Make room by dropping whichever's taken the least time,
+                # which is the least interesting one to keep
+                del self.statements[min(self.statements, key=lambda k: self.statements[k][1])]
+            stats = self.statements[key] = [0, 0.0, 0.0]
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] = max(stats[2], seconds)
+        
+        if seconds < self.threshold:
+            return
+        entry = {
+          'at': time.time(),
+          'caller': where,
+          'method': method,
+          'query': query,
+          'params': shape(params),
+          'ms': round(seconds * 1000, 3),
+          'plan': None,
+          }
+        self.slow.append(entry)
+        now = time.monotonic()
+        if EXPLAINABLE.match(query) and now - self._last_explained.get(key, -self.explain_interval) >= self.explain_interval:
+            if len(self._last_explained) >= MAX_STATEMENTS:
+                self._last_explained = {k: t for k, t in self._last_explained.items() if now - t < self.explain_interval}
+            self._last_explained[key] = now
+            self._loop.create_task(self._explain(entry, query, params))
+    
+    async def _explain(self, entry, query, params):
+        analyze = not WRITES.search(query)  # don't actually redo writes, even rolled back
+        async with self._lock:  # one at a time on the one connection
+            try:
+                if self._conn is None or self._conn.is_closed():
+                    self._conn = await asyncpg.connect(dsn=self.dsn, loop=self._loop)
+                tr = self._conn.transaction()
+                await tr.start()
+                try:
+                    await self._conn.execute(f'''SET LOCAL statement_timeout = {int(self.explain_timeout * 1000)}''')
+                    rows = await self._conn.fetch(
+                      ('EXPLAIN (ANALYZE, BUFFERS) ' if analyze else 'EXPLAIN ') + query,
+                      *params
+                      )
+                finally:
+                    await tr.rollback()
+            except Exception as e:
+                entry['plan'] = f'EXPLAIN failed: {e!r}'
+            else:
+                entry['plan'] = '\n'.join(row[0] for row in rows)
+                entry['analyzed'] = analyze
+    
+    def dump(self, top=25):
+        """Everything the tracer has, newest slow statement first."""
+        by_total = sorted(self.statements.items(), key=lambda kv: kv[1][1], reverse=True)[:top]
+        return {
+          'threshold_ms': self.threshold * 1000,
+          'slow': list(reversed(self.slow)),
+          'statements': [
+            {'caller': where, 'query': query, 'count': count, 'total_ms': round(total * 1000, 3), 'max_ms': round(longest * 1000, 3)}
+            for (where, query), (count, total, longest) in by_total
+            ],
+          }
+    
+    async def close(self):
+        if self._conn is not None:
+            await self._conn.close()
@@ -1,30 +1,25 @@
-import aiofiles
 import io
 import uuid
 import string
 from decimal import Decimal
-from types import ModuleType
 
-import bcrypt
-import pandas
-
-from ..core import AsyncInit
+from .. import sessions
+from ..core import AsyncInit, typedefs
+from ..singleflight import SingleFlight
 from ..attributes import Perms, Limits, Locks
-
-
-# These are 'variable annotations', used in python 3.6 for introducing
-# a variable before actually assigning to it. I'm just using them here
-# so pylint stops whinging about my do_imports() method using `global`
-MediaItem: ModuleType
-MediaType: ModuleType
-Role: ModuleType
-User: ModuleType
+from .mediaitem import UPSERT_WORK
 
 # first two args map to each other; str.maketrans('ab', 'xy') turns 'a'->'x' and 'b'-'>y'
 # third arg is what chars to map to nothing (i.e. to delete)
 # so i'm just deleting (almost) all punctuation
 GBQUERY = str.maketrans('', '', r"""!"#$%&'()*+,-./:;<=>?@[\]^_`{|}~""")
 NO_PUNC = str.maketrans('', '', string.punctuation)
+SEARCHES = SingleFlight('search')
+
+
+async def _aiter(iterable):
+    for i in iterable:
+        yield i
 
 
 class Location(AsyncInit):
@@ -42,6 +37,8 @@ class Location(AsyncInit):
     _color        (int):      Raw number representing location's preferred color/scheme. Private variable.
     fine_interval (int):      How often overdue fines are compounded.
     """
+    coalesce = True  # every request from a location loads it; see core.py
+    
     props = [
       'lid',
       'name',
@@ -51,11 +48,6 @@ class Location(AsyncInit):
       'fine_interval'
       ]
     
-    @staticmethod
-    def do_imports():
-        global Role, MediaItem, MediaType, User
-        from . import Role, MediaItem, MediaType, User
-    
     async def __init__(self, lid, app, *, owner=None):
         self._app = app
         self.pool = self._app.pg_pool
@@ -66,7 +58,7 @@ class Location(AsyncInit):
             name, ip, fine_amt, fine_interval, color, last_report = await conn.fetchrow(query, self.lid)
             query = '''SELECT uid FROM members WHERE lid = $1 AND manages = true'''
             ouid = await conn.fetchval(query, self.lid)
-        self.owner = await User(ouid, self._app, location=self) if owner is None else owner  # just for consistency; don't think the `else` will ever be used though
+        self.owner = await typedefs.User(ouid, self._app, location=self) if owner is None else owner  # just for consistency; don't think the `else` will ever be used though
         self.name = name
         self.ip = ip
         self.fine_amt = fine_amt
@@ -157,6 +149,9 @@ class Location(AsyncInit):
               FROM signups
              WHERE key = $1::text
             ''', token))
+        # Signing up is rare enough not to load these at every startup
+        import aiofiles
+        import bcrypt
         fetch['ip'] = rqst.ip
         fetch['pwhash'] = await rqst.app.aexec(None, bcrypt.hashpw, checkoutpw.encode(), bcrypt.gensalt(12))
         fetch['adminpwhash'] = await rqst.app.aexec(None, bcrypt.hashpw, adminpw.encode(), bcrypt.gensalt(12))
@@ -202,6 +197,7 @@ class Location(AsyncInit):
         """
         Fix+reorder all necessary attributes to match DB in the user CSV dataframe.
         """
+        import bcrypt
         df.password = df.password.str.encode('utf-8')
         df.password = df.password.apply(lambda pw: bcrypt.hashpw(pw, salt=bcrypt.gensalt(12)))
         # assign the given role ID to all members
@@ -213,7 +209,7 @@ class Location(AsyncInit):
         # str(), I'm pretty sure)
         return df[['rid', 'lid', 'type', 'fullname', 'username', 'password']].applymap(lambda b: b.decode() if isinstance(b, bytes) else b)
     
-    async def add_members_batch(self, file, rid):
+    async def add_members_batch(self, file, rid, *, progress=None):
         """
         Batch addition of members.
         
@@ -224,11 +220,24 @@ class Location(AsyncInit):
         
         `rid` is the ID of the role that is to be assigned
         to each added member.
-        """
+        
+        `progress`, if given, is awaited with how far along this is
+        (0 to 1) every so often; it's run as a background job, see
+        jobs.py.
+        """
+        # Pandas is by far our heaviest dependency and this is the only
+        # place it's used, so it only gets imported once someone actually
+        # uploads a CSV (rather than slowing down every single cold start)
+        import pandas
         # load the file as a Pandas dataframe
         df = await self._app.aexec(None, pandas.read_csv, file)
+        if progress is not None:
+            await progress(0.1)
         # Rearrange columns & add necessary info
+        # (bcrypt'ing every password is what takes so long)
         df = await self._app.aexec(None, self._fix, df, rid)
+        if progress is not None:
+            await progress(0.9)
         async with self.acquire() as conn:
             return await conn.copy_to_table(
               'members',
@@ -239,7 +248,7 @@ class Location(AsyncInit):
               )
         # w amre la alla that it works
     
-    async def report(self, live: bool, **do):
+    async def report(self, live: bool, *, progress=None, **do):
         """
         `do` is in the format:
         
@@ -249,6 +258,8 @@ class Location(AsyncInit):
         generate a report for.
         
         `live` determines whether to serve a live report or one stored from the week prior.
+        
+        `progress` is as for add_members_batch().
         """
         def query_setup(name: str, sort_by):
             num = (sort_by == 'per_user') or 2 * (sort_by == 'per_role')
@@ -302,10 +313,22 @@ class Location(AsyncInit):
         query += f'''
         AND items.lid = {self.lid}
         '''
-        search_opts = ([{}], await self.members(by_role=False), await self.roles())
+        # Members are gone through with a cursor rather than all loaded
+        # up front, since there might be an awful lot of them
+        search_opts = ([{}], None, await self.roles() if sort_by == 'per_role' else None)
         to_search, key, param = query_setup(col, sort_by)
-        async with self.acquire() as conn:
-            for obj in to_search:
+        async with self.acquire() as conn, conn.transaction(readonly=True):
+            if to_search is None:
+                total = await conn.fetchval('''SELECT count(*) FROM members WHERE lid = $1::bigint AND type = 0''', self.lid)
+                to_search = conn.cursor('''SELECT uid, username FROM members WHERE lid = $1::bigint AND type = 0 ORDER BY uid''', self.lid)
+            else:
+                total = len(to_search)
+                to_search = _aiter(to_search)
+            i = 0
+            async for obj in to_search:
+                if progress is not None:
+                    await progress(i / total)
+                i += 1
                 search = (
                   conn.fetch(query) if sort_by == 'all' else
                   conn.fetch(query, obj.get(param, None))
@@ -319,28 +342,64 @@ class Location(AsyncInit):
         """
         query = '''SELECT uid FROM members WHERE username = $1::text AND lid = $2::bigint AND type = 0'''
         uid = await self.pool.fetchval(query)
-        return await User(uid, self._app, location=self)
+        return await typedefs.User(uid, self._app, location=self)
     
     async def members(self, by_role=True, *, limit=True, cont=0, max_results=15):
         """
-        Serves all of this location's members.
+        Serves all of this location's members, as JSON (bytes) that
+        Postgres puts together itself -- roles and all, in the one query.
+        For every last one of them, see members_export().
         """
-        roles = {}
-        async with self.acquire() as conn:
-            if by_role:
-                for role in await self.roles():
-                    query = '''SELECT uid, username, fullname FROM members WHERE lid = $1::bigint AND rid = $2::bigint AND type = 0''' \
-                            + ('''LIMIT {} OFFSET {}'''.format(max_results, cont) if limit else '')
-                    roles[role['name']] = (role['rid'], await conn.fetch(query, self.lid, role['rid']))
-                return [{'name': role, 'rid': rid, 'data': [{j: i[j] for j in ('uid', 'username', 'fullname')} for i in user]} for role, (rid, user) in roles.items()]
-            query = '''SELECT uid, username, fullname FROM members WHERE lid = $1::bigint AND type = 0''' \
-                    + ('''LIMIT {} OFFSET {}'''.format(max_results, cont) if limit else '')
-            return [{j: i[j] for j in ('uid', 'username', 'fullname')} for i in await conn.fetch(query, self.lid)]
+        page = '''LIMIT {} OFFSET {}'''.format(max_results, cont) if limit else ''
+        if by_role:
+            query = '''
+            SELECT coalesce(json_agg(json_build_object('name', roles.name, 'rid', roles.rid, 'data', (
+                     SELECT coalesce(json_agg(m ORDER BY m.uid), '[]')
+                       FROM (
+                              SELECT uid, username, fullname
+                                FROM members
+                               WHERE lid = $1::bigint AND rid = roles.rid AND type = 0
+                            ORDER BY uid
+                              {}
+                            ) AS m
+                   )) ORDER BY roles.rid), '[]')
+              FROM roles
+             WHERE lid = $1::bigint
+            '''.format(page)
+        else:
+            query = '''
+            SELECT coalesce(json_agg(m ORDER BY m.uid), '[]')
+              FROM (
+                     SELECT uid, username, fullname
+                       FROM members
+                      WHERE lid = $1::bigint AND type = 0
+                   ORDER BY uid
+                     {}
+                   ) AS m
+            '''.format(page)
+        return await self.pool.fetchval(query, self.lid)
+    
+    def members_export(self):
+        """
+        (query, *args) for all this location's members, one JSON object
+        per row, for streaming.rows().
+        """
+        query = '''
+        SELECT row_to_json(m)
+          FROM (
+                 SELECT members.uid, members.username, members.fullname, members.rid, roles.name AS role
+                   FROM members LEFT JOIN roles ON roles.rid = members.rid
+                  WHERE members.lid = $1::bigint AND members.type = 0
+               ORDER BY members.uid
+               ) AS m
+        '''
+        return query, self.lid
     
     async def add_member(self, username, password, rid, fullname):
         """
         Adds a new member to this location, given the above info.
         """
+        import bcrypt
         pwhash = await self._app.aexec(self._app.ppe, bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt(12))
         query = '''
         INSERT INTO members (
@@ -364,28 +423,61 @@ class Location(AsyncInit):
         keyword-based arguments in queries, and it also does not support
         'ignoring' certain arguments, so I have to instead construct a
         query with *only* the expressions I'm looking for.
+        
+        Searches works rather than items, so there's one result per title
+        however many copies there are, each with how many of them there are
+        and how many are available. Genre and where_taken are per copy, so
+        they pick which copy represents the work (available ones first).
         """
-        search_terms = title, genre, author, type_
+        search_terms = title, author, type_, genre
         query = (
-          '''SELECT DISTINCT ON (lower(title)) title, mid, author, genre, type, issued_to, image FROM items WHERE true '''  # stupid hack coming up
-          + ('''AND title ILIKE '%' || ${}::text || '%' ''' if title else '')
-          + ('''AND genre ILIKE '%' || ${}::text || '%' ''' if genre else '')
-          + ('''AND author ILIKE '%' || ${}::text || '%' ''' if author else '')
-          + ('''AND type ILIKE '%' || ${}::text || '%' ''' if type_ else '')
-          + ('''AND false ''' if not any(search_terms) else '')  # because 'WHERE true' otherwise returns everything if not any(search_terms)
-          + ('''AND issued_to IS {} NULL '''.format(('', 'NOT')[where_taken]) if where_taken is not None else '')
-          + ('''ORDER BY lower(title) ''')  # just to establish a consistent order for `cont' param
-          ).format(*range(1, 1+sum(map(bool, search_terms)))) \
+          '''
+          SELECT works.wid, works.title, works.author, works.type, works.copies, works.available - works.on_shelf AS available,
+                 items.mid, genres.name AS genre, items.issued_to, items.image
+            FROM works
+            JOIN LATERAL (
+                   SELECT mid, lid, gid, issued_to, image
+                     FROM items
+                    WHERE items.wid = works.wid '''
+          # (the matching genres are looked up by name first, so the items themselves are by ID)
+          + ('''AND items.gid IN (SELECT id FROM genres WHERE genres.lid = works.lid AND genres.name ILIKE '%' || ${}::text || '%') ''' if genre else '')
+          + ('''AND items.issued_to IS {} NULL '''.format(('', 'NOT')[where_taken]) if where_taken is not None else '')
+          + '''
+                 ORDER BY items.issued_to IS NOT NULL, items.mid
+                    LIMIT 1
+                 ) AS items ON true
+       LEFT JOIN genres ON genres.lid = items.lid AND genres.id = items.gid
+           WHERE works.lid = ${}::bigint '''
+          + ('''AND works.title ILIKE '%' || ${}::text || '%' ''' if title else '')
+          + ('''AND works.author ILIKE '%' || ${}::text || '%' ''' if author else '')
+          + ('''AND works.type ILIKE '%' || ${}::text || '%' ''' if type_ else '')
+          + ('''AND false ''' if not any(search_terms) else '')  # because otherwise it'd return everything if not any(search_terms)
+          + ('''ORDER BY lower(works.title), works.wid ''')  # just to establish a consistent order for `cont' param
+          ).format(*range(1, 2+sum(map(bool, search_terms)))) \
           + ('''LIMIT {} OFFSET {} ''').format(max_results, cont)  # these are ok not to parameterize because they're internal
-        results = await self.pool.fetch(query, *filter(bool, search_terms))
+        # genre's placeholder comes first in the query, then lid's, then the rest
+        params = [genre] if genre else []
+        params += [self.lid, *filter(bool, (title, author, type_))]
         if where_taken is not None:  # this means I'm calling it from in here and so I probably want an actual MediaItem or at least no junk
+            results = await self.pool.fetch(query, *params)
             if max_results == 1:
-                return await MediaItem(results[0]['mid'], app=self._app)
+                return await typedefs.MediaItem(results[0]['mid'], app=self._app)
             return [i['mid'] for i in results]
         # I'd have liked to provide a full MediaItem for each result,
         # but that would take so so so so so unbearably long on Heroku's DB speeds,
-        # not to mention being just pretty all-around inefficient
-        return [{j: i[j] for j in ('mid', 'title', 'author', 'genre', 'type', 'issued_to', 'image')} for i in results]
+        # not to mention being just pretty all-around inefficient.
+        # So it's just the JSON for them (bytes), straight from Postgres
+        query = '''
+        SELECT coalesce(json_agg(json_build_object(
+                 'mid', r.mid, 'title', r.title, 'author', r.author, 'genre', r.genre, 'type', r.type,
+                 'issued_to', r.issued_to, 'image', r.image, 'copies', r.copies, 'available', r.available
+               ) ORDER BY lower(r.title), r.wid), '[]')
+          FROM ({}) AS r
+        '''.format(query)
+        # A whole class searching for the same thing at once only needs the one query
+        # (case doesn't matter to ILIKE, so it doesn't to the key either)
+        key = (self.lid, *(i and i.lower() for i in search_terms), int(cont), max_results)
+        return await SEARCHES.do(key, lambda: self.pool.fetchval(query, *params))
     
     async def roles(self, *, lower_than: Perms.raw = None):
         """
@@ -394,22 +486,24 @@ class Location(AsyncInit):
         effects 'filtering' -- only returns the roles whose
         permissions number is lower than it, to prevent less-endowed
         operators from assigning higher-permed roles to members.
+        
+        Unlike the other listings this isn't JSON from Postgres, because
+        the perms/limits/locks get unpacked by attributes.py; but each
+        role's member count comes along in the same query at least.
         """
-        async with self.acquire() as conn:
-            query = '''
-            SELECT rid, name, isdefault, permissions AS perms, limits, locks
-              FROM roles
-             WHERE lid = $1::bigint
-            '''
-            sums = '''SELECT count(*) FROM members WHERE rid = $1::bigint'''
-            res = [{j: i[j] for j in ('rid', 'name', 'isdefault', 'perms', 'limits', 'locks')} for i in await conn.fetch(query, self.lid)]
-            if lower_than and lower_than < 127:  # if it isn't an admin role
-                res = [i for i in res if i['perms'] < lower_than]
-            for i in res:
-                i['perms'] = Perms(i['perms']).props
-                i['limits'] = Limits(i['limits']).props
-                i['locks'] = Locks(i['locks']).props
-                i['count'] = await conn.fetchval(sums, i['rid'])
+        query = '''
+        SELECT rid, name, isdefault, permissions AS perms, limits, locks,
+               (SELECT count(*) FROM members WHERE members.rid = roles.rid) AS count
+          FROM roles
+         WHERE lid = $1::bigint
+        '''
+        res = [{j: i[j] for j in ('rid', 'name', 'isdefault', 'perms', 'limits', 'locks', 'count')} for i in await self.pool.fetch(query, self.lid)]
+        if lower_than and lower_than < 127:  # if it isn't an admin role
+            res = [i for i in res if i['perms'] < lower_than]
+        for i in res:
+            i['perms'] = Perms(i['perms']).props
+            i['limits'] = Limits(i['limits']).props
+            i['locks'] = Locks(i['locks']).props
         return res
     
     async def add_role(self, name, *, kws=None, seqs=None):
@@ -419,7 +513,7 @@ class Location(AsyncInit):
         from either of which the perms/limits/locks objects can be
         constructed.
         """
-        perms, limits, locks = Role.attrs_from(seqs=seqs, kws=kws)
+        perms, limits, locks = typedefs.Role.attrs_from(seqs=seqs, kws=kws)
         async with self.acquire() as conn:
             query = '''
             INSERT INTO roles (
@@ -431,23 +525,66 @@ class Location(AsyncInit):
             '''
             await conn.execute(query, self.lid, name, perms.raw, limits.raw, locks.raw)
             rid = await conn.fetchval('''SELECT currval(pg_get_serial_sequence('roles', 'rid'))''')
-        return await Role(rid, self._app, location=self)
+        self._app.versions.bump(self.lid, 'roles')
+        return await typedefs.Role(rid, self._app, location=self)
     
     async def items(self, *, cont=0, max_results=5):
         """
         Returns all this location's items in chunks of
         max_results items, on page cont.
+        
+        As JSON ({"items": [...]}, in bytes), which Postgres puts
+        together itself, so none of the rows ever have to be turned
+        into Python objects just to be turned straight back into JSON.
         """
         query = '''
-        SELECT mid, type, title, author, genre, image
-          FROM items
-         WHERE lid = $1::bigint
-      ORDER BY title
-         LIMIT {}
-        OFFSET {}
+        SELECT json_build_object('items', coalesce(json_agg(page ORDER BY page.title, page.mid), '[]'))
+          FROM (
+                 SELECT items.mid, items.type, items.title, items.author, genres.name AS genre, items.image
+                   FROM items LEFT JOIN genres ON genres.lid = items.lid AND genres.id = items.gid
+                  WHERE items.lid = $1::bigint
+               ORDER BY items.title, items.mid
+                  LIMIT {}
+                 OFFSET {}
+               ) AS page
         '''.format(max_results, cont)
-        res = await self.pool.fetch(query, self.lid)
-        return [{j: i[j] for j in ('mid', 'type', 'title', 'author', 'genre', 'image')} for i in res]
+        return await self.pool.fetchval(query, self.lid)
+    
+    def items_export(self):
+        """As members_export(), but all this location's items."""
+        query = '''
+        SELECT row_to_json(i)
+          FROM (
+                 SELECT items.mid, items.type, items.title, items.author, genres.name AS genre, items.isbn, items.image, items.issued_to, items.due_date
+                   FROM items LEFT JOIN genres ON genres.lid = items.lid AND genres.id = items.gid
+                  WHERE items.lid = $1::bigint
+               ORDER BY items.title, items.mid
+               ) AS i
+        '''
+        return query, self.lid
+    
+    async def pickup_shelf(self):
+        """
+        Returns the copies set aside for members' holds, i.e. what
+        should be on the pickup shelf, soonest-to-expire first.
+        """
+        query = '''
+        SELECT items.mid, items.title, items.author, items.type, members.uid, members.username, members.fullname, holds.ready_since, holds.expires
+          FROM holds
+          JOIN items ON items.mid = holds.ready_mid
+          JOIN members ON members.uid = holds.uid
+         WHERE holds.lid = $1::bigint
+           AND holds.state = 'ready'
+      ORDER BY holds.expires
+        '''
+        return [
+          {
+            **{j: i[j] for j in ('mid', 'title', 'author', 'type', 'uid', 'username', 'fullname')},
+            'ready_since': str(i['ready_since']),
+            'expires': str(i['expires']),
+            }
+          for i in await self.pool.fetch(query, self.lid)
+          ]
     
     async def edit(self, locname, color, checkoutpw, fine_amt, fine_interval):
         """Checkout password can be empty"""
@@ -464,6 +601,7 @@ class Location(AsyncInit):
         await self.pool.execute(query, self.lid, locname, color, fine_amt, fine_interval)
         checkout_pwhash = checkoutpw
         if checkoutpw is not None:
+            import bcrypt
             checkout_pwhash = await self._app.aexec(None, bcrypt.hashpw, checkoutpw.encode(), bcrypt.gensalt(12))
         query = '''
         SELECT pwhash FROM members
@@ -477,13 +615,21 @@ class Location(AsyncInit):
            AND type = 1
         '''
         await self.pool.execute(query, self.lid, checkout_pwhash)
+        self._app.versions.bump(self.lid, 'location')
+        if checkoutpw is not None:
+            # Anyone still logged in with the old password gets kicked out
+            await sessions.revoke_location(self._app, self.lid, type_=1)
     
     async def media_types(self):
         """
         Returns all this location's media types, with their limits included as a Limits obj.
+        Cached (see attrcache.py), so don't change what comes back.
         """
-        query = '''SELECT name, limits FROM mtypes WHERE lid = $1::bigint'''
-        return [{'name': i['name'], 'limits': Limits(i['limits'])} for i in await self.pool.fetch(query, self.lid)]
+        async def fetch():
+            query = '''SELECT name, limits FROM mtypes WHERE lid = $1::bigint'''
+            return [{'name': i['name'], 'limits': Limits(i['limits'])} for i in await self.pool.fetch(query, self.lid)]
+        cache = getattr(self._app, 'attr_cache', None)
+        return await fetch() if cache is None else await cache.get(self.lid, 'mtypes', fetch)
     
     async def add_media_type(self, name, unit, limits: Limits.props):
         """
@@ -495,14 +641,15 @@ class Location(AsyncInit):
         SELECT $1::text, $2::text, $3::bigint, $4::bigint
         '''
         await self.pool.execute(query, name.lower(), unit.lower(), Limits.from_kwargs(**limits).raw, self.lid)
-        return await MediaType(name.lower(), self, self._app)
+        self._app.versions.bump(self.lid, 'mtypes')
+        return await typedefs.MediaType(name.lower(), self, self._app)
     
     async def edit_media_type(self, mtype, *, limits=None, name=None, unit=None):
         """
         Edit's a media type's limits, unit, and name.
         """
-        mtype = await MediaType(mtype.lower(), self, self._app)
-        await mtype.edit(limits=limits and Limits.from_kwargs(**limits).raw, name=name.lower(), unit=unit)
+        mtype = await typedefs.MediaType(mtype.lower(), self, self._app)
+        await mtype.edit(limits=limits and Limits.from_kwargs(**limits).raw, name=name and name.lower(), unit=unit)
     
     async def remove_media_type(self, name):
         """
@@ -510,62 +657,77 @@ class Location(AsyncInit):
         any media items might have it.
         (If this isn't done MediaItem throws "this type doesn't exist yet"
         whenever you try to access one of said items' info)
+        The items go to type-less works, merging with any already there.
         """
         query = '''
         DELETE FROM mtypes
          WHERE name = $1::text
            AND lid = $2::bigint
         '''
-        await self.pool.execute(query, name, self.lid)
-        query = '''
-        UPDATE items
-           SET type = NULL
-         WHERE type = $1::text
-           AND lid = $2::bigint
-        '''
-        await self.pool.execute(query, name, self.lid)
+        async with self.acquire() as conn, conn.transaction():
+            await conn.execute(query, name, self.lid)
+            await conn.execute('''SELECT works_retype($1::bigint, $2::text, NULL)''', self.lid, name)
+        self._app.versions.bump(self.lid, 'mtypes')
     
     async def genres(self):
         """
-        Grabs all a location's genres.
-        There's no actual table storing genres, of course --
-        -- they're literally just names and one item isn't enough data
-        to necessitate a whole table ofc --
-        -- so I grab whatever's in the genres column of the items table.
+        Grabs all a location's genres -- or the ones any of its items
+        are actually in, anyway, which is one index lookup per genre.
+        Cached (see attrcache.py), so don't change what comes back.
         """
-        query = '''
-        SELECT DISTINCT lower(genre) AS genre FROM items WHERE lid = $1::bigint ORDER BY lower(genre)
-        '''
-        return [i['genre'] for i in await self.pool.fetch(query, self.lid)]
+        async def fetch():
+            query = '''
+            SELECT name
+              FROM genres
+             WHERE lid = $1::bigint
+               AND EXISTS (SELECT 1 FROM items WHERE items.lid = genres.lid AND items.gid = genres.id)
+          ORDER BY name
+            '''
+            return [i['name'] for i in await self.pool.fetch(query, self.lid)]
+        cache = getattr(self._app, 'attr_cache', None)
+        return await fetch() if cache is None else await cache.get(self.lid, 'genres', fetch)
     
     async def rename_genre(self, cur, to):
         """
-        Changes the name of a genre, from [cur]rent value [to] a new value
-        """
-        await self.pool.execute(
-          '''UPDATE items SET genre = lower($2::text) WHERE genre = lower($1::text)''', cur, to
-          )
+        Changes the name of a genre, from [cur]rent value [to] a new value.
+        That's just the one row, unless there's already a genre called
+        that, in which case the two are merged.
+        """
+        async with self.acquire() as conn, conn.transaction():
+            query = '''SELECT id FROM genres WHERE lid = $1::bigint AND name = lower($2::text)'''
+            gid, into = await conn.fetchval(query, self.lid, cur), await conn.fetchval(query, self.lid, to)
+            if gid is None:
+                return
+            if into is None:
+                await conn.execute('''UPDATE genres SET name = lower($3::text) WHERE lid = $1::bigint AND id = $2::int''', self.lid, gid, to)
+            elif into != gid:
+                await conn.execute('''UPDATE items SET gid = $3::int WHERE lid = $1::bigint AND gid = $2::int''', self.lid, gid, into)
+                await conn.execute('''DELETE FROM genres WHERE lid = $1::bigint AND id = $2::int''', self.lid, gid)
+        self._app.versions.bump(self.lid, 'genres')
     
     async def remove_genre(self, genre):
         """
-        Removes a genre from this location.
+        Removes a genre from this location, leaving its items without one.
         """
-        await self.pool.execute(
-          '''UPDATE items SET genre = NULL WHERE genre = lower($1::text)''', genre
-          )
+        async with self.acquire() as conn, conn.transaction():
+            gid = await conn.fetchval('''SELECT id FROM genres WHERE lid = $1::bigint AND name = lower($2::text)''', self.lid, genre)
+            if gid is None:
+                return
+            await conn.execute('''UPDATE items SET gid = NULL WHERE lid = $1::bigint AND gid = $2::int''', self.lid, gid)
+            await conn.execute('''DELETE FROM genres WHERE lid = $1::bigint AND id = $2::int''', self.lid, gid)
+        self._app.versions.bump(self.lid, 'genres')
     
     async def add_media(self, title, author, published, type_, genre, isbn, price, length):
         """
         Adds a new media item to location.
-        Genre will be added regardless of whether it's new, because
-        again there's no table or anything keeping track of genres.
+        Genre will be added to the location's if it's new.
         Item's price will be converted to a proper representation of its
         value through the Decimal class before being passed to
         PostgreSQL.
         """
         ident = img = ''
         try:
-            async with self._app.sem, self._app.session.get(self.gb_image_query(title, author)) as resp:
+            async with self._app.sem, self._app.http_session().get(self.gb_image_query(title, author)) as resp:
                 rel = (await resp.json())['items'][0]['volumeInfo']
         except KeyError:
             pass
@@ -580,24 +742,27 @@ class Location(AsyncInit):
         args = type_.name, genre, ident or isbn, self.lid, title, author, int(published), round(Decimal(price), 2), int(length)
         async with self.acquire() as conn:
             query = '''
+            WITH ''' + UPSERT_WORK.format(lid='$5', title='$6', author='$7', type='$2') + '''
             INSERT INTO items (
-                          type, genre,
+                          type, gid,
                           isbn, lid,
                           title, author, published,
                           price, length,
                           acquired, limits,
-                          image
+                          image, wid
                           )
-                 SELECT $2::text, lower($3::text),
+                 SELECT $2::text, genre_id($5::bigint, $3::text),
                         $4::text, $5::bigint,
                         $6::text, $7::text, $8::int,
                         $9::numeric, $10::int,
                         current_date, NULL,
-                        $1::text;
+                        $1::text, work.wid
+                   FROM work;
             '''
             await conn.execute(query, img, *args)
             mid = await conn.fetchval('''SELECT currval(pg_get_serial_sequence('items', 'mid'))''')
-        return await MediaItem(mid, self._app)
+        self._app.versions.bump(self.lid, 'genres')
+        return await typedefs.MediaItem(mid, self._app)
     
     async def remove_item(self, item):
         """
@@ -608,9 +773,11 @@ class Location(AsyncInit):
         This of course means that any fines on the item will be cleared
         without having to be paid off.
         """
-        item = item if isinstance(item, MediaItem) else await MediaItem(item, self._app)
+        item = item if isinstance(item, typedefs.MediaItem) else await typedefs.MediaItem(item, self._app)
         query = '''
         DELETE FROM items
         WHERE mid = $1::bigint
         '''
-        return await self.pool.execute(query, item.mid)
+        res = await self.pool.execute(query, item.mid)
+        self._app.versions.bump(self.lid, 'genres')
+        return res
@@ -1,18 +1,61 @@
 import datetime as dt
 from decimal import Decimal
-from types import SimpleNamespace, ModuleType
+from types import SimpleNamespace
 
-from ..core import AsyncInit
+from ..core import AsyncInit, typedefs
 from ..attributes import Limits
 
+PICKUP_DAYS = 7  # how long a held copy waits on the pickup shelf
 
-# These are 'variable annotations', used in python 3.6 for introducing
-# a variable before actually assigning to it. I'm just using them here
-# so pylint stops whinging about my do_imports() method using `global`
-Location: ModuleType
-MediaType: ModuleType
-Role: ModuleType
-User: ModuleType
+# The work a title/author/type falls under at a location, created if it's
+# the first copy of it there; a `work` CTE for the statement filing an item
+# under it. Format in whichever parameters hold lid, title, author & type
+UPSERT_WORK = '''
+work AS (
+  INSERT INTO works (lid, key, title, author, type)
+  VALUES ({lid}::bigint, work_key({title}::text, {author}::text, {type}::text), {title}::text, {author}::text, {type}::text)
+      ON CONFLICT (lid, key) DO UPDATE SET key = EXCLUDED.key  -- (a no-op, but RETURNING needs the row)
+  RETURNING wid
+)
+'''
+
+# Sets copy `returned` aside for whoever's been waiting longest for its
+# work, if anyone; prefixed with a `returned` CTE of (mid, wid).
+# SKIP LOCKED so that two copies of a work coming back at once go to the
+# first two in line, rather than the second waiting on the first
+_NEXT_HOLD = '''
+next AS (
+  SELECT holds.uid, holds.mid, returned.mid AS ready_mid
+    FROM holds, returned
+   WHERE holds.wid = returned.wid
+     AND holds.state = 'waiting'
+   ORDER BY holds.created, holds.seq
+   LIMIT 1
+     FOR UPDATE OF holds SKIP LOCKED
+)
+UPDATE holds
+   SET state = 'ready',
+       ready_mid = next.ready_mid,
+       ready_since = now(),
+       expires = current_date + $2::int
+  FROM next, members
+ WHERE holds.uid = next.uid
+   AND holds.mid = next.mid
+   AND members.uid = holds.uid
+RETURNING holds.uid, members.username, members.fullname, holds.expires
+'''
+
+# _NEXT_HOLD for copy $1 if it's on the shelf, e.g. once whoever it was
+# set aside for has cancelled their hold, let it expire or checked out
+# another copy; see MediaItem.pass_on(). Also run by scheduled_updates.py
+PASS_ON = '''
+WITH returned AS (
+  SELECT mid, wid
+    FROM items
+   WHERE mid = $1::bigint
+     AND issued_to IS NULL
+),
+''' + _NEXT_HOLD
 
 
 class MediaItem(AsyncInit):
@@ -31,15 +74,18 @@ class MediaItem(AsyncInit):
     published   (date):      Specifically a datetime.date object; what year item was published.
     mid         (int):       Item's unique ID, used on its barcode and when checking in/out.
     lid         (int):       Shorthand for item.location.lid.
+    wid         (int):       ID of the work item is a copy of (see the works table).
     _issued_uid (int):       The raw uID of the member item is checked out to; not intended to be exposed elsewhere.
+    held_for    (int):       uID of the member this copy's set aside for on the pickup shelf, if any.
     _limnum     (int):       (UNUSED) contains the raw number of item's limit overrides (was implemented on media *types* in the final project).
-    genre       (str):       Name of item's genre.
+    genre       (str):       Name of item's genre (see the genres table).
     image       (str):       A link to Google Books' image for item (really only works on books and maybe audio recordings of books).
     author      (str):       Name of item's author or creator.
     title       (str):       Title of item.
     _type       (str):       Shorthand for item.type.name, but not intended to be exposed outside this class.
     isbn        (str):       Item's ISBN (if defined by user), or if not then whichever of its ISBN-10/-13 was available on Google Books' API.
     """
+    coalesce = True  # kiosks all scanning the same copy; see core.py
     
     props = [
       'mid', 'genre', 'type',
@@ -49,11 +95,6 @@ class MediaItem(AsyncInit):
       'available', 'due_date'
       ]
     
-    @staticmethod
-    def do_imports():
-        global Location, Role, MediaType, User
-        from . import Location, Role, MediaType, User
-    
     async def __init__(self, mid, app):
         try:
             self.mid = int(mid)
@@ -63,9 +104,11 @@ class MediaItem(AsyncInit):
         self.pool = app.pg_pool
         self.acquire = self.pool.acquire
         query = '''
-        SELECT type, isbn, lid, author, title, published, genre, issued_to, due_date, fines, acquired, limits, image, length, price
-          FROM items
-         WHERE mid = $1::bigint
+        SELECT items.type, items.isbn, items.lid, items.author, items.title, items.published, genres.name AS genre,
+               items.issued_to, items.due_date, items.fines, items.acquired, items.limits, items.image, items.length, items.price, items.wid,
+               (SELECT uid FROM holds WHERE ready_mid = items.mid AND state = 'ready') AS held_for
+          FROM items LEFT JOIN genres ON genres.lid = items.lid AND genres.id = items.gid
+         WHERE items.mid = $1::bigint
         '''
         try:
             (
@@ -75,14 +118,35 @@ class MediaItem(AsyncInit):
               self._issued_uid, self.due_date,
               self.fines, self.acquired,
               self._limnum, self.image,
-              self.length, self.price
+              self.length, self.price,
+              self.wid, self.held_for
             ) = await self.pool.fetchrow(query, self.mid)
         except TypeError:
             raise TypeError('item')  # to be fed back to the client as "item does not exist!"
-        self.location = await Location(self.lid, self._app)
+        self.location = await typedefs.Location(self.lid, self._app)
         self.available = not self._issued_uid
-        self.issued_to = None if self._issued_uid is None else await User(self._issued_uid, self._app, location=self.location)
-        self.type = None if self._type is None else await MediaType(self._type, self.location, self._app)
+        self.issued_to = None if self._issued_uid is None else await typedefs.User(self._issued_uid, self._app, location=self.location)
+        self.type = None if self._type is None else await typedefs.MediaType(self._type, self.location, self._app)
+    
+    @staticmethod
+    async def availability(mid, app):
+        """
+        Whether item `mid` is available, and if not who has it, as
+        (available, issued_uid, issued_username) -- in one query, rather
+        than building the item and its Location, MediaType and issuee.
+        None if there's no such item.
+        """
+        try:
+            mid = int(mid)
+        except (ValueError, TypeError):
+            return None
+        query = '''
+        SELECT items.issued_to, members.username
+          FROM items LEFT JOIN members ON members.uid = items.issued_to
+         WHERE items.mid = $1::bigint
+        '''
+        row = await app.pg_pool.fetchrow(query, mid)
+        return None if row is None else (row['issued_to'] is None, row['issued_to'], row['username'])
     
     def to_dict(self):
         retdir = {attr: str(getattr(self, attr, None)) for attr in self.props}
@@ -152,26 +216,33 @@ class MediaItem(AsyncInit):
         """
         Edits all of this item's info.
         type_ is a string holding the type's name, not a MediaType object.
+        A new title/author/type files it under a different work.
         """
         query = '''
+        WITH ''' + UPSERT_WORK.format(lid='$10', title='$2', author='$3', type='$5') + '''
         UPDATE items
            SET title = $2::text,
                author = $3::text,
-               genre = $4::text,
+               gid = genre_id($10::bigint, $4::text),
                type = $5::text,
                price = $6::numeric,
                length = $7::int,
                published = $8::int,
-               isbn = $9::text
+               isbn = $9::text,
+               wid = (SELECT wid FROM work)
          WHERE mid = $1::bigint
+     RETURNING wid
         '''
-        await self.pool.execute(query, self.mid, title, author, genre, type_, round(Decimal(price), 2), int(length), int(published), isbn)
+        self.wid = await self.pool.fetchval(
+          query, self.mid, title, author, genre, type_, round(Decimal(price), 2), int(length), int(published), isbn, self.lid
+          )
+        self._app.versions.bump(self.lid, 'genres')
     
     async def issue_to(self, user):
         """
         Set user's recent genre to self.genre,
         set item's issued_to to the user's ID,
-        and clear the user's holds on the item
+        and clear the user's holds on the item (or any copy of it)
         """
         # Give priority to mediatype/mediaitem limits over user/role limits --
         # unless a limit on the mediatype/mediaitem is 254, the 'null' code,
@@ -189,7 +260,7 @@ class MediaItem(AsyncInit):
                 }
               )
         infinite = limits.checkout_duration >= 255
-        async with self.acquire() as conn:
+        async with self.acquire() as conn, conn.transaction():
             query = '''
             UPDATE members
                SET recent = $2::text
@@ -209,12 +280,17 @@ class MediaItem(AsyncInit):
             if not infinite:
                 params.append(7*limits.checkout_duration)
             await conn.execute(*params)
+            # Any hold they had on the work is done with now; if it had a
+            # different copy waiting for them, that goes to the next in line
             query = '''
             DELETE FROM holds
-             WHERE mid = $1::bigint
-               AND uid = $2::bigint
+             WHERE uid = $2::bigint
+               AND (mid = $1::bigint OR ready_mid = $1::bigint OR wid = $3::bigint)
+            RETURNING ready_mid
             '''
-            await conn.execute(query, self.mid, user.uid)
+            for row in await conn.fetch(query, self.mid, user.uid, self.wid):
+                if row['ready_mid'] not in (None, self.mid):
+                    await conn.execute(PASS_ON, row['ready_mid'], PICKUP_DAYS)
         self.issued_to = user
         self.due_date = 'never.' if infinite else dt.date.today() + dt.timedelta(weeks=limits.checkout_duration)
         self.fines = 0
@@ -222,18 +298,34 @@ class MediaItem(AsyncInit):
     
     async def check_in(self):
         """
-        Returns a checked-out item.
+        Returns a checked-out item, and in the same go sets it aside for
+        the next member waiting on a hold for it, if there is one -- whose
+        record (uid, username, fullname, expires) is returned, else None.
         """
         query = '''
-        UPDATE items
-           SET issued_to = NULL,
-               due_date = NULL,
-               fines = NULL
-         WHERE mid = $1::bigint;
-        '''
-        await self.pool.execute(query, self.mid)
+        WITH returned AS (
+          UPDATE items
+             SET issued_to = NULL,
+                 due_date = NULL,
+                 fines = NULL
+           WHERE mid = $1::bigint
+          RETURNING mid, wid
+        ),
+        ''' + _NEXT_HOLD
+        held = await self.pool.fetchrow(query, self.mid, PICKUP_DAYS)
         self.due_date = None
         self.available = True
+        self.held_for = held and held['uid']
+        return held
+    
+    async def pass_on(self):
+        """
+        Sets this item aside for the next member in line, e.g. after the
+        one it was set aside for cancels their hold. Returns as check_in().
+        """
+        held = await self.pool.fetchrow(PASS_ON, self.mid, PICKUP_DAYS)
+        self.held_for = held and held['uid']
+        return held
     
     async def remove(self):
         """
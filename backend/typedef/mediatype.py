@@ -1,18 +1,7 @@
-from types import ModuleType
-
-from ..core import AsyncInit
+from ..core import AsyncInit, typedefs
 from ..attributes import Limits
 
 
-# These are 'variable annotations', used in python 3.6 for introducing
-# a variable before actually assigning to it. I'm just using them here
-# so pylint stops whinging about my do_imports() method using `global`
-Location: ModuleType
-MediaItem: ModuleType
-Role: ModuleType
-User: ModuleType
-
-
 class MediaType(AsyncInit):
     """
     Defines a kind of media, e.g. books or audiotapes.
@@ -25,16 +14,11 @@ class MediaType(AsyncInit):
     unit     (str):      Media type's unit of length, e.g. "pages" or "minutes"
     """
     
-    @staticmethod
-    def do_imports():
-        global Location, Role, MediaItem, User
-        from . import Location, Role, MediaItem, User
-    
     async def __init__(self, name, location, app):
         self._app = app
         self.pool = app.pg_pool
         self.acquire = self.pool.acquire
-        self.location = location if isinstance(location, Location) else await Location(int(location), self._app)
+        self.location = location if isinstance(location, typedefs.Location) else await typedefs.Location(int(location), self._app)
         self.name = name
         check = await self.pool.fetchval('''SELECT name FROM mtypes WHERE name = $1::text AND lid = $2::bigint''', self.name, self.location.lid)
         if not check:
@@ -54,6 +38,8 @@ class MediaType(AsyncInit):
         Edits all of this media type's info.
         
         limits is the raw number, not a 'props' dict or a sequence.
+        A new name refiles the type's items (and their works, and holds
+        on those) under it; see works_retype() in 0006_works_retype.sql.
         """
         query = '''
         UPDATE mtypes
@@ -63,5 +49,9 @@ class MediaType(AsyncInit):
         WHERE name = $1::text
           AND lid = $2::bigint
         '''
-        await self.pool.execute(query, self.name, self.location.lid, limits, name, unit)
-        self.limits, self.name = Limits(limits), name
+        async with self.acquire() as conn, conn.transaction():
+            await conn.execute(query, self.name, self.location.lid, limits, name, unit)
+            if name is not None and name != self.name:
+                await conn.execute('''SELECT works_retype($1::bigint, $2::text, $3::text)''', self.location.lid, self.name, name)
+        self._app.versions.bump(self.location.lid, 'mtypes')
+        self.limits, self.name = Limits(limits), name or self.name
@@ -1,18 +1,7 @@
-from types import ModuleType
-
-from ..core import AsyncInit
+from ..core import AsyncInit, typedefs
 from ..attributes import Perms, Limits, Locks
 
 
-# These are 'variable annotations', used in python 3.6 for introducing
-# a variable before actually assigning to it. I'm just using them here
-# so pylint stops whinging about my do_imports() method using `global`
-MediaItem: ModuleType
-MediaType: ModuleType
-Location: ModuleType
-User: ModuleType
-
-
 class Role(AsyncInit):
     """
     Defines a role, i.e. an abstract container for authorization stuff.
@@ -25,11 +14,6 @@ class Role(AsyncInit):
     _limnbin,               Shorthand for role.perms/limits/locks.raw, but
     _locknbin   (int):      not intended to be exposed outside this class
     """
-    @staticmethod
-    def do_imports():
-        global Location, MediaItem, MediaType, User
-        from . import Location, MediaItem, MediaType, User
-    
     async def __init__(self, rid, app, *, location=None):
         self._app = app
         self.pool = self._app.pg_pool
@@ -40,7 +24,7 @@ class Role(AsyncInit):
             lid, name, default, permbin, limbin, lockbin = await self.pool.fetchrow(query, self.rid)
         except TypeError:
             raise TypeError('role')  # to be fed back to application as 'role does not exist!'
-        self.location = await Location(lid, self._app) if location is None else location
+        self.location = await typedefs.Location(lid, self._app) if location is None else location
         self.name = name
         self.is_default = default
         # Comments below pertain to these three lines
@@ -104,11 +88,13 @@ class Role(AsyncInit):
          WHERE rid = $1::bigint
         '''
         await self.pool.execute(query, self.rid, name, perms.raw, limits.raw, locks.raw)
+        self._app.versions.bump(self.location.lid, 'roles')
     
     async def delete(self):
         """Deletes this role."""
         query = '''DELETE FROM roles WHERE rid = $1::bigint'''
         await self.pool.execute(query, self.rid)
+        self._app.versions.bump(self.location.lid, 'roles')
     
     async def num_members(self):
         """This could probably be an attr set in __init__..."""
@@ -1,19 +1,66 @@
 import asyncpg
-from types import ModuleType
 
-import bcrypt
-
-from ..core import AsyncInit
+from .. import sessions
+from ..core import AsyncInit, typedefs
 from ..attributes import Perms, Limits, Locks
+from .mediaitem import PASS_ON, PICKUP_DAYS
+
+# Everything a member's notifications are made of, in one query (they're
+# polled by every kiosk, and rebuilt for every change pushed over
+# /api/member/events). Format in the WHERE clause picking the member
+NOTIFS = '''
+SELECT (SELECT count(*) FROM holds WHERE holds.uid = members.uid AND holds.state = 'ready') AS holds,
+       items.fines, items.overdue, items.checkouts,
+       coalesce(members.limits, roles.limits) AS limits,
+       coalesce(members.locks, roles.locks) AS locks
+  FROM members
+  LEFT JOIN roles ON roles.rid = members.rid,
+       LATERAL (
+         SELECT sum(fines) AS fines,
+                count(*) FILTER (WHERE due_date < current_date) AS overdue,
+                count(*) AS checkouts
+           FROM items
+          WHERE issued_to = members.uid
+       ) AS items
+ WHERE {}
+'''
 
 
-# These are 'variable annotations', used in python 3.6 for introducing
-# a variable before actually assigning to it. I'm just using them here
-# so pylint stops whinging about my do_imports() method using `global`
-MediaItem: ModuleType
-MediaType: ModuleType
-Location: ModuleType
-Role: ModuleType
+def _cannot_check_out(limits, locks, num_checkouts):
+    """See User.cannot_check_out."""
+    chk, dur = locks.checkouts, limits.checkout_duration
+    if chk and dur:  # user is able to check out -- that is, unless the item's type's limits won't allow it
+        return False
+    ret = (
+      "You can't check anything out at the moment"
+      + (
+        '' if chk else
+        ' (currently using {} of {} allowed concurrent checkouts'
+        .format(num_checkouts, locks.checkouts)
+        )
+      + ('' if dur else '; allowed to check out for 0 weeks')
+      )
+    return ret + ('' if chk else ')')  # construct dynamic notif string
+
+
+def _notifs(row):
+    """Notifications from a row of NOTIFS."""
+    response = []
+    
+    def add(type_, message):
+        response.append({"type": type_, "text": message})
+    
+    holds, fines, overdue = row['holds'], row['fines'], row['overdue']
+    cannot_check_out = _cannot_check_out(Limits(row['limits']), Locks(row['locks']), row['checkouts'])
+    if holds:
+        add('notification', f'You have {holds} holds ready for pickup.')
+    if overdue:
+        add('warning', f'You have {overdue} overdue items.')
+    if fines:
+        add('warning', f'You have ${fines} in overdue fines.')
+    if cannot_check_out:
+        add('alert', cannot_check_out)
+    return response
 
 
 class User(AsyncInit):
@@ -36,11 +83,6 @@ class User(AsyncInit):
     _limnum,                 All shorthand for user.perms/limits/locks.raw, but
     _locknum     (int):      not intended to be exposed outside this class
     """
-    @staticmethod
-    def do_imports():
-        global Location, Role, MediaItem, MediaType
-        from . import Location, Role, MediaItem, MediaType
-    
     async def __init__(self, uid, app, *, location=None, role=None):
         self._app = app
         self.pool = self._app.pg_pool
@@ -62,8 +104,8 @@ class User(AsyncInit):
             holds = await conn.fetchval(query, self.uid)
             query = '''SELECT count(*) FROM items WHERE issued_to = $1::bigint'''
             self.num_checkouts = await conn.fetchval(query, self.uid)
-        self.location = location if isinstance(location, Location) else await Location(lid, self._app)
-        self.role = role if isinstance(role, Role) else await Role(rid, self._app, location=self.location)
+        self.location = location if isinstance(location, typedefs.Location) else await typedefs.Location(lid, self._app)
+        self.role = role if isinstance(role, typedefs.Role) else await typedefs.Role(rid, self._app, location=self.location)
         self.lid, self.rid = lid, rid
         self.holds = holds
         self.username = username
@@ -110,19 +152,7 @@ class User(AsyncInit):
         (could be that they've checked out too many books already or
         that their checkout duration is restricted to 0)
         """
-        chk, dur = self.locks.checkouts, self.limits.checkout_duration
-        if chk and dur:  # user is able to check out -- that is, unless the item's type's limits won't allow it
-            return False
-        ret = (
-          "You can't check anything out at the moment"
-          + (
-            '' if chk else
-            ' (currently using {} of {} allowed concurrent checkouts'
-            .format(self.num_checkouts, self.locks.checkouts)
-            )
-          + ('' if dur else '; allowed to check out for 0 weeks')
-          )
-        return ret + ('' if chk else ')')  # construct dynamic notif string
+        return _cannot_check_out(self.limits, self.locks, self.num_checkouts)
     
     @classmethod
     async def from_identifiers(cls, username=None, location=None, lid=None, *, app):
@@ -132,11 +162,22 @@ class User(AsyncInit):
         and, once found, passes it to __init__())
         """
         if lid and location is None:
-            location = await Location(int(lid), app)
+            location = await typedefs.Location(int(lid), app)
         query = '''SELECT uid FROM members WHERE username = $1::text AND lid = $2::bigint'''
         uid = await app.pg_pool.fetchval(query, username, location.lid)
         return await cls(uid, app)
     
+    @staticmethod
+    async def notifs_of(username, lid, *, app):
+        """
+        notifs() for the member with this username at location lid, without
+        building the User (or its Location and Role) first. None if there's
+        no such member.
+        """
+        query = NOTIFS.format('members.username = $1::text AND members.lid = $2::bigint')
+        row = await app.pg_pool.fetchrow(query, username, int(lid))
+        return None if row is None else _notifs(row)
+    
     def edit_perms(self, **new):
         """Just shorthand"""
         self.perms.edit(**new)
@@ -147,109 +188,87 @@ class User(AsyncInit):
     
     async def delete(self):
         """
-        Get rid of & clean up after a member.
+        Get rid of & clean up after a member. Copies set aside for them
+        or checked out to them go to whoever's next in line for each.
         """
         queries = '''
-        DELETE FROM members
-         WHERE uid = $1::bigint
-        ''', '''
         DELETE FROM holds
          WHERE uid = $1::bigint
+        RETURNING ready_mid AS mid
         ''', '''
         UPDATE items
            SET issued_to = NULL,
                due_date = NULL,
                fines = NULL
          WHERE issued_to = $1::bigint
+        RETURNING mid
+        ''', '''
+        DELETE FROM members
+         WHERE uid = $1::bigint
         '''
         async with self.acquire() as conn:
             async with conn.transaction():
-                [await conn.execute(query, self.uid) for query in queries]
+                freed = [row['mid'] for query in queries for row in await conn.fetch(query, self.uid)]
+                for mid in freed:
+                    if mid is not None:
+                        await conn.execute(PASS_ON, mid, PICKUP_DAYS)
+        self._app.versions.bump(self.lid, 'members')
+        await sessions.revoke_users(self._app, [self.uid])
     
     async def notifs(self):
         """
         Construct a user's notifications, which appear on the checkout
         page and serve info regarding whether the user has holds available
         or fines accrued or items overdue.
+        Always read fresh, limits and all, rather than from this object.
         """
-        async with self.acquire() as conn:
-            holds = await conn.fetchval('''
-            SELECT count(*) FROM holds, items
-             WHERE holds.uid = $1::bigint
-               AND items.mid = holds.mid
-               AND items.issued_to IS NULL
-            ''', self.uid)
-            
-            fines = await conn.fetchval('''
-              SELECT sum(fines) AS fines
-                FROM items
-               WHERE issued_to = $1::bigint
-             ''', self.uid)
-            
-            overdue = await conn.fetchval('''
-              SELECT count(*) AS overdue
-                FROM items
-               WHERE due_date < current_date
-                 AND issued_to = $1::bigint
-               ''', self.uid)
-        
-        response = []
-        
-        def add(type_, message):
-            response.append({"type": type_, "text": message})
-        
-        if holds:
-            add('notification', f'You have {holds} holds available.')
-        if overdue:
-            add('warning', f'You have {overdue} overdue items.')
-        if fines:
-            add('warning', f'You have ${fines} in overdue fines.')
-        if self.cannot_check_out:
-            add('alert', self.cannot_check_out)
-        return response
+        return _notifs(await self.pool.fetchrow(NOTIFS.format('members.uid = $1::bigint'), self.uid))
     
-    async def hold(self, *, title, author, type_, genre, item=None):
+    async def hold(self, item):
         """
-        Places a hold from this user on an item.
-        All the extra attrs are to determine whether the item (as a whole, i.e.
-        not just the specifically-requested media ID) is available at all
-        before allowing the hold.
+        Places a hold from this user on an item -- or rather on its work,
+        i.e. whichever copy of it comes back first. Only allowed if no copy
+        is available right now and the user hasn't got one out already.
         """
-        if item is None:
-            item = await self.location.search(title=title, genre=genre, type_=type_ and str(type_), author=author, max_results=1, where_taken=True)
-        templ = '''
-       SELECT count(*)
-         FROM items
-        WHERE lower(title) = lower($1::text)
-          AND lower(author) = lower($2::text)
-          AND lower(type) = lower($3::text)
-          AND lower(genre) = lower($4::text)
-        '''
         async with self.acquire() as conn:
-            if await conn.fetchval(templ + '''AND issued_to IS NULL''', title, author, str(type_), genre):
+            query = '''
+            SELECT works.available - works.on_shelf AS free,
+                   EXISTS (SELECT 1 FROM items WHERE issued_to = $2::bigint AND wid = works.wid) AS mine
+              FROM works
+             WHERE wid = $1::bigint
+            '''
+            free, mine = await conn.fetchrow(query, item.wid, self.uid) or (0, False)
+            if free:
                 return 'Item is already available!'
-            if await conn.fetchval(templ + '''AND issued_to = $5::bigint''', title, author, str(type_), genre, self.uid):
+            if mine:
                 return 'You have this item checked out already!'
             query = '''
             INSERT INTO holds
-              (uid, mid, created)
-            SELECT $1::bigint, $2::bigint, current_date
+              (uid, mid, lid, wid, created)
+            SELECT $1::bigint, $2::bigint, $3::bigint, $4::bigint, current_date
+             WHERE NOT EXISTS (SELECT 1 FROM holds WHERE uid = $1::bigint AND wid = $4::bigint)
             '''
             try:
-                await conn.execute(query, self.uid, item.mid)
+                placed = await conn.execute(query, self.uid, item.mid, item.lid, item.wid)
             except asyncpg.exceptions.UniqueViolationError:
+                placed = 'INSERT 0 0'
+            if placed == 'INSERT 0 0':
                 return 'You already have a hold placed on this item!'
     
     async def clear_hold(self, item):
         """
-        Removes a hold.
+        Removes a hold. If its copy was already waiting on the pickup
+        shelf, it goes to the next member in line instead.
         """
         query = '''
         DELETE FROM holds
               WHERE uid = $1::bigint
-                AND mid = $2::bigint
+                AND (mid = $2::bigint OR ready_mid = $2::bigint)
+          RETURNING ready_mid
         '''
-        return await self.pool.execute(query, self.uid, item.mid)
+        ready_mid = await self.pool.fetchval(query, self.uid, item.mid)
+        if ready_mid is not None:
+            await (item if item.mid == ready_mid else await typedefs.MediaItem(ready_mid, self._app)).pass_on()
     
     async def edit(self, username, rid, fullname):
         """
@@ -263,6 +282,10 @@ class User(AsyncInit):
          WHERE uid = $1::bigint
         '''
         await self.pool.execute(query, self.uid, username, rid, fullname)
+        self._app.versions.bump(self.lid, 'members')
+        if rid is not None and int(rid) != self.rid:
+            # New role means new permissions, so make them log back in
+            await sessions.revoke_users(self._app, [self.uid])
     
     async def edit_self(self, name=None, pw=None):
         """
@@ -277,6 +300,7 @@ class User(AsyncInit):
         '''
         pwhash = self._pwhash
         if pw is not None:
+            import bcrypt
             pwhash = await self._app.aexec(self._app.ppe, bcrypt.hashpw, pw.encode(), bcrypt.gensalt(12))
         try:
             await self.pool.execute(query, self.uid, name, pwhash)
@@ -286,32 +310,54 @@ class User(AsyncInit):
             self._pwhash = pwhash
     
     async def verify_pw(self, pw):
+        import bcrypt
         return await self._app.aexec(self._app.ppe, bcrypt.checkpw, pw.encode(), self._pwhash)
     
     async def items(self):
         """
-        Returns all this user's checked-out items.
+        Returns all this user's checked-out items, as JSON (bytes) that
+        Postgres puts together itself.
         """
         query = '''
-        SELECT mid, title, author, type, genre, image, due_date FROM items WHERE issued_to = $1::bigint
+        SELECT coalesce(json_agg(json_build_object(
+                 'mid', items.mid, 'title', items.title, 'author', items.author, 'genre', genres.name,
+                 'type', items.type, 'image', items.image, 'due_date', items.due_date
+               ) ORDER BY items.due_date, items.mid), '[]')
+          FROM items LEFT JOIN genres ON genres.lid = items.lid AND genres.id = items.gid
+         WHERE items.issued_to = $1::bigint
         '''
-        return [{j: str(i[j]) for j in ('mid', 'title', 'author', 'genre', 'type', 'image', 'due_date')} for i in await self.pool.fetch(query, self.uid)]
+        return await self.pool.fetchval(query, self.uid)
     
     async def held(self):
         """
-        Returns all items this user has on hold.
+        Returns all items this user has on hold: the copy set aside for
+        them if it's ready, else the one they asked for, along with their
+        place in line for it. As JSON (bytes), like items().
         """
         query = '''
-        SELECT items.mid AS mid,
-               items.title AS title,
-               items.type AS type,
-               items.author AS author,
-               items.genre AS genre,
-               items.image AS image
-          FROM holds, items
-         WHERE holds.uid = $1::bigint AND items.mid = holds.mid
+        SELECT coalesce(json_agg(json_build_object(
+                 'mid', items.mid,
+                 'title', items.title,
+                 'type', items.type,
+                 'author', items.author,
+                 'genre', genres.name,
+                 'image', items.image,
+                 'state', holds.state,
+                 'expires', holds.expires,
+                 'position', CASE WHEN holds.state = 'waiting' THEN (
+                   SELECT count(*)
+                     FROM holds AS ahead
+                    WHERE ahead.wid = holds.wid
+                      AND ahead.state = 'waiting'
+                      AND (ahead.created, ahead.seq) <= (holds.created, holds.seq)
+                 ) END
+               ) ORDER BY holds.state, holds.created, holds.seq), '[]')
+          FROM holds
+          JOIN items ON items.mid = coalesce(holds.ready_mid, holds.mid)
+     LEFT JOIN genres ON genres.lid = items.lid AND genres.id = items.gid
+         WHERE holds.uid = $1::bigint
         '''
-        return [{j: i[j] for j in ('mid', 'title', 'author', 'genre', 'type', 'image')} for i in await self.pool.fetch(query, self.uid)]
+        return await self.pool.fetchval(query, self.uid)
     
     @property
     def checkouts_left(self) -> int:
@@ -0,0 +1,129 @@
+"""
+Version counters for the data behind the app's read-mostly endpoints,
+so that they can hand out ETags and answer If-None-Match with a 304
+without going anywhere near Postgres. (See deco.conditional().)
+
+Each location has one counter per kind of data, which the typedef
+methods that modify said data bump:
+
+location  name, color, fine settings
+mtypes    media types
+genres    genres of the location's items
+roles     roles' names and perms/limits/locks
+members   members' own info (including which role they have)
+help      help articles; these aren't per-location, so they're under lid 0
+
+Bumps are passed along to every other worker over the invalidation bus
+(see bus.py), once it's been set up, as the counter's new value rather
+than as just "it changed". A worker that hears about one moves its own
+counter past both its current value and that one, so every bump anywhere
+gives every worker a version it's never handed out before, and the
+counters of workers that have heard the same bumps end up agreeing.
+"""
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+
+# For per-user responses: browsers may keep them, but only for the
+# current user and only after checking back with us first
+PRIVATE = 'private, no-cache'
+
+# Most users whose location is remembered at once; see Owners
+OWNERS_MAX = 50000
+
+
+class Owners(OrderedDict):
+    """
+    uid -> lid, forgetting whoever's gone longest without a request once
+    there are more than `size` of them. (Forgotten ones are just looked
+    up again from the DB next time.)
+    """
+    def __init__(self, size=OWNERS_MAX):
+        super().__init__()
+        self.size = size
+    
+    def __getitem__(self, uid):
+        lid = super().__getitem__(uid)
+        self.move_to_end(uid)
+        return lid
+    
+    def __setitem__(self, uid, lid):
+        super().__setitem__(uid, lid)
+        self.move_to_end(uid)
+        if len(self) > self.size:
+            self.popitem(last=False)
+    
+    def get(self, uid, default=None):
+        try:
+            return self[uid]
+        except KeyError:
+            return default
+
+
+class Versions:
+    """
+    epoch   (str):  When this process started, plus some random bits
+                    for processes that started in the same second; part
+                    of every tag, so that tags from before a restart
+                    (when the counters were all reset to 0) or from
+                    another process can't match
+    clock   (int):  Goes up by one on every bump, to detect whether
+                    anything changed while a response was being built
+    owners  (Owners): uid -> lid of users requests have recently been
+                    made as; saves having to look up a user's location
+                    from the DB just to check their ETag
+    bus     (InvalidationBus): Where to publish bumps to, if anywhere
+    """
+    def __init__(self, bus=None):
+        self.epoch = format(int(time.time()), 'x') + uuid.uuid4().hex[:6]
+        self.clock = 0
+        self.owners = Owners()
+        self.bus = bus
+        self._counters = defaultdict(int)
+    
+    def bump(self, lid, *kinds, publish=True):
+        """
+        Marks the given kinds of data as changed for location `lid`.
+        publish=False is for bumps that came in over the bus to begin with.
+        """
+        for kind in kinds:
+            key = int(lid), kind
+            self._counters[key] += 1
+            if publish and self.bus is not None:
+                self.bus.publish('versions', *key, self._counters[key])
+        self.clock += 1
+    
+    def bump_all(self):
+        """
+        Moves every counter on, without publishing, for when this worker
+        may have missed bumps from the others (see server.py's
+        reopen_listener()). Every tag handed out so far came from one of
+        these, since etag() creates any it uses.
+        """
+        for key in self._counters:
+            self._counters[key] += 1
+        self.clock += 1
+    
+    def get(self, lid, kind):
+        """The current version of one kind of data at location `lid`."""
+        return self._counters[int(lid), kind]
+    
+    def on_bus_message(self, lid, kind, version):
+        """
+        Another worker's bumped lid's `kind` to `version`. Each of these
+        is applied (the bus doesn't merge them), and always moves the
+        counter on, even if it's already at or past `version` -- its
+        current value could well have been handed out for the data from
+        before this change.
+        """
+        key = int(lid), kind
+        self._counters[key] = max(self._counters[key] + 1, int(version))
+        self.clock += 1
+    
+    def etag(self, lid, kinds, uid=None):
+        """
+        Builds an ETag out of the current versions of `kinds`, as in
+        "5b0f3a2c-12-40-3.1.7" (epoch-lid-uid-versions).
+        """
+        versions = '.'.join(str(self._counters[lid, kind]) for kind in kinds)
+        return f'"{self.epoch}-{lid}-{uid or 0}-{versions}"'
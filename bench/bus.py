@@ -0,0 +1,155 @@
+"""
+Checks backend/bus.py end to end: two app instances, each with its own
+pool, LISTEN connection, version counters and token cache (i.e. two
+workers, as far as the bus can tell), against one Postgres. Doesn't
+touch any tables, so any database will do, bench/dataset.py's or not:
+
+    python bench/bus.py --dsn postgres://localhost/booksy_bench
+
+Checks that version bumps and session revocations made on one reach the
+other; that a burst of bumps is all applied, not merged into one; that
+bumps made on both at once leave them agreeing, with neither handing
+out a tag it's already handed out for different data; and reports the
+lag. Exits non-zero if any check fails.
+"""
+import argparse
+import asyncio
+import functools
+import os
+import random
+import sys
+import types
+
+import asyncpg
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from backend import sessions  # noqa: E402
+from backend.bus import InvalidationBus  # noqa: E402
+from backend.versions import Versions  # noqa: E402
+
+TIMEOUT = 2.0  # s; how long a message gets to arrive before it's a failure
+
+
+async def instance(dsn, loop):
+    """The parts of server.py's set_up_dbs() that the bus needs."""
+    app = types.SimpleNamespace(loop=loop, versions=Versions(), rtoken_cache=sessions.TokenCache())
+    app.pg_pool = await asyncpg.create_pool(dsn=dsn, min_size=1, max_size=2, loop=loop)
+    app.pg_listener = await asyncpg.connect(dsn=dsn, loop=loop)
+    app.bus = InvalidationBus(app)
+    app.bus.on('versions', app.versions.on_bus_message)
+    app.bus.on('rtoken', functools.partial(sessions.forget, app))
+    app.versions.bus = app.bus
+    await app.bus.listen(app.pg_listener)
+    return app
+
+
+async def close(app):
+    await app.pg_listener.close()
+    await app.pg_pool.close()
+
+
+async def until(cond):
+    """Waits for cond() to come true, for up to TIMEOUT seconds."""
+    for _ in range(int(TIMEOUT / 0.01)):
+        if cond():
+            return True
+        await asyncio.sleep(0.01)
+    return cond()
+
+
+async def check_epochs(a, b):
+    assert a.versions.epoch != b.versions.epoch, 'two workers share an epoch, so their tags can collide'
+
+
+async def check_bump(a, b, lid):
+    before = b.versions.etag(lid, ['genres'])
+    a.versions.bump(lid, 'genres')
+    assert await until(lambda: b.versions.get(lid, 'genres') == a.versions.get(lid, 'genres')), "bump didn't arrive"
+    assert b.versions.etag(lid, ['genres']) != before, "other worker's tag didn't change"
+
+
+async def check_burst(a, b, lid, n):
+    start = b.versions.get(lid, 'roles')
+    applied = b.bus.applied
+    for _ in range(n):
+        a.versions.bump(lid, 'roles')
+    assert await until(lambda: b.versions.get(lid, 'roles') == a.versions.get(lid, 'roles')), \
+        f"other worker's at {b.versions.get(lid, 'roles')}, publisher's at {a.versions.get(lid, 'roles')}"
+    assert b.versions.get(lid, 'roles') - start >= n
+    assert b.bus.applied - applied == n, f'{b.bus.applied - applied} of {n} bumps applied'
+
+
+async def check_concurrent(a, b, lid):
+    # Whatever each one's handed out a tag for so far
+    seen = [{app.versions.get(lid, 'members')} for app in (a, b)]
+    for app, used in zip((a, b), seen):
+        app.versions.bump(lid, 'members')
+        used.add(app.versions.get(lid, 'members'))
+    # (both bumped from the same version, so they'd agree even before
+    # hearing about each other's)
+    assert await until(lambda: all(app.versions.get(lid, 'members') not in used for app, used in zip((a, b), seen))), \
+        'a worker stayed at a version it had already used before the other\'s bump'
+    assert a.versions.get(lid, 'members') == b.versions.get(lid, 'members'), \
+        f"workers disagree: {a.versions.get(lid, 'members')} vs {b.versions.get(lid, 'members')}"
+
+
+async def check_own_ignored(a, lid):
+    applied = a.bus.applied
+    a.versions.bump(lid, 'location')
+    await asyncio.sleep(a.bus.delay * 10)
+    assert a.bus.applied == applied, 'a worker applied its own message'
+
+
+async def check_rtoken(a, b):
+    for app in (a, b):
+        app.rtoken_cache['1'] = 'token'
+        app.rtoken_cache['token'] = '1'
+    sessions.forget(a, '1', 'token')
+    sessions._publish(a, ['1', 'token'])
+    assert await until(lambda: '1' not in b.rtoken_cache and 'token' not in b.rtoken_cache), 'revoked session still cached'
+
+
+async def main(args):
+    loop = asyncio.get_event_loop()
+    a, b = await instance(args.dsn, loop), await instance(args.dsn, loop)
+    lid = random.randrange(10**9, 10**10)  # not a real location, so nothing else bumps it
+    checks = [
+      ('separate epochs', check_epochs(a, b)),
+      ('bump reaches the other worker', check_bump(a, b, lid)),
+      ('burst of bumps all applied', check_burst(a, b, lid, args.burst)),
+      ('concurrent bumps converge', check_concurrent(a, b, lid)),
+      ('own messages ignored', check_own_ignored(a, lid)),
+      ('session revocation', check_rtoken(a, b)),
+      ]
+    failed = 0
+    try:
+        for name, check in checks:
+            try:
+                await check
+            except AssertionError as e:
+                failed += 1
+                print(f'FAIL {name}: {e}')
+            else:
+                print(f'ok   {name}')
+    finally:
+        for _, check in checks:
+            check.close()  # (any not run because of an error)
+        await close(a)
+        await close(b)
+    
+    lag = b.bus.lag
+    if lag['count']:
+        print(f"lag: {1000 * lag['total'] / lag['count']:.1f}ms mean, {1000 * lag['max']:.1f}ms max over {lag['count']} messages")
+    return failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dsn', default=os.getenv('DATABASE_URL'), help='default: $DATABASE_URL')
+    parser.add_argument('--burst', type=int, default=200, help='bumps in the burst check')
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error('no --dsn given and DATABASE_URL is not set')
+    sys.exit(1 if asyncio.get_event_loop().run_until_complete(main(args)) else 0)
@@ -0,0 +1,329 @@
+"""
+Fills a (local!) Postgres DB with a synthetic dataset shaped like real
+libraries' -- many locations, each with its own roles, media types,
+members and items, with skewed title/author/genre popularity, plus
+active checkouts, overdue items with fines, and holds -- for the
+benchmarks in this directory to run against.
+
+    python bench/dataset.py --items 100k --reset              # ~5 locations
+    python bench/dataset.py --items 10M --reset --seed 2      # production-sized
+    python bench/dataset.py --items 1k --locations 1 --fixture bench/fixture.json
+
+Everything is loaded with COPY, in chunks, so 10M items is a matter of
+minutes rather than hours; and it's all derived from --seed, so the same
+arguments always give the same data (apart from dates, which are
+relative to today). Every account's password is PASSWORD below, and
+--fixture writes out the logins/items that bench/loadtest.py needs.
+
+--reset drops and recreates every table (from backend/sql/schema.sql,
+then the migrations; see migrate.py) first. It won't touch a DB that isn't on localhost without --force.
+"""
+import argparse
+import asyncio
+import datetime as dt
+import itertools
+import json
+import os
+import random
+import re
+import sys
+import time
+from decimal import Decimal
+from urllib.parse import urlparse
+
+import asyncpg
+import bcrypt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from backend.attributes import Perms, Limits, Locks  # noqa: E402
+from migrate import migrate  # noqa: E402
+
+SCHEMA = os.path.join(ROOT, 'backend', 'sql', 'schema.sql')
+TABLES = 'schema_migrations', 'jobs', 'holds', 'items', 'works', 'genres', 'mtypes', 'members', 'roles', 'signups', 'weeklies', 'locations'
+PASSWORD = 'booksy-bench'
+CHUNK = 50000
+
+# (name, perms, limits, locks, share of members); the first three are what
+# backend/sql/register_location.sql gives every new location
+ROLES = [
+  ('Admin', 127, -1, -1, 0),
+  ('Organizer', 55, 1028, 5140, 0.02),
+  ('Subscriber', 0, 514, 5135, 0.83),
+  ('Librarian',
+    Perms.from_kwargs(manage_accounts=True, manage_media=True, generate_reports=True, return_items=True).raw,
+    Limits.from_kwargs(checkout_duration=6, renewals=5, holds=10).raw,
+    Locks.from_kwargs(checkouts=30, fines=50).raw,
+    0.03),
+  ('Teacher',
+    Perms.from_kwargs(return_items=True).raw,
+    Limits.from_kwargs(checkout_duration=4, renewals=3, holds=6).raw,
+    Locks.from_kwargs(checkouts=20, fines=25).raw,
+    0.12),
+  ]
+MTYPES = [('book', 'pages', 0.78), ('audiobook', 'minutes', 0.08), ('dvd', 'minutes', 0.09), ('magazine', 'pages', 0.05)]
+GENRES = [
+  'fiction', 'mystery', 'fantasy', 'science fiction', 'romance', 'biography', 'history', 'young adult',
+  'children', 'thriller', 'horror', 'poetry', 'drama', 'science', 'mathematics', 'art', 'music', 'travel',
+  'cooking', 'religion', 'philosophy', 'psychology', 'economics', 'politics', 'sports', 'health',
+  'graphic novel', 'classics', 'humor', 'reference', 'technology', 'nature', 'true crime', 'education',
+  'law', 'language', 'anthology', 'western', 'adventure', 'self-help',
+  ]
+FIRST = [
+  'james', 'mary', 'john', 'patricia', 'robert', 'jennifer', 'michael', 'linda', 'william', 'elizabeth',
+  'david', 'barbara', 'richard', 'susan', 'joseph', 'jessica', 'thomas', 'sarah', 'charles', 'karen',
+  'wei', 'aisha', 'mateo', 'priya', 'yuki', 'omar', 'sofia', 'kwame', 'elena', 'ravi', 'fatima', 'lucas',
+  ]
+LAST = [
+  'smith', 'johnson', 'williams', 'brown', 'jones', 'garcia', 'miller', 'davis', 'rodriguez', 'martinez',
+  'hernandez', 'lopez', 'gonzalez', 'wilson', 'anderson', 'thomas', 'taylor', 'moore', 'jackson', 'martin',
+  'lee', 'nguyen', 'chen', 'patel', 'kim', 'okafor', 'haddad', 'novak', 'silva', 'tanaka', 'ivanova',
+  ]
+WORDS = [
+  'night', 'river', 'shadow', 'garden', 'city', 'storm', 'winter', 'glass', 'fire', 'silence', 'crown',
+  'ocean', 'machine', 'house', 'road', 'mountain', 'star', 'memory', 'island', 'secret', 'mirror', 'wolf',
+  'letter', 'clock', 'forest', 'kingdom', 'bridge', 'harvest', 'empire', 'ghost', 'summer', 'light',
+  ]
+ADJECTIVES = [
+  'last', 'silent', 'hidden', 'broken', 'golden', 'lost', 'burning', 'quiet', 'endless', 'wild', 'bitter',
+  'little', 'dark', 'distant', 'final', 'secret', 'long', 'red', 'forgotten', 'iron', 'strange', 'first',
+  ]
+PATTERNS = [
+  'The {A} {W}', '{W} of the {W}', 'A {W} in {W}', 'The {W} and the {W}', '{A} {W}s', 'The {W}',
+  'Beyond the {A} {W}', 'Notes on {W}', 'The {A} {W} of {W}', 'Introduction to {W}',
+  ]
+SLOT = re.compile(r'{([AW])}')
+
+
+def scaled(value):
+    """'250k' -> 250000, '10M' -> 10000000"""
+    value = value.strip().lower()
+    mult = {'k': 10**3, 'm': 10**6}.get(value[-1], 1)
+    return int(float(value.rstrip('km')) * mult)
+
+
+def zipf_weights(n, s=1.1):
+    """Cumulative Zipf weights for random.choices(): a few things very popular, most not."""
+    return list(itertools.accumulate(1 / (k ** s) for k in range(1, n + 1)))
+
+
+class Works:
+    """
+    The 'catalogue' items are copies of: each work has a title, author,
+    genre and media type, and some are (much) more popular than others.
+    """
+    def __init__(self, rng, count):
+        authors = [f'{rng.choice(FIRST).title()} {rng.choice(LAST).title()}' for _ in range(max(50, count // 8))]
+        author_weights = zipf_weights(len(authors), 0.9)
+        genre_weights = zipf_weights(len(GENRES), 0.8)
+        self.works = []
+        for i in range(count):
+            title = SLOT.sub(lambda m: rng.choice(ADJECTIVES if m.group(1) == 'A' else WORDS).title(), rng.choice(PATTERNS))
+            if rng.random() < 0.5:  # else there'd only be a few hundred distinct titles
+                title += f' {("II", "III", "IV", "Volume " + str(i % 97 + 1), str(1900 + i % 120))[i % 5]}'
+            self.works.append((
+              title,
+              rng.choices(authors, cum_weights=author_weights)[0],
+              rng.choices(GENRES, cum_weights=genre_weights)[0],
+              rng.choices([t[0] for t in MTYPES], weights=[t[2] for t in MTYPES])[0],
+              ))
+        self.weights = zipf_weights(count)
+    
+    def pick(self, rng, k):
+        return rng.choices(self.works, cum_weights=self.weights, k=k)
+
+
+class IDs:
+    """Hands out serial IDs by hand, so rows can refer to each other before they're loaded."""
+    def __init__(self, start):
+        self.next = start
+    
+    def __call__(self):
+        self.next += 1
+        return self.next - 1
+
+
+async def copy(conn, table, columns, records):
+    if records:
+        await conn.copy_records_to_table(table, records=records, columns=columns)
+
+
+async def load_location(conn, index, n_items, n_members, args, ids, works, pwhash):
+    """Generates & COPYs one location's worth of everything; returns its bit of the fixture."""
+    rng = random.Random(f'{args.seed}-{index}')
+    today = dt.date.today()
+    lid = ids['lid']()
+    name = f'{rng.choice(LAST).title()} {rng.choice(("Public Library", "High School", "Academy", "Middle School", "College"))} {index}'
+    base = ''.join(word[0] for word in name.split(None, 4)).lower()
+    fine_amt = Decimal(rng.choice(('0.05', '0.10', '0.25')))
+    await copy(conn, 'locations', ['lid', 'name', 'color', 'fine_amt', 'fine_interval', 'report_day'], [
+      (lid, name, rng.getrandbits(24), fine_amt, 1, rng.choice(('monday', 'friday', 'sunday'))),
+      ])
+    
+    rids = {}
+    role_rows = []
+    for role, perms, limits, locks, _ in ROLES:
+        rids[role] = ids['rid']()
+        role_rows.append((rids[role], lid, role, role in ('Admin', 'Organizer', 'Subscriber'), perms, limits, locks))
+    await copy(conn, 'roles', ['rid', 'lid', 'name', 'isdefault', 'permissions', 'limits', 'locks'], role_rows)
+    await copy(conn, 'mtypes', ['lid', 'name', 'unit', 'limits'], [(lid, mtype, unit, None) for mtype, unit, _ in MTYPES])
+    # Items refer to their genre by ID (see 0005_genres.sql)
+    gids = {r['name']: r['id'] for r in await conn.fetch(
+      '''INSERT INTO genres (lid, name) SELECT $1::bigint, unnest($2::text[]) RETURNING name, id''',
+      lid, GENRES,
+      )}
+    
+    # Members: the admin, the checkout account, then everyone else
+    admin, checkout = f'{base}-admin', f'{base}-checkout'
+    uids = []
+    member_rows = [
+      (ids['uid'](), lid, rids['Admin'], admin, pwhash, f'{name} Admin', f'admin@{base}.example', True, 0),
+      (ids['uid'](), lid, rids['Subscriber'], checkout, pwhash, f'{name} Patron', None, False, 1),
+      ]
+    role_names = [r[0] for r in ROLES if r[4]]
+    role_shares = [r[4] for r in ROLES if r[4]]
+    usernames = []
+    for i in range(n_members):
+        first, last = rng.choice(FIRST), rng.choice(LAST)
+        username = f'{first}{last[0]}{i}'
+        uid = ids['uid']()
+        uids.append(uid)
+        usernames.append(username)
+        member_rows.append((
+          uid, lid, rids[rng.choices(role_names, weights=role_shares)[0]], username, pwhash,
+          f'{first.title()} {last.title()}', f'{username}@{base}.example', False, 0,
+          ))
+    for chunk in range(0, len(member_rows), CHUNK):
+        await copy(conn, 'members', ['uid', 'lid', 'rid', 'username', 'pwhash', 'fullname', 'email', 'manages', 'type'], member_rows[chunk:chunk+CHUNK])
+    del member_rows
+    
+    # Items, in chunks; some readers borrow a lot more than others
+    reader_weights = zipf_weights(len(uids), 0.7) if uids else None
+    recent = {}
+    available, issued = [], []
+    hold_rows = []
+    done = 0
+    while done < n_items:
+        count = min(CHUNK, n_items - done)
+        item_rows = []
+        for title, author, genre, mtype in works.pick(rng, count):
+            mid = ids['mid']()
+            issued_to = due = fines = None
+            if uids and rng.random() < args.checked_out:
+                issued_to = rng.choices(uids, cum_weights=reader_weights)[0]
+                due = today + dt.timedelta(days=rng.randint(-45, 28))
+                fines = max(0, (today - due).days) * fine_amt
+                recent[issued_to] = genre
+                issued.append(mid)
+                # Popular, checked-out items are the ones that get held
+                if rng.random() < args.held:
+                    for uid in set(rng.sample(uids, min(len(uids), rng.randint(1, 3)))) - {issued_to}:
+                        hold_rows.append((uid, mid, today - dt.timedelta(days=rng.randint(0, 30))))
+            elif len(available) < 2000:
+                available.append(mid)
+            item_rows.append((
+              mid, lid, mtype, f'978{rng.randrange(10**10):010d}', title, author, gids[genre],
+              rng.randint(1850, today.year), Decimal(rng.randint(300, 6000)) / 100,
+              rng.randint(40, 900), today - dt.timedelta(days=rng.randint(0, 3650)),
+              issued_to, due, fines,
+              ))
+        await copy(conn, 'items', [
+          'mid', 'lid', 'type', 'isbn', 'title', 'author', 'gid', 'published', 'price',
+          'length', 'acquired', 'issued_to', 'due_date', 'fines',
+          ], item_rows)
+        done += count
+    for chunk in range(0, len(hold_rows), CHUNK):
+        await copy(conn, 'holds', ['uid', 'mid', 'created'], hold_rows[chunk:chunk+CHUNK])
+    if recent:
+        # Way faster than an UPDATE per member
+        await conn.execute('''CREATE TEMP TABLE recents (uid bigint, recent text) ON COMMIT DROP''')
+        await copy(conn, 'recents', ['uid', 'recent'], list(recent.items()))
+        await conn.execute('''UPDATE members SET recent = recents.recent FROM recents WHERE members.uid = recents.uid''')
+    
+    sample = works.works[:200]
+    return {
+      'lid': lid,
+      'name': name,
+      'admin': {'username': admin, 'password': PASSWORD},
+      'checkout': {'username': checkout, 'password': PASSWORD},
+      'members': usernames[:1000],
+      'member_uids': uids[:1000],
+      'member_password': PASSWORD,
+      'rid': rids['Subscriber'],
+      'mids': available,
+      'issued': issued[:500],
+      'titles': sorted({w[0] for w in sample}),
+      'authors': sorted({w[1] for w in sample}),
+      'genres': GENRES,
+      'counts': {'items': n_items, 'members': n_members, 'checked_out': len(issued), 'holds': len(hold_rows)},
+      }
+
+
+async def main(args):
+    conn = await asyncpg.connect(dsn=args.dsn)
+    try:
+        if args.reset:
+            await conn.execute(f'''DROP TABLE IF EXISTS {', '.join(TABLES)} CASCADE''')
+        with open(SCHEMA) as f:
+            await conn.execute(f.read())
+        await migrate(conn)
+        
+        ids = {}
+        for table, col in (('locations', 'lid'), ('roles', 'rid'), ('members', 'uid'), ('items', 'mid')):
+            ids[col] = IDs(await conn.fetchval(f'''SELECT coalesce(max({col}), 0) + 1 FROM {table}'''))
+        
+        rng = random.Random(args.seed)
+        works = Works(rng, min(500000, max(100, args.items // 3)))
+        # Location sizes vary a lot, too (a district library vs a classroom)
+        sizes = [rng.lognormvariate(0, 0.8) for _ in range(args.locations)]
+        items = [max(1, int(args.items * s / sum(sizes))) for s in sizes]
+        print(f'Hashing the shared password ({args.bcrypt_rounds} rounds)...')
+        pwhash = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(args.bcrypt_rounds))
+        
+        fixture = []
+        start = time.perf_counter()
+        for index, n_items in enumerate(items):
+            n_members = max(20, int(n_items * args.members_per_item))
+            async with conn.transaction():
+                loc = await load_location(conn, index, n_items, n_members, args, ids, works, pwhash)
+                # COPY doesn't file items under their works; see 0003_works.sql
+                await conn.execute('''SELECT works_refresh($1::bigint)''', loc['lid'])
+            fixture.append(loc)
+            c = loc['counts']
+            print(f"[{index+1}/{len(items)}] lid {loc['lid']}: {c['items']} items, {c['members']} members, "
+                  f"{c['checked_out']} checked out, {c['holds']} holds  ({time.perf_counter() - start:.0f}s)")
+        
+        for table, col in (('locations', 'lid'), ('roles', 'rid'), ('members', 'uid'), ('items', 'mid')):
+            await conn.execute(f'''SELECT setval(pg_get_serial_sequence('{table}', '{col}'), {ids[col].next - 1})''')
+        await conn.execute('''ANALYZE''')
+    finally:
+        await conn.close()
+    
+    if args.fixture:
+        with open(args.fixture, 'w') as f:
+            json.dump({'locations': fixture[:args.fixture_locations]}, f, indent=2)
+        print('Fixture written to', args.fixture)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dsn', default=os.getenv('DATABASE_URL'), help='default: $DATABASE_URL')
+    parser.add_argument('--items', type=scaled, default=scaled('100k'), help='total items, e.g. 1k, 250k, 10M')
+    parser.add_argument('--locations', type=int, help='default: one per 20k items, 1 to 500')
+    parser.add_argument('--members-per-item', type=float, default=0.125)
+    parser.add_argument('--checked-out', type=float, default=0.12, help='fraction of items checked out')
+    parser.add_argument('--held', type=float, default=0.25, help='fraction of checked-out items with holds')
+    parser.add_argument('--seed', default='booksy')
+    parser.add_argument('--bcrypt-rounds', type=int, default=12, help="12's what the app itself uses")
+    parser.add_argument('--fixture', help='write logins & item IDs for bench/loadtest.py here')
+    parser.add_argument('--fixture-locations', type=int, default=20, help='how many locations to put in the fixture')
+    parser.add_argument('--reset', action='store_true', help='drop & recreate all tables first')
+    parser.add_argument('--force', action='store_true', help="allow --reset on a DB that isn't local")
+    args = parser.parse_args()
+    if args.dsn is None:
+        parser.error('no --dsn given and DATABASE_URL is not set')
+    if args.reset and not args.force and urlparse(args.dsn).hostname not in ('localhost', '127.0.0.1', '::1', None):
+        parser.error(f'refusing to --reset {urlparse(args.dsn).hostname} without --force')
+    if args.locations is None:
+        args.locations = min(500, max(1, args.items // 20000))
+    asyncio.get_event_loop().run_until_complete(main(args))
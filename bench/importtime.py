@@ -0,0 +1,103 @@
+"""
+Measures how long it takes just to import server.py -- i.e. the bulk of
+a cold start on a dyno restart, before any DB connection is opened --
+using Python's own `-X importtime` output, and fails if that regresses.
+
+    python bench/importtime.py            # compare against the baseline
+    python bench/importtime.py --update   # record a new baseline
+
+The baseline (bench/importtime.json) has to be recorded with --update
+on the same stack as production -- until it has been, the check just
+fails and says so -- and re-recorded whenever startup gets deliberately
+faster or slower.
+
+It also fails outright if any of the modules in LAZY (which should only
+ever be imported on first use) turn up during startup, since that's the
+easiest way for the import time to quietly creep back up.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(ROOT, 'bench', 'importtime.json')
+
+# Heavy and/or rarely-used dependencies that must stay out of startup
+LAZY = 'pandas', 'aiosmtplib', 'aioredis', 'aiohttp', 'aiofiles', 'bcrypt'
+
+
+def measure():
+    """
+    Imports server.py in a fresh interpreter and returns a dict of
+    {top-level module: cumulative import time in microseconds}.
+    
+    server.py is imported rather than run so it never actually starts
+    serving; it may well die *after* its imports when run outside of
+    Heroku (no /app/dist and so on), but by then -X importtime has
+    already printed everything needed here.
+    """
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    env.setdefault('SANIC_JWT_SECRET', 'importtime')
+    proc = subprocess.run(
+      [sys.executable, '-X', 'importtime', '-c', 'import server'],
+      cwd=ROOT, env=env,
+      stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+      )
+    modules = {}
+    for line in proc.stderr.decode().splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # nested imports are indented under whatever imported them, so
+        # only the unindented ones are needed to get the full total
+        if not name[1:].startswith(' '):
+            modules[name.strip()] = int(cumulative)
+        else:
+            modules.setdefault(name.strip(), 0)
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='number of fresh interpreters to time (median is used)')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown over baseline, as a fraction')
+    parser.add_argument('--update', action='store_true', help='write the measured time out as the new baseline')
+    args = parser.parse_args()
+    
+    runs = [measure() for _ in range(args.runs)]
+    total = int(statistics.median(sum(r.values()) for r in runs))
+    slowest = sorted(runs[-1].items(), key=lambda kv: kv[1], reverse=True)[:10]
+    print(f'server.py import time: {total/1000:.1f}ms (median of {args.runs})')
+    print(*(f'  {us/1000:8.1f}ms  {name}' for name, us in slowest), sep='\n')
+    
+    eager = [name for name in LAZY if any(name in r or any(m.startswith(name + '.') for m in r) for r in runs)]
+    if eager:
+        print('FAIL: imported at startup but should be lazy:', ', '.join(eager))
+        return 1
+    
+    if args.update:
+        with open(BASELINE, 'w') as f:
+            json.dump({'total_us': total}, f, indent=2)
+            f.write('\n')
+        print('Baseline written to', os.path.relpath(BASELINE, ROOT))
+        return 0
+    if not os.path.exists(BASELINE):
+        # (a missing baseline mustn't quietly become whatever's current)
+        print('FAIL: no baseline at', os.path.relpath(BASELINE, ROOT), '(record one with --update)')
+        return 1
+    
+    with open(BASELINE) as f:
+        baseline = json.load(f)['total_us']
+    allowed = baseline * (1 + args.tolerance)
+    print(f'baseline: {baseline/1000:.1f}ms (allowing up to {allowed/1000:.1f}ms)')
+    if total > allowed:
+        print(f'FAIL: startup import time regressed by {100 * (total/baseline - 1):.0f}%')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""
+Compares the list endpoints' two ways of producing JSON, on 1,000-row
+pages: fetching Records, turning them into dicts and ujson.dumps()ing
+those (how it used to be done), against Postgres building the JSON
+itself with json_agg() and it coming back as bytes (see init_connection()
+in backend/pool.py, and Location.items() etc.).
+
+Run against a bench/dataset.py database:
+
+    python bench/jsonagg.py
+    python bench/jsonagg.py --rows 5000 --runs 50
+
+For each it reports this process's CPU time and the peak memory
+allocated (by tracemalloc) per page, plus wall time -- which, unlike
+CPU time, includes what the work moved onto Postgres costs it.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import asyncpg
+import ujson
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from backend.pool import InstrumentedPool, init_connection  # noqa: E402
+from backend.typedef import Location  # noqa: E402
+
+# The dicts way, as each of these was before
+AS_RECORDS = {
+  'items': (
+    '''SELECT items.mid, items.type, items.title, items.author, genres.name AS genre, items.image
+         FROM items LEFT JOIN genres ON genres.lid = items.lid AND genres.id = items.gid
+        WHERE items.lid = $1::bigint
+        ORDER BY items.title, items.mid LIMIT {}''',
+    ('mid', 'type', 'title', 'author', 'genre', 'image'),
+    ),
+  'members': (
+    '''SELECT uid, username, fullname FROM members WHERE lid = $1::bigint AND type = 0 ORDER BY uid LIMIT {}''',
+    ('uid', 'username', 'fullname'),
+    ),
+  }
+
+
+async def as_dicts(pool, name, lid, rows):
+    query, cols = AS_RECORDS[name]
+    return ujson.dumps([{j: i[j] for j in cols} for i in await pool.fetch(query.format(rows), lid)]).encode()
+
+
+async def as_json(location, name, rows):
+    if name == 'items':
+        return await location.items(max_results=rows)
+    return await location.members(by_role=False, max_results=rows)
+
+
+async def measure(coro_fn, runs):
+    """(median CPU s, median peak bytes, median wall s, response size) of awaiting coro_fn() `runs` times"""
+    cpu, peak, wall = [], [], []
+    for _ in range(runs):
+        tracemalloc.start()
+        start_cpu, start_wall = time.process_time(), time.perf_counter()
+        body = await coro_fn()
+        cpu.append(time.process_time() - start_cpu)
+        wall.append(time.perf_counter() - start_wall)
+        peak.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return statistics.median(cpu), statistics.median(peak), statistics.median(wall), len(body)
+
+
+async def main(args):
+    pool = InstrumentedPool(await asyncpg.create_pool(dsn=args.dsn, min_size=1, max_size=2, init=init_connection))
+    try:
+        # The location with the most items, so that there's a full page of everything
+        lid = await pool.fetchval('''SELECT lid FROM items GROUP BY lid ORDER BY count(*) DESC LIMIT 1''')
+        location = await Location(lid, SimpleNamespace(pg_pool=pool))
+        print(f'location {lid}, {args.rows} rows/page, median of {args.runs} runs')
+        print(f'{"":>10} {"":>8} {"cpu ms":>8} {"peak KiB":>9} {"wall ms":>8} {"bytes":>9}')
+        for name in AS_RECORDS:
+            for how, fn in (
+              ('dicts', lambda: as_dicts(pool, name, lid, args.rows)),
+              ('json_agg', lambda: as_json(location, name, args.rows)),
+              ):
+                await fn()  # warm up (prepared statement cache etc.)
+                cpu, peak, wall, size = await measure(fn, args.runs)
+                print(f'{name:>10} {how:>8} {cpu*1000:8.2f} {peak/1024:9.1f} {wall*1000:8.2f} {size:9}')
+    finally:
+        await pool.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dsn', default=os.getenv('DATABASE_URL'), help='default: $DATABASE_URL')
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error('no --dsn given and DATABASE_URL is not set')
+    asyncio.get_event_loop().run_until_complete(main(args))
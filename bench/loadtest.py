@@ -0,0 +1,373 @@
+"""
+Load-tests a locally running server.py (against a local Postgres and
+Redis) with a few workloads shaped like what libraries actually do:
+
+  morning-rush    members log in & check their notifications, while the
+                  front desk's checkout account scans stacks of items
+                  out and back in
+  search-storm    lots of members searching the catalogue at once
+  reports         admins generating live reports
+  batch-import    admins uploading CSVs of new members
+  big-tenant      the fixture's biggest location's members all searching
+                  at once, enough to saturate the DB pool by themselves
+  small-tenants   members of every other location looking at their
+                  suggestions and permissions -- cheap requests, whose
+                  latency shouldn't depend on what big-tenant is up to
+
+reports and batch-import are background jobs, so run worker.py as well;
+they're also timed from the 202 to the job being done, as "JOB <type>".
+
+    python bench/loadtest.py --fixture bench/fixture.json              # the default scenarios
+    python bench/loadtest.py --fixture ... -s search-storm -c 50 -d 60
+    python bench/loadtest.py --fixture ... --update                    # record a new baseline
+    python bench/loadtest.py --fixture ... --isolation                 # small-tenants alone, then with big-tenant
+
+Prints p50/p95/p99 latency and throughput per endpoint, writes the lot
+out as JSON (--out), and compares it against the baseline in
+bench/loadtest-baseline.json, failing if any endpoint's p95 got worse
+(or its throughput dropped) by more than --tolerance. (big-tenant and
+small-tenants aren't in the default set, since they'd skew the rest.)
+
+--isolation instead runs small-tenants by itself and then again next to
+big-tenant, and fails if the small locations' p99 went up by more than
+--tolerance in the meantime; i.e. it checks that the pool's being shared
+fairly (see backend/fairpool.py). Start the server with
+RATE_LIMITS='{"search": null}' for that, or big-tenant mostly gets 429s.
+
+The fixture says who to log in as and what to ask for:
+
+    {"locations": [{
+        "lid": 1,
+        "admin": {"username": "...", "password": "..."},
+        "checkout": {"username": "...", "password": "..."},
+        "members": ["username", ...], "member_password": "...",
+        "member_uids": [the above members' uIDs, in the same order],
+        "rid": <role ID to give batch-imported members>,
+        "mids": [item ID, ...],
+        "titles": [...], "authors": [...], "genres": [...]
+    }, ...]}
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(ROOT, 'bench', 'loadtest-baseline.json')
+
+REPORT = {'checkouts': False, 'overdues': False, 'fines': False, 'holds': False}
+
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of an already-sorted list."""
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+
+class Stats:
+    """Latencies & statuses per endpoint, only once warmup is over."""
+    def __init__(self):
+        self.recording = False
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.started = self.stopped = None
+    
+    def start(self):
+        self.recording = True
+        self.started = time.perf_counter()
+    
+    def stop(self):
+        self.recording = False
+        self.stopped = time.perf_counter()
+    
+    def record(self, endpoint, seconds, status):
+        if self.recording:
+            self.latencies[endpoint].append(seconds)
+            self.statuses[endpoint][str(status)] += 1
+    
+    def summary(self):
+        elapsed = (self.stopped or time.perf_counter()) - self.started
+        out = {}
+        for endpoint, latencies in sorted(self.latencies.items()):
+            ordered = sorted(latencies)
+            statuses = self.statuses[endpoint]
+            out[endpoint] = {
+              'requests': len(ordered),
+              'errors': sum(n for status, n in statuses.items() if not status.startswith(('2', '3'))),
+              'statuses': dict(statuses),
+              'throughput': len(ordered) / elapsed,
+              **{f'p{p}_ms': percentile(ordered, p) * 1000 for p in (50, 95, 99)},
+              'max_ms': ordered[-1] * 1000,
+              }
+        return out
+
+
+class Client:
+    """One virtual user, with their own cookies (and so their own session)."""
+    def __init__(self, base, stats):
+        self.base = base.rstrip('/')
+        self.stats = stats
+        # unsafe=True, or aiohttp won't keep cookies set by an IP address like 127.0.0.1
+        self.session = aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar(unsafe=True))
+    
+    async def request(self, method, path, endpoint=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            async with self.session.request(method, self.base + path, allow_redirects=False, **kwargs) as resp:
+                body = await resp.read()
+                status = resp.status
+        except aiohttp.ClientError as e:
+            body, status = str(e).encode(), 'error'
+        self.stats.record(endpoint or f'{method} {path}', time.perf_counter() - start, status)
+        return status, body
+    
+    async def login(self, lid, username, password):
+        status, _ = await self.request('POST', '/auth', json={'user_id': username, 'password': password, 'lid': lid})
+        if status != 200:
+            raise RuntimeError(f'could not log in as {username} at location {lid} ({status})')
+    
+    async def close(self):
+        await self.session.close()
+
+
+async def morning_rush(client, loc, rng, *, scans=10):
+    """
+    A member logs in and checks their notifications; meanwhile the front
+    desk scans a stack of items out to them and then back in.
+    """
+    username = rng.choice(loc['members'])
+    await client.login(loc['lid'], username, loc['member_password'])
+    await client.request('GET', '/api/member/notifications', params={'lid': loc['lid'], 'username': username})
+    await client.login(loc['lid'], loc['checkout']['username'], loc['checkout']['password'])
+    stack = rng.sample(loc['mids'], min(scans, len(loc['mids'])))
+    for mid in stack:
+        status, _ = await client.request('GET', '/api/media/check', params={'mid': mid})
+        if status == 200:
+            await client.request('POST', '/api/media/check/out', json={'mid': mid, 'username': username, 'lid': loc['lid']})
+    for mid in stack:
+        await client.request('POST', '/api/media/check/in', json={'mid': mid, 'username': username, 'lid': loc['lid']})
+
+
+async def search_storm(client, loc, rng):
+    """A member runs a search, then pages through a few results."""
+    field = rng.choice(('title', 'author', 'genre'))
+    term = rng.choice(loc[field + 's'])
+    # short prefixes, like someone typing
+    term = term[:rng.randint(3, max(3, len(term)))]
+    params = {'title': 'null', 'genre': 'null', 'media_type': 'null', 'author': 'null', field: term}
+    for cont in range(0, 5 * rng.randint(1, 3), 5):
+        await client.request('GET', '/api/location/media/search', params={**params, 'cont': cont})
+
+
+async def await_job(client, status, body, endpoint, *, every=0.5):
+    """
+    Polls the job a 202 was for (see backend/jobs.py) until it's done,
+    and records how long that took from start to finish as `endpoint`.
+    """
+    if status != 202:
+        return
+    jid = json.loads(body)['job']
+    start = time.perf_counter()
+    while True:
+        status, body = await client.request('GET', f'/api/jobs/{jid}', 'GET /api/jobs/<jid>')
+        state = json.loads(body)['state'] if status == 200 else 'error'
+        if state in ('done', 'failed', 'error'):
+            break
+        await asyncio.sleep(every)
+    client.stats.record(endpoint, time.perf_counter() - start, 200 if state == 'done' else state)
+
+
+async def reports(client, loc, rng):
+    """An admin generates one of the live reports."""
+    kind, sort_by = rng.choice([
+      ('checkouts', 'per_user'), ('checkouts', 'per_role'), ('overdues', 'per_user'),
+      ('fines', 'per_user'), ('holds', 'per_user'),
+      ])
+    status, body = await client.request('PUT', '/api/location/reports', json={'get': {**REPORT, kind: sort_by}, 'live': True})
+    await await_job(client, status, body, 'JOB report.live')
+
+
+async def batch_import(client, loc, rng, *, rows=200):
+    """An admin uploads a CSV of new members."""
+    tag = f'{rng.getrandbits(40):010x}'
+    csv = 'fullname,username,password\n' + ''.join(
+      f'Load Test {tag} {i},lt{tag}{i},loadtest{i}\n' for i in range(rows)
+      )
+    form = aiohttp.FormData()
+    form.add_field('rid', str(loc['rid']))
+    form.add_field('csv', io.BytesIO(csv.encode()), filename='members.csv', content_type='text/csv')
+    status, body = await client.request('POST', '/api/location/members/add/batch', data=form)
+    await await_job(client, status, body, 'JOB members.import')
+
+
+async def big_tenant(client, loc, rng):
+    """search_storm(), tagged as the big location's."""
+    field = rng.choice(('title', 'author', 'genre'))
+    term = rng.choice(loc[field + 's'])[:3]  # short, so lots of matches
+    params = {'title': 'null', 'genre': 'null', 'media_type': 'null', 'author': 'null', field: term}
+    await client.request('GET', '/api/location/media/search', '[big] GET /api/location/media/search', params={**params, 'cont': 0})
+
+
+async def small_tenants(client, loc, rng):
+    """A member at a small location looks at their own stuff."""
+    await client.request('GET', '/api/member/suggest', '[small] GET /api/member/suggest')
+    await client.request('GET', '/api/member/check-perms', '[small] GET /api/member/check-perms')
+    await asyncio.sleep(rng.uniform(0, 0.2))  # they're people, not a script
+
+
+def biggest(fixture):
+    return max(fixture['locations'], key=lambda loc: len(loc['mids']))
+
+
+# name -> (workload, who it logs in as beforehand, share of --concurrency, which locations)
+SCENARIOS = {
+  'morning-rush': (morning_rush, None, 0.4, 'any'),  # logs in by itself
+  'search-storm': (search_storm, 'member', 0.4, 'any'),
+  'reports': (reports, 'admin', 0.1, 'any'),
+  'batch-import': (batch_import, 'admin', 0.1, 'any'),
+  'big-tenant': (big_tenant, 'member', 0.8, 'big'),
+  'small-tenants': (small_tenants, 'member', 0.2, 'small'),
+  }
+DEFAULT_SCENARIOS = ['morning-rush', 'search-storm', 'reports', 'batch-import']
+
+
+async def worker(name, base, stats, fixture, seed, deadline):
+    workload, login_as, _, where = SCENARIOS[name]
+    rng = random.Random(seed)
+    client = Client(base, stats)
+    try:
+        big = biggest(fixture)
+        if where == 'big':
+            loc = big
+        elif where == 'small':
+            loc = rng.choice([loc for loc in fixture['locations'] if loc is not big] or [big])
+        else:
+            loc = rng.choice(fixture['locations'])
+        if login_as == 'member':
+            await client.login(loc['lid'], rng.choice(loc['members']), loc['member_password'])
+        elif login_as == 'admin':
+            await client.login(loc['lid'], loc['admin']['username'], loc['admin']['password'])
+        while time.perf_counter() < deadline:
+            await workload(client, loc, rng)
+    finally:
+        await client.close()
+
+
+async def run(args, fixture, scenarios=None):
+    stats = Stats()
+    start = time.perf_counter()
+    deadline = start + args.warmup + args.duration
+    weights = {name: SCENARIOS[name][2] for name in scenarios or args.scenario}
+    total = sum(weights.values())
+    tasks = []
+    for name, weight in weights.items():
+        for i in range(max(1, round(args.concurrency * weight / total))):
+            tasks.append(worker(name, args.url, stats, fixture, f'{args.seed}-{name}-{i}', deadline))
+    
+    async def measure():
+        await asyncio.sleep(args.warmup)
+        stats.start()
+        await asyncio.sleep(args.duration)
+        stats.stop()
+    await asyncio.gather(measure(), *tasks)
+    return stats.summary()
+
+
+def compare(results, baseline, tolerance):
+    """Returns a list of regressions, as human-readable strings."""
+    failures = []
+    for endpoint, old in baseline.items():
+        new = results.get(endpoint)
+        if new is None:
+            continue
+        if new['p95_ms'] > old['p95_ms'] * (1 + tolerance):
+            failures.append(f"{endpoint}: p95 {old['p95_ms']:.1f}ms -> {new['p95_ms']:.1f}ms")
+        if new['throughput'] < old['throughput'] * (1 - tolerance):
+            failures.append(f"{endpoint}: throughput {old['throughput']:.1f}/s -> {new['throughput']:.1f}/s")
+    return failures
+
+
+def isolation(args, fixture):
+    """
+    Runs small-tenants alone and then alongside big-tenant, and compares
+    the small locations' p99s. Returns a list of regressions, as above.
+    """
+    loop = asyncio.get_event_loop()
+    alone = loop.run_until_complete(run(args, fixture, ['small-tenants']))
+    shared = loop.run_until_complete(run(args, fixture, ['big-tenant', 'small-tenants']))
+    failures = []
+    print(f"{'endpoint':<52} {'alone p99':>10} {'shared p99':>11}")
+    for endpoint, r in shared.items():
+        before = alone.get(endpoint)
+        if before is None:
+            print(f"{endpoint:<52} {'':>10} {r['p99_ms']:>9.1f}ms")
+            continue
+        print(f"{endpoint:<52} {before['p99_ms']:>8.1f}ms {r['p99_ms']:>9.1f}ms")
+        if r['p99_ms'] > before['p99_ms'] * (1 + args.tolerance):
+            failures.append(f"{endpoint}: p99 {before['p99_ms']:.1f}ms alone -> {r['p99_ms']:.1f}ms next to big-tenant")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help='where server.py is running')
+    parser.add_argument('--fixture', required=True, help='JSON file of logins & data to use; see above')
+    parser.add_argument('-s', '--scenario', action='append', choices=SCENARIOS, help='scenario(s) to run (default: all of them)')
+    parser.add_argument('-c', '--concurrency', type=int, default=20, help='virtual users, split between scenarios')
+    parser.add_argument('-d', '--duration', type=float, default=30, help='seconds to measure for')
+    parser.add_argument('--warmup', type=float, default=5, help='seconds to run for before measuring')
+    parser.add_argument('--seed', default='booksy', help='for the choice of users, items & search terms')
+    parser.add_argument('--out', help='where to write the results (default: bench/results/loadtest-<time>.json)')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed regression over baseline, as a fraction')
+    parser.add_argument('--update', action='store_true', help='write the results out as the new baseline')
+    parser.add_argument('--isolation', action='store_true', help="check small locations aren't slowed down by a big one")
+    args = parser.parse_args()
+    args.scenario = args.scenario or DEFAULT_SCENARIOS
+    
+    with open(args.fixture) as f:
+        fixture = json.load(f)
+    if args.isolation:
+        failures = isolation(args, fixture)
+        if failures:
+            print('FAIL: small locations slowed down:', *failures, sep='\n  ')
+            return 1
+        print('OK: small locations within', f'{args.tolerance:.0%}', 'of their p99 alone')
+        return 0
+    results = asyncio.get_event_loop().run_until_complete(run(args, fixture))
+    
+    print(f"{'endpoint':<44} {'reqs':>7} {'err':>5} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for endpoint, r in results.items():
+        print(f"{endpoint:<44} {r['requests']:>7} {r['errors']:>5} {r['throughput']:>8.1f}"
+              f" {r['p50_ms']:>6.1f}ms {r['p95_ms']:>6.1f}ms {r['p99_ms']:>6.1f}ms")
+    
+    out = args.out or os.path.join(ROOT, 'bench', 'results', time.strftime('loadtest-%Y%m%d-%H%M%S.json'))
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    meta = {k: getattr(args, k) for k in ('url', 'scenario', 'concurrency', 'duration', 'warmup', 'seed')}
+    with open(out, 'w') as f:
+        json.dump({'meta': meta, 'endpoints': results}, f, indent=2)
+    print('Results written to', os.path.relpath(out, ROOT))
+    
+    if args.update or not os.path.exists(BASELINE):
+        with open(BASELINE, 'w') as f:
+            json.dump({'meta': meta, 'endpoints': results}, f, indent=2)
+        print('Baseline written to', os.path.relpath(BASELINE, ROOT))
+        return 0
+    with open(BASELINE) as f:
+        failures = compare(results, json.load(f)['endpoints'], args.tolerance)
+    if failures:
+        print('FAIL: regressed against baseline:', *failures, sep='\n  ')
+        return 1
+    print('OK: within', f'{args.tolerance:.0%}', 'of baseline')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,312 @@
+"""
+Checks how many DB queries and pool acquisitions every endpoint makes
+against a budget, so that a new eager attribute somewhere in the
+User -> Location -> owner User -> Role chain (and so on) can't quietly
+add round trips to every request.
+
+Run server.py locally against a bench/dataset.py database with
+
+    DB_ROUNDTRIP_HEADERS=1   (reports each request's counts, and the route
+                              it matched, in X-DB-Queries/X-DB-Acquires/
+                              X-Route headers; see backend/metrics.py)
+    ADMIN_TOKEN=<anything>   (for /metrics and /admin/*)
+    RATE_LIMITS='{"reports": null, "batch": null, "search": null, "exports": null}'
+                             (else running this twice in a row gets 429s)
+
+and a worker.py if the report and CSV-import jobs it queues up should
+actually run. Then:
+
+    python bench/roundtrips.py --fixture bench/fixture.json            # check against budgets
+    python bench/roundtrips.py --fixture bench/fixture.json --update   # record new budgets
+
+Every route the blueprints define gets requested (bar EXCLUDED), logged
+in as the fixture's first location's admin; writes come in pairs that
+undo each other, so the data's the same after every run. Adding media
+looks the item up on Google Books, so that needs network access.
+
+Fails if any endpoint goes over its budget in bench/roundtrip-budgets.json
+(or has none), goes over one of TARGETS, answers with a status it
+shouldn't, or isn't requested at all. Streaming responses (the exports
+and /api/member/events) only count what's done before the stream starts.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import sys
+import uuid
+
+import aiohttp
+import sanic
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGETS = os.path.join(ROOT, 'bench', 'roundtrip-budgets.json')
+sys.path.insert(0, ROOT)
+
+from backend.blueprints import bp  # noqa: E402
+from backend.streaming import NDJSON  # noqa: E402
+
+# Most queries *or* acquisitions these may make, whatever the budgets say
+TARGETS = {
+  'GET /api/media/check': 2,
+  'GET /api/member/notifications': 2,
+  }
+
+# Routes not requested, and why
+EXCLUDED = {
+  'POST /api/location/signup': 'emails whoever signs up',
+  }
+
+REPORT = {'checkouts': 'per_user', 'overdues': False, 'fines': False, 'holds': False}
+LIMITS = {'checkout_duration': 2, 'renewals': 1, 'holds': 5}
+
+Step = collections.namedtuple('Step', 'method route path kwargs ok save stream')
+
+
+class StateMissing(Exception):
+    pass
+
+
+def step(method, route, path=None, *, ok=(200, 204), save=None, stream=False, **kwargs):
+    """
+    One request. `route` is the pattern it should match (as in
+    X-Route), `path` what's actually requested if that's different, and
+    `save` is called with the response body if the status is in `ok`.
+    """
+    return Step(method, route, path or route, kwargs, ok, save, stream)
+
+
+def key(method, route):
+    return f"{method} {route.rstrip('/') or '/'}"
+
+
+def routes():
+    """Every 'METHOD /route' the blueprints define."""
+    app = sanic.Sanic('roundtrips')
+    app.blueprint(bp)
+    return {key(method, r.uri) for r in app.router.routes_all.values() for method in r.methods}
+
+
+def _uid_of(username):
+    def save(body):
+        for line in body.splitlines():
+            member = json.loads(line)
+            if member['username'] == username:
+                return member['uid']
+        raise StateMissing(f'{username} not in the members export')
+    return save
+
+
+def steps(loc, s, admin_token):
+    """
+    Yields each Step in turn, so later ones can use what earlier ones
+    saved in `s` (a KeyError from one means that never happened).
+    """
+    def put(name, get=lambda body: body):
+        def save(body):
+            s[name] = get(body)
+        return save
+    
+    def js(*path):
+        def get(body):
+            obj = json.loads(body)
+            for i in path:
+                obj = obj[i]
+            return obj
+        return get
+    
+    lid, rid = loc['lid'], loc['rid']
+    admin, password = loc['admin']['username'], loc['admin']['password']
+    uid, mid, issued = loc['member_uids'][0], loc['mids'][0], loc['issued'][0]
+    tag = uuid.uuid4().hex[:8]  # (so a run that died halfway doesn't collide with the next)
+    username, mtype, genre = f'rt-{tag}', f'rt-{tag}', f'rt-{tag}'
+    seqs = {'perms': {}, 'limits': {'checkout_duration': 1, 'renewals': 0, 'holds': 0}, 'locks': {'checkouts': 1, 'fines': 0}}
+    item = {'title': f'Roundtrip {tag}', 'author': 'Bench', 'published': 2000, 'genre': genre, 'isbn': '', 'price': '9.99', 'length': 100}
+    
+    # Reads
+    yield step('GET', '/api/attrs')
+    yield step('GET', '/api/bootstrap')
+    yield step('GET', '/api/help/titles', save=put('help', lambda body: next((a['id'] for a in json.loads(body)['articles']), 0)))
+    yield step('GET', '/api/help/content', params={'ID': s['help']}, ok=(200, 404))
+    yield step('GET', '/api/help/brief', params={'ID': s['help']}, ok=(200, 404))
+    yield step('GET', '/api/roles/me')
+    yield step('GET', '/api/roles/me/<attr:(perms|limits|locks)>', '/api/roles/me/perms')
+    yield step('GET', '/api/member/check-perms')
+    yield step('GET', '/stock/buttons/main-header')
+    yield step('GET', '/stock/buttons/home-sidebar')
+    yield step('GET', '/stock/buttons/mgmt-header')
+    yield step('GET', '/api/location/', save=put('loc', js('loc')))
+    yield step('GET', '/api/location/is-registered')
+    yield step('GET', '/api/location/reports/last')
+    yield step('GET', '/api/location/pickup-shelf')
+    yield step('GET', '/api/location/backups/<to_back_up:members|location|roles|holds|items>', '/api/location/backups/members', ok=(500,))  # (NotImplementedError)
+    yield step('GET', '/api/location/roles/')
+    yield step('GET', '/api/location/roles/filtered')
+    yield step('GET', '/api/location/members/', params={'cont': 0})
+    yield step('GET', '/api/location/members/info', params={'check': uid})
+    yield step('GET', '/api/location/media/', params={'cont': 0})
+    yield step('GET', '/api/location/media/export', stream=True)
+    yield step('GET', '/api/location/media/search', params={'title': loc['titles'][0][:4], 'genre': 'null', 'media_type': 'null', 'author': 'null', 'cont': 0})
+    yield step('GET', '/api/location/media/types/')
+    yield step('GET', '/api/location/media/genres/')
+    yield step('GET', '/api/member/notifications', params={'lid': lid, 'username': loc['members'][0]})
+    yield step('GET', '/api/member/events', stream=True)
+    yield step('GET', '/api/member/suggest')
+    yield step('GET', '/api/member/checked-out', params={'member': uid})
+    yield step('GET', '/api/member/held', params={'member': uid})
+    yield step('GET', '/api/media/check', params={'mid': mid})
+    yield step('GET', '/api/media/check', params={'mid': issued})
+    yield step('GET', '/api/media/info', params={'mid': mid})
+    for route in ('/metrics', '/admin/pool', '/admin/slow-queries'):
+        yield step('GET', route, headers={'Authorization': f'Bearer {admin_token}'})
+    
+    # Jobs (a live report, since the weekly one's computed then and there)
+    yield step('PUT', '/api/location/reports', json={'get': REPORT, 'live': True}, ok=(202,), save=put('job', js('job')))
+    yield step('GET', '/api/jobs/<jid:int>', f"/api/jobs/{s['job']}")
+    form = aiohttp.FormData()
+    form.add_field('rid', str(rid))
+    form.add_field('csv', b'fullname,username,password\n', filename='members.csv', content_type='text/csv')
+    yield step('POST', '/api/location/members/add/batch', data=form, ok=(202,))
+    
+    # Members
+    yield step('POST', '/api/location/members/add', json={'member': {'username': username, 'rid': rid, 'name': 'Roundtrip Test', 'password': password}})
+    yield step('GET', '/api/location/members/export', headers={'Accept': NDJSON}, save=put('uid', _uid_of(username)))
+    yield step('POST', '/api/member/edit', json={'member': {'user_id': s['uid'], 'username': username, 'rid': rid, 'name': 'Roundtrip Test'}})
+    yield step('POST', '/api/location/members/remove', json={'member': s['uid']})
+    
+    # Edits that leave everything as it was
+    yield step('POST', '/api/location/edit', json={'locname': None, 'color': None, 'checkoutpw': None, 'fine_amt': s['loc']['fine_amt'], 'fine_interval': s['loc']['fine_interval']})
+    yield step('POST', '/api/member/self', json={'fullname': f"{loc['name']} Admin", 'newpass': password, 'curpass': password})
+    
+    # Roles
+    yield step('POST', '/api/location/roles/add', json={'name': username, 'seqs': seqs}, save=put('rid', js('rid')))
+    yield step('GET', '/api/roles/detail', params={'rid': s['rid']})
+    yield step('POST', '/api/roles/edit', json={'rid': s['rid'], 'name': username, 'seqs': seqs})
+    yield step('PUT', '/api/roles/delete', json={'rid': s['rid']})
+    
+    # A media type, and an item of it taken through checkout, a hold and
+    # the type being renamed and removed from under it
+    yield step('POST', '/api/location/media/types/add', json={'add': {'name': mtype, 'unit': 'pages', 'limits': LIMITS}})
+    yield step('GET', '/api/location/media/types/info', params={'name': mtype})
+    yield step('POST', '/api/location/media/add', json={**item, 'media_type': {'name': mtype}}, save=put('mid', js('mid')))
+    yield step('POST', '/api/media/edit', json={**item, 'mid': s['mid'], 'type_': mtype})
+    yield step('POST', '/api/location/media/genres/edit', json={'genre': genre, 'to': f'{genre}-2'})
+    yield step('POST', '/api/media/check/out', json={'mid': s['mid'], 'username': loc['checkout']['username'], 'lid': lid})
+    yield step('POST', '/api/media/clear-fines', json={'mid': s['mid']})
+    yield step('POST', '/api/media/hold', json={'mid': s['mid']})
+    yield step('POST', '/api/location/media/types/edit', json={'edit': mtype, 'name': f'{mtype}-2', 'unit': 'pages', 'limits': None})
+    yield step('POST', '/api/media/check/in', json={'mid': s['mid'], 'username': admin, 'lid': lid})
+    yield step('GET', '/api/location/pickup-shelf')
+    yield step('POST', '/api/member/clear-hold', json={'mid': s['mid']})
+    yield step('POST', '/api/location/media/types/remove', json={'remove': f'{mtype}-2'})
+    yield step('POST', '/api/location/media/remove', json={'mid': s['mid']})
+    # (and one of a type that stays, to delete the other way)
+    yield step('POST', '/api/location/media/add', json={**item, 'genre': f'{genre}-2', 'media_type': {'name': 'book'}}, save=put('mid', js('mid')))
+    yield step('POST', '/api/media/delete', json={'mid': s['mid']})
+    yield step('POST', '/api/location/media/genres/remove', json={'genre': f'{genre}-2'})
+
+
+async def measure(url, loc, admin_token):
+    """
+    ({'METHOD /route': {'queries', 'acquires'}}, the worst of any repeats;
+    [problems with any of the responses])
+    """
+    results, problems, state = {}, [], {}
+    jar = aiohttp.CookieJar(unsafe=True)  # else no cookies from 127.0.0.1
+    async with aiohttp.ClientSession(cookie_jar=jar) as session:
+        login = {'user_id': loc['admin']['username'], 'password': loc['admin']['password'], 'lid': loc['lid']}
+        async with session.post(url + '/auth', json=login) as resp:
+            if resp.status != 200:
+                raise RuntimeError(f'could not log in as {login["user_id"]} ({resp.status})')
+        todo = steps(loc, state, admin_token)
+        while True:
+            try:
+                st = next(todo)
+            except StopIteration:
+                break
+            except KeyError as e:
+                problems.append(f'stopped early: needed {e} from a step that failed')
+                break
+            name = key(st.method, st.route)
+            # Every request made without If-None-Match, so @conditional
+            # endpoints are measured on a cache miss
+            async with session.request(st.method, url + st.path, allow_redirects=False, **st.kwargs) as resp:
+                if st.stream:
+                    resp.close()  # (doesn't end by itself, in the case of /events)
+                    body = b''
+                else:
+                    body = await resp.read()
+                if 'X-DB-Queries' not in resp.headers:
+                    raise RuntimeError('no X-DB-Queries header; is the server running with DB_ROUNDTRIP_HEADERS=1?')
+                route = key(st.method, resp.headers.get('X-Route', st.route))
+                if route != name:
+                    problems.append(f'{st.method} {st.path}: matched {route}, not {name}')
+                if resp.status not in st.ok:
+                    problems.append(f'{st.method} {st.path}: status {resp.status}, {body[:200]!r}')
+                elif st.save is not None:
+                    try:
+                        st.save(body)
+                    except StateMissing as e:
+                        problems.append(f'{st.method} {st.path}: {e}')
+                prev = results.get(name, {'queries': 0, 'acquires': 0})
+                results[name] = {
+                  'queries': max(prev['queries'], int(resp.headers['X-DB-Queries'])),
+                  'acquires': max(prev['acquires'], int(resp.headers['X-DB-Acquires'])),
+                  }
+    return results, problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help='where server.py is running')
+    parser.add_argument('--fixture', required=True, help="bench/dataset.py's --fixture output")
+    parser.add_argument('--admin-token', default=os.getenv('ADMIN_TOKEN'), help="the server's ADMIN_TOKEN (default: $ADMIN_TOKEN)")
+    parser.add_argument('--update', action='store_true', help='write the measured counts out as the new budgets')
+    args = parser.parse_args()
+    if not args.admin_token:
+        parser.error('no --admin-token given and ADMIN_TOKEN is not set')
+    
+    budgets = {}
+    if os.path.exists(BUDGETS):
+        with open(BUDGETS) as f:
+            budgets = json.load(f)
+    elif not args.update:
+        print(f'FAIL: no budgets in {os.path.relpath(BUDGETS, ROOT)}; record some with --update')
+        return 1
+    with open(args.fixture) as f:
+        loc = json.load(f)['locations'][0]
+    results, failures = asyncio.get_event_loop().run_until_complete(measure(args.url.rstrip('/'), loc, args.admin_token))
+    
+    print(f"{'endpoint':<52} {'queries':>8} {'acquires':>9}  budget")
+    for name, r in sorted(results.items()):
+        budget = budgets.get(name)
+        note = 'none' if budget is None else f"{budget['queries']}/{budget['acquires']}"
+        if args.update:
+            pass
+        elif budget is None:
+            failures.append(f'{name}: no budget')
+        elif r['queries'] > budget['queries'] or r['acquires'] > budget['acquires']:
+            failures.append(f"{name}: {r['queries']}/{r['acquires']} over budget of {note}")
+            note += '  OVER'
+        if name in TARGETS and max(r['queries'], r['acquires']) > TARGETS[name]:
+            failures.append(f"{name}: {r['queries']}/{r['acquires']}, target is {TARGETS[name]}")
+            note += '  OVER TARGET'
+        print(f"{name:<52} {r['queries']:>8} {r['acquires']:>9}  {note}")
+    
+    missed = routes() - set(results) - set(EXCLUDED)
+    failures.extend(f'{name}: never requested' for name in sorted(missed))
+    if args.update:
+        with open(BUDGETS, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('Budgets written to', os.path.relpath(BUDGETS, ROOT))
+    if failures:
+        print('FAIL:', *failures, sep='\n  ')
+        return 1
+    print('OK: every endpoint requested and within budget')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
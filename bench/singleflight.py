@@ -0,0 +1,141 @@
+"""
+Checks backend/singleflight.py's behaviour -- that concurrent identical
+lookups share one call, and that what happens to the first caller
+(cancelled, or the lookup failing) happens properly to the rest -- and
+reports the coalescing ratio for a burst of identical lookups. Doesn't
+need a DB or a running server:
+
+    python bench/singleflight.py
+    python bench/singleflight.py --callers 200
+
+Exits non-zero if any check fails.
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from backend import context, metrics  # noqa: E402
+from backend.core import AsyncInit  # noqa: E402
+from backend.singleflight import SingleFlight  # noqa: E402
+
+DELAY = 0.05  # s; how long each pretend lookup takes
+
+
+class Lookup:
+    """A pretend DB call that counts how often it's actually made."""
+    def __init__(self, result='row', error=None):
+        self.calls = 0
+        self.result = result
+        self.error = error
+    
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(DELAY)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class Thing(AsyncInit):
+    coalesce = True
+    loads = 0
+    
+    async def __init__(self, tid, app=None):
+        type(self).loads += 1
+        await asyncio.sleep(DELAY)
+        self.tid = int(tid)
+
+
+async def check_shared(flight, callers):
+    lookup = Lookup()
+    results = await asyncio.gather(*(flight.do('k', lookup) for _ in range(callers)))
+    assert lookup.calls == 1, f'{lookup.calls} calls for {callers} callers'
+    assert all(r == 'row' for r in results)
+    assert not len(flight), 'finished lookup left in flight'
+
+
+async def check_leader_cancelled(flight):
+    lookup = Lookup()
+    leader = asyncio.ensure_future(flight.do('k', lookup))
+    await asyncio.sleep(0)  # so it's in flight before anyone joins
+    followers = [asyncio.ensure_future(flight.do('k', lookup)) for _ in range(5)]
+    await asyncio.sleep(0)
+    leader.cancel()
+    results = await asyncio.gather(*followers)
+    assert leader.cancelled()
+    assert lookup.calls == 1 and results == ['row'] * 5, 'followers lost their result with the leader'
+
+
+async def check_everyone_cancelled(flight):
+    lookup = Lookup()
+    callers = [asyncio.ensure_future(flight.do('k', lookup)) for _ in range(3)]
+    await asyncio.sleep(0)
+    for caller in callers:
+        caller.cancel()
+    await asyncio.sleep(DELAY * 2)
+    assert lookup.calls == 1 and not len(flight), 'abandoned lookup never landed'
+    # ...and the next caller gets a lookup of its own
+    assert await flight.do('k', lookup) == 'row' and lookup.calls == 2
+
+
+async def check_failure(flight):
+    lookup = Lookup(error=LookupError('nope'))
+    results = await asyncio.gather(*(flight.do('k', lookup) for _ in range(4)), return_exceptions=True)
+    assert lookup.calls == 1 and all(isinstance(r, LookupError) for r in results)
+    lookup.error = None
+    assert await flight.do('k', lookup) == 'row', 'a failed lookup stuck around'
+
+
+async def check_context(flight):
+    ctx = context.bind(context.RequestContext('/check'))
+    seen = []
+    
+    async def lookup():
+        seen.append(context.current())
+    await flight.do('ctx', lookup)
+    assert seen == [ctx], "lookup didn't run in the first caller's context"
+
+
+async def check_typedefs():
+    Thing.loads = 0
+    things = await asyncio.gather(*(Thing(7) for _ in range(10)), Thing('7', app=None), Thing(8))
+    assert Thing.loads == 2, f'{Thing.loads} loads for 2 distinct things'
+    assert len({id(t) for t in things}) == len(things), 'callers were handed the same object'
+    assert [t.tid for t in things] == [7] * 11 + [8]
+
+
+async def main(args):
+    flight = SingleFlight('check')
+    checks = [
+      ('shared', check_shared(flight, args.callers)),
+      ('leader cancelled', check_leader_cancelled(flight)),
+      ('everyone cancelled', check_everyone_cancelled(flight)),
+      ('lookup failed', check_failure(flight)),
+      ('request context', check_context(flight)),
+      ('typedef coalescing', check_typedefs()),
+      ]
+    failed = 0
+    for name, check in checks:
+        try:
+            await check
+        except AssertionError as e:
+            failed += 1
+            print(f'FAIL {name}: {e}')
+        else:
+            print(f'ok   {name}')
+    
+    counts = metrics.SINGLEFLIGHT._values
+    led, joined = counts.get(('check', 'led'), 0), counts.get(('check', 'joined'), 0)
+    print(f'coalescing ratio: {joined}/{led + joined} = {joined / (led + joined):.1%} of lookups joined one in flight')
+    return failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--callers', type=int, default=50, help='concurrent identical lookups for the burst')
+    args = parser.parse_args()
+    sys.exit(1 if asyncio.get_event_loop().run_until_complete(main(args)) else 0)
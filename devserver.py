@@ -8,8 +8,6 @@ import os
 from concurrent.futures import ProcessPoolExecutor
 from glob import glob
 
-import aiohttp
-import aioredis
 import asyncpg
 import sanic
 import urllib
@@ -18,8 +16,10 @@ import sanic_jwt as jwt
 from sanic import Sanic
 
 from backend import deco
-from backend.typedef import Location, Role, MediaItem, MediaType, User
+from backend.typedef import Location, User
 from backend.blueprints import bp
+from backend.helpcache import HelpCache
+from backend.versions import Versions
 
 asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())  # make it go faster <3
 
@@ -35,6 +35,7 @@ app.blueprint(bp)
 app.config.TESTING = True
 
 app.rtoken_cache = {}  # refresh-token dict
+app.versions = Versions()
 
 
 async def authenticate(rqst, *args, **kwargs):
@@ -140,6 +141,14 @@ for rel, absol in zip(relative, absolute):
     app.static(rel[0], absol[0])  # Route user requests to Angular's files
 
 
+def http_session():
+    """Same as in server.py"""
+    if app.session is None:
+        import aiohttp
+        app.session = aiohttp.ClientSession()
+    return app.session
+
+
 @app.listener('before_server_start')
 async def set_up_dbs(app, loop):
     """
@@ -148,19 +157,24 @@ async def set_up_dbs(app, loop):
     """
     app.pg_pool = await asyncpg.create_pool(dsn=os.getenv('DATABASE_URL'), max_size=15, loop=loop)
     app.acquire = app.pg_pool.acquire
+    app.pg_listener = await asyncpg.connect(dsn=os.getenv('DATABASE_URL'), loop=loop)
+    app.help = HelpCache(app)
+    await app.help.load()
+    await app.help.listen(app.pg_listener)
     # async with app.acquire() as conn:
     #     await setup.create_pg_tables(conn)
     
-    app.session = aiohttp.ClientSession()
+    app.session = None
+    app.http_session = http_session
     app.sem = asyncio.Semaphore(4, loop=loop)  # limit concurrency of aiohttp requests to Google Books
     
     app.ppe = ProcessPoolExecutor(4)
     app.aexec = loop.run_in_executor    # ensure the aiolocks' being set up
     
-    [i.do_imports() for i in [Location, Role, MediaType, MediaItem, User]]
     if os.getenv('REDIS_URL') is None:  # can't do nothin bout this
         app.config.SANIC_JWT_REFRESH_TOKEN_ENABLED = True  # bc using dict on this dev server
     else:
+        import aioredis
         app.rd_pool = await aioredis.create_pool(
           os.getenv('REDIS_URL'),
           minsize=5,
@@ -180,8 +194,10 @@ async def close_dbs(app, loop):
     """
     Gracefully close all acquired connections before closing.
     """
+    await app.pg_listener.close()
     await app.pg_pool.close()
-    await app.session.close()
+    if app.session is not None:
+        await app.session.close()
     print('Shutting down.')
 
 
@@ -2,6 +2,10 @@
 My help articles aren't stored in this repository, but rather in the project's
 PostgreSQL DB. This script lets me edit them easily.
 
+(Every save also sends a NOTIFY on the 'help' channel, which tells the
+running server to reload that article into its cache -- see
+backend/helpcache.py)
+
 Honestly, although I wrote this whole file in one night and was done with
 it after two hours at most, I'm almost more proud of its functionality
 than I am of the whole rest of the project.
@@ -47,7 +51,10 @@ class HelpItem:
         return self._id
     
     async def _update(self, column, new):
-        await self._conn.execute(f'''UPDATE help SET {column} = $2::text WHERE id = $1::bigint''', self._id, new)
+        async with self._conn.transaction():
+            await self._conn.execute(f'''UPDATE help SET {column} = $2::text WHERE id = $1::bigint''', self._id, new)
+            # Delivered on commit, so the server never reloads a half-saved article
+            await self._conn.execute('''SELECT pg_notify('help', $1::text)''', str(self._id))
         return new
     
     async def edit_title(self, new=None):
@@ -116,6 +123,9 @@ async def do(items: list, conn: asyncpg.Connection, *, loop: asyncio.AbstractEve
                 msg = await conn.fetch(' '.join((column, *new)))
             except Exception as e:
                 msg = f'{type(e).__name__}: {e}'
+            else:
+                # No telling what that touched, so have the server reload everything
+                await conn.execute('''NOTIFY help''')
             clear_screen()
             continue
         try:
@@ -0,0 +1,64 @@
+"""
+Applies whichever of the SQL files in backend/sql/migrations haven't
+been yet, in filename order, each in its own transaction, and notes
+them down in schema_migrations. Runs in the release phase (see the
+Procfile) so that the DB's caught up before new code starts using it.
+
+    python3 migrate.py          # apply what's pending
+    python3 migrate.py --list   # just show what's pending
+
+Start a new DB from backend/sql/schema.sql first (bench/dataset.py does
+both). Migrations should be safe to re-run, i.e. IF NOT EXISTS and so on,
+in case one ever has to be re-applied by hand.
+"""
+import asyncio
+import os
+import sys
+
+import asyncpg
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend', 'sql', 'migrations')
+LOCK = 0x626f6f6b  # pg_advisory_lock() key, so two releases can't migrate at once
+
+
+def migrations():
+    return sorted(name for name in os.listdir(MIGRATIONS) if name.endswith('.sql'))
+
+
+async def pending(conn):
+    await conn.execute('''CREATE TABLE IF NOT EXISTS schema_migrations (name text PRIMARY KEY, applied timestamptz NOT NULL DEFAULT now())''')
+    done = {row['name'] for row in await conn.fetch('''SELECT name FROM schema_migrations''')}
+    return [name for name in migrations() if name not in done]
+
+
+async def migrate(conn):
+    """Applies what's pending on `conn`; returns the names of what it applied."""
+    await conn.execute('''SELECT pg_advisory_lock($1::bigint)''', LOCK)
+    try:
+        applied = []
+        for name in await pending(conn):
+            with open(os.path.join(MIGRATIONS, name)) as f:
+                sql = f.read()
+            async with conn.transaction():
+                await conn.execute(sql)
+                await conn.execute('''INSERT INTO schema_migrations (name) VALUES ($1::text)''', name)
+            applied.append(name)
+        return applied
+    finally:
+        await conn.execute('''SELECT pg_advisory_unlock($1::bigint)''', LOCK)
+
+
+async def main(list_only=False):
+    conn = await asyncpg.connect(os.getenv('DATABASE_URL'))
+    try:
+        if list_only:
+            print(*await pending(conn) or ['Nothing pending.'], sep='\n')
+            return
+        for name in await migrate(conn):
+            print('Applied', name)
+    finally:
+        await conn.close()
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(main('--list' in sys.argv[1:]))
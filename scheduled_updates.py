@@ -4,6 +4,8 @@ import os
 
 import asyncpg
 
+from backend.typedef.mediaitem import PASS_ON, PICKUP_DAYS
+
 now = dt.datetime.now
 
 # update fines and purge old signups
@@ -43,11 +45,41 @@ SELECT 'hold', holds.mid, holds.uid, locations.lid, locations.report_day
 UPDATE locations SET last_report_date = current_date WHERE report_day = '{0}';
 '''
 
+# tell whoever has anything out that went overdue at midnight, so that
+# their open pages say so (see backend/events.py). The fines update above
+# only does that by itself where the location charges fines; elsewhere
+# an item going overdue doesn't change anything in its row. (This runs
+# daily, so "went overdue" is "was due yesterday")
+overdue_query = '''
+SELECT member_events_notify(array(
+  SELECT DISTINCT issued_to
+    FROM items
+   WHERE due_date = current_date - 1
+     AND issued_to IS NOT NULL
+))
+'''
+
+# drop holds that sat on the pickup shelf past their expiry...
+expire_query = '''
+DELETE FROM holds
+ WHERE state = 'ready'
+   AND expires < current_date
+RETURNING ready_mid
+'''
+
 
 async def update_all():
     conn = await asyncpg.connect(os.getenv('DATABASE_URL'))
     try:
         await conn.execute(update_query.format(now().strftime('%A').lower()))
+        await conn.execute(overdue_query)
+        async with conn.transaction():
+            # ...and pass each copy on to the next member in line for it,
+            # if any (one at a time so that two copies of a work don't both
+            # go to the same member)
+            for row in await conn.fetch(expire_query):
+                if row['ready_mid'] is not None:
+                    await conn.execute(PASS_ON, row['ready_mid'], PICKUP_DAYS)
     finally:
         await conn.close()
 
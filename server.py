@@ -1,40 +1,63 @@
 import asyncio
+import functools
 import os
 import urllib
 from concurrent.futures import ProcessPoolExecutor
-from glob import glob
 from inspect import cleandoc
 
-import aiohttp
-import aioredis
 import asyncpg
-import bcrypt
 import sanic
 import uvloop
 import sanic_jwt as jwt
 from sanic import Sanic
 
-from backend import deco
-from backend.typedef import Location, Role, MediaItem, MediaType, User
+from backend import deco, metrics, sessions, static
+from backend.attrcache import AttrCache
+from backend.typedef import Location, User
 from backend.blueprints import bp
+from backend.bus import InvalidationBus
+from backend.events import MemberEvents
+from backend.fairpool import FairScheduler
+from backend.helpcache import HelpCache
+from backend.overload import OverloadController
+from backend.pool import InstrumentedPool, init_connection
+from backend.ratelimit import RateLimiter
+from backend.tracer import QueryTracer
+from backend.versions import Versions
 
 # make it go faster!
 asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 # Create a Sanic application for this file
 app = Sanic('Booksy')
-# These are for checking API access later. (See function force_angular())
-app.safe_segments = ('?', '.html', '.css', '.js', '.ts', '/auth', 'auth/', 'api/', 'stock/', '/verify', '/register')
 # "Blueprints", i.e. separate files containing endpoint info to
 # avoid clogging up this main file.
 # They can be found in ./backend/blueprints
 app.blueprint(bp)
 app.config.TESTING = False  # tells my backend to act like the real deal
-
-app.rtoken_cache = {}  # To mitigate DB slowness
-# Note that I don't have to worry myself about LRUing the above cache
-# (to handle the users that just close their browser w/o logging out)
-# because Heroku does the thing where it restarts processes after 24h
-# -- so the 'cache' won't get a chance to accumulate in memory anyway
+app.config.ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')  # for /metrics; see deco.admin_only()
+app.config.SLOW_QUERY_MS = os.getenv('SLOW_QUERY_MS')  # turns on the query tracer; see backend/tracer.py
+app.config.DB_ROUNDTRIP_HEADERS = bool(os.getenv('DB_ROUNDTRIP_HEADERS'))  # for bench/roundtrips.py; never in production
+# Per-location (or per-session) limits on the expensive endpoints; see backend/ratelimit.py
+app.config.RATE_LIMITS = os.getenv('RATE_LIMITS')
+app.config.RATE_LIMIT_OVERRIDES = os.getenv('RATE_LIMIT_OVERRIDES')
+app.config.RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory')
+# Sharing the Postgres pool out fairly between locations; see backend/fairpool.py
+app.config.PG_FAIR_POOL = os.getenv('PG_FAIR_POOL', '1') != '0'
+app.config.PG_TENANT_CAP = os.getenv('PG_TENANT_CAP')
+app.config.PG_TENANT_WEIGHTS = os.getenv('PG_TENANT_WEIGHTS')
+# Turning low-priority requests away when overloaded; see backend/overload.py
+app.config.OVERLOAD_SHEDDING = os.getenv('OVERLOAD_SHEDDING', '1') != '0'
+app.config.OVERLOAD_LAG_MS = os.getenv('OVERLOAD_LAG_MS')
+app.config.OVERLOAD_WAIT_MS = os.getenv('OVERLOAD_WAIT_MS')
+# Caching media types & genres for /api/attrs; see backend/attrcache.py
+app.config.ATTR_CACHE_SOFT_S = os.getenv('ATTR_CACHE_SOFT_S')
+app.config.ATTR_CACHE_HARD_S = os.getenv('ATTR_CACHE_HARD_S')
+
+# How long refresh tokens (i.e. sessions) last; see backend/sessions.py
+app.config.REFRESH_TOKEN_TTL = int(os.getenv('REFRESH_TOKEN_TTL', sessions.DEFAULT_TTL))
+app.rtoken_cache = sessions.TokenCache(app.config.REFRESH_TOKEN_TTL)  # To mitigate DB slowness
+
+app.versions = Versions()  # For ETags on read-mostly endpoints; see backend/versions.py
 
 
 async def authenticate(rqst, *args, **kwargs):
@@ -56,6 +79,7 @@ async def authenticate(rqst, *args, **kwargs):
     async with app.acquire() as conn:
         query = '''SELECT pwhash FROM members WHERE lid = $1::bigint AND username = $2::text'''
         pwhash = await conn.fetchval(query, lid, username)
+    import bcrypt  # lazy, like the rest; only ever needed for logging in
     bvalid = await app.aexec(app.ppe, bcrypt.checkpw, password, pwhash)
     if not all((username, password, pwhash, bvalid)):
         return False
@@ -69,29 +93,17 @@ async def retrieve_user(rqst, payload, *args, **kwargs):
 
 async def store_rtoken(user_id, refresh_token, *args, **kwargs):
     """/auth/refresh"""
-    async with app.rd_pool.get() as conn:
-        await conn.execute('set', user_id, refresh_token)
-        await conn.execute('set', refresh_token, user_id)  # for retrieving user from refresh token
-        app.rtoken_cache[refresh_token] = user_id
-        app.rtoken_cache[user_id] = refresh_token
+    await sessions.store(app, user_id, refresh_token)
 
 
 async def retrieve_rtoken(user_id, *args, **kwargs):
     """/auth/refresh"""
-    try:
-        return app.rtoken_cache[user_id]
-    except KeyError:
-        async with app.rd_pool.get() as conn:
-            app.rtoken_cache[user_id] = await conn.execute('get', user_id)
-            return app.rtoken_cache[user_id]
+    return await sessions.retrieve(app, user_id)
 
 
 async def revoke_rtoken(user_id, *args, **kwargs):
     """/auth/logout"""
-    async with app.rd_pool.get() as conn:
-        await conn.execute('del', await conn.execute('get', user_id))  # delete refresh token first
-        await conn.execute('del', user_id)
-        del app.rtoken_cache[app.rtoken_cache[user_id]], app.rtoken_cache[user_id]
+    await sessions.revoke_users(app, [user_id])
 
 
 # Initialize with JSON Web Token (JWT) authentication for logins.
@@ -115,18 +127,70 @@ app.config.SANIC_JWT_CLAIM_IAT = True  # for longer sessions
 # that to be sure as to how to deal with or ameliorate it
 app.config.SANIC_JWT_COOKIE_SET = True
 
-# Get the filenames generated by Angular's AOT build
-# (could probably slim this down, sorta just threw the stuff together until it worked)
-olddir = os.getcwd()
-os.chdir('/app/dist')
-filenames = 'index.html', 'styles*.css', 'inline*.js', 'main*.js', 'polyfills*.js', 'scripts*.js'
-relative = [glob(i) for i in filenames]
-os.chdir(olddir)
-absolute = [glob(i) for i in map('/app/dist/'.__add__, filenames)]
-# Route user requests to Angular's files by redirecting, say,
-# /api/whatever to /app/dist/api/whatever
-for rel, absol in zip(relative, absolute):
-    app.static(rel[0], absol[0])
+# Route user requests to the files generated by Angular's AOT build.
+# (They're actually read in & compressed by build_static() below)
+static.register(app)
+
+
+def http_session():
+    """
+    The aiohttp session is only ever used for Google Books lookups when
+    adding media, so it (and aiohttp itself) is created on first use
+    rather than at startup.
+    """
+    if app.session is None:
+        import aiohttp
+        app.session = aiohttp.ClientSession()
+    return app.session
+
+
+async def open_listener(loop):
+    """
+    Opens the dedicated connection that the bus, the help cache and
+    member events LISTEN on (one that's in the pool would stop receiving
+    notifications as soon as it was released), to be reopened by
+    reopen_listener() whenever it drops.
+    """
+    conn = await asyncpg.connect(dsn=os.getenv('DATABASE_URL'), loop=loop)
+    conn.add_termination_listener(listener_lost)
+    for listener in (app.bus, app.help, app.member_events):
+        await listener.listen(conn)
+    app.pg_listener = conn
+
+
+def listener_lost(conn):
+    """
+    Called by asyncpg when the LISTEN connection goes, which Heroku's
+    Postgres does every so often. Not on shutdown; see close_dbs().
+    """
+    print('LISTEN connection lost; cached versions, sessions and help articles may be stale until it is reopened.')
+    metrics.BUS_RECONNECTS.inc()
+    app.loop.create_task(reopen_listener(app.loop))
+
+
+async def reopen_listener(loop):
+    """
+    Keeps trying to reopen the LISTEN connection, then throws out
+    everything that a NOTIFY missed in the meantime would have: every
+    version counter moves on (so no old ETag matches), every cached
+    session's looked up in Redis again, the help articles are reloaded
+    and every open event stream rebuilds its notifications.
+    """
+    delay = 0.5
+    while True:
+        try:
+            await open_listener(loop)
+        except (OSError, asyncpg.PostgresError) as e:
+            print(f'Could not reopen the LISTEN connection ({e!r}); retrying in {delay}s.')
+            await asyncio.sleep(delay)
+            delay = min(2 * delay, 30)
+        else:
+            break
+    app.versions.bump_all()
+    app.rtoken_cache.clear()
+    await app.help.load()
+    app.member_events.wake_all()
+    print('LISTEN connection reopened.')
 
 
 @app.listener('before_server_start')
@@ -135,28 +199,63 @@ async def set_up_dbs(app, loop):
     Establishes a connection to the environment's Postgres and Redis DBs
     for use in (first) authenticating and (then) storing refresh tokens.
     """
-    app.session = aiohttp.ClientSession()
+    app.session = None
+    app.http_session = http_session
     app.sem = asyncio.Semaphore(4, loop=loop)  # limit concurrency of aiohttp requests to Google Books
     
     app.ppe = ProcessPoolExecutor(4)
-    app.aexec = loop.run_in_executor
+    app.aexec = metrics.instrument_executor(app, loop.run_in_executor)
     
-    app.pg_pool = await asyncpg.create_pool(dsn=os.getenv('DATABASE_URL'), max_size=15, loop=loop)
+    # Counts & times queries for /metrics; see backend/pool.py
+    tracer = None
+    if app.config.SLOW_QUERY_MS:
+        tracer = QueryTracer(os.getenv('DATABASE_URL'), float(app.config.SLOW_QUERY_MS), loop=loop)
+    pool_size = 15
+    # ...and queues up acquisitions fairly between locations; see backend/fairpool.py
+    scheduler = FairScheduler.from_config(app.config, pool_size, loop=loop) if app.config.PG_FAIR_POOL else None
+    app.pg_pool = InstrumentedPool(
+      await asyncpg.create_pool(dsn=os.getenv('DATABASE_URL'), max_size=pool_size, init=init_connection, loop=loop),
+      tracer,
+      scheduler
+      )
     app.acquire = app.pg_pool.acquire
     
-    # The below line is necessary (as are the @staticmethod do_imports() methods
-    # in each typedef class) because if the imports are done at the top of each
-    # file, Python will die on attempting to resolve the circular dependencies.
-    [i.do_imports() for i in [Location, Role, MediaType, MediaItem, User]]
+    app.bus = InvalidationBus(app)
+    app.bus.on('versions', app.versions.on_bus_message)
+    app.bus.on('rtoken', functools.partial(sessions.forget, app))
+    app.versions.bus = app.bus
+    
+    app.help = HelpCache(app)
+    await app.help.load()
+    app.attr_cache = AttrCache.from_config(app)
+    
+    # Fans notification changes out to /api/member/events streams
+    app.member_events = MemberEvents(app)
+    await open_listener(loop)
+    
     if os.getenv('REDIS_URL') is None:  # Means I'm testing (don't have Redis on home PC)
         app.config.SANIC_JWT_REFRESH_TOKEN_ENABLED = False
     else:
+        import aioredis
         app.rd_pool = await aioredis.create_pool(
           os.getenv('REDIS_URL'),
           minsize=5,
           maxsize=15,
           loop=loop
           )
+    app.limiter = RateLimiter(app)  # after Redis, in case it's the backend
+    
+    app.overload = OverloadController.from_config(app, loop=loop)
+    app.overload.start()
+
+
+@app.listener('before_server_start')
+async def build_static(app, loop):
+    """
+    Loads Angular's files into memory, precompressed, so that serving
+    them is just a dict lookup. See backend/static.py.
+    """
+    await static.build(app, loop)
 
 
 @app.listener('before_server_stop')
@@ -165,26 +264,38 @@ async def close_dbs(app, loop):
     Cleanly close all acquired connections before shutting off.
     """
     print('Shutting down.')
-    await app.session.close()
+    await app.overload.close()
+    if app.session is not None:
+        await app.session.close()
+    app.pg_listener.remove_termination_listener(listener_lost)
+    await app.pg_listener.close()
+    if app.pg_pool.tracer is not None:
+        await app.pg_pool.tracer.close()
     await app.pg_pool.close()
     # & aioredis is really strange
     app.rd_pool.close()
     await app.rd_pool.wait_closed()
 
 
+@app.middleware('request')
+async def start_metrics(rqst):
+    """
+    Starts keeping track of how long this request takes and how much it
+    makes of the DB. (Registered first so that it sees everything.)
+    """
+    metrics.start_request(rqst)
+
+
 @app.middleware('request')
 async def force_angular(rqst):
     """
-    Let through any requestes with URLs containing strings in `safe`,
-    because this denotes API access; else redirect to Angular's files
+    Let through any requests for API routes or static files (or with a
+    query string, because that's the Angular app talking to itself);
+    else redirect to Angular's files
     """
-    if not any(i in rqst.url for i in app.safe_segments):
-        try:
-            url = rqst.url[3+rqst.url.find('://'):]
-            path = urllib.parse.quote(url.split('/', 1)[1])
-            return sanic.response.redirect(f'/index.html/?redirect={path}')
-        except IndexError:
-            return sanic.response.redirect('/index.html')
+    if not rqst.query_string and not static.classify(rqst.path):
+        path = urllib.parse.quote(rqst.path[1:])
+        return sanic.response.redirect(f'/index.html/?redirect={path}' if path else '/index.html')
 
 
 @app.middleware('response')
@@ -194,8 +305,22 @@ async def force_no_cache(rqst, resp):
     the sidebar buttons (which, of course, are *supposed* to be served
     according to the CURRENT user's permissions, not whomsever a given
     IP was logged in as previously)
+    
+    Responses that set their own Cache-Control (i.e. Angular's static
+    files; see backend/static.py) are left alone.
+    """
+    if 'Cache-Control' not in resp.headers:
+        resp.headers['Cache-Control'] = static.NO_STORE
+
+
+@app.middleware('response')
+async def finish_metrics(rqst, resp):
+    """
+    Records the request's latency, status and DB usage; see
+    backend/metrics.py. (Response middleware runs in reverse order of
+    registration, so this one runs last.)
     """
-    resp.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+    metrics.finish_request(rqst, resp)
 
 
 @app.route('/login')
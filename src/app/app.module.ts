@@ -62,6 +62,7 @@ import {SpaceOnlyTitleCasePipe} from './titlespace.pipe';
 import { ButtonService } from './button.service';
 import { CheckoutService } from './checkout.service';
 import { HelpService } from './help.service';
+import { JobsService } from './jobs.service';
 import { LocationService } from './location.service';
 import { MediaService } from './media.service';
 import { MediaTypeService } from './media-type.service';
@@ -143,6 +144,7 @@ import { SetupService } from './setup.service';
     ReportsService,
     LocationService,
     HelpService,
+    JobsService,
     MediaTypeService,
     Globals
   ],
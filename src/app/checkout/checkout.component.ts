@@ -62,7 +62,9 @@ export class CheckoutComponent {
             this.checkoutService.checkIn(mID, this.username)
               .subscribe(
                 resp => {
-                  this.msg = 'Checked in!';
+                  this.msg = resp.held_for
+                    ? `Checked in! Put it on the pickup shelf for ${resp.held_for.name || resp.held_for.username}.`
+                    : 'Checked in!';
                   this._mid = this.mid;
                 },
                 err => this.msg = err.error ? err.error : 'Error checking in'
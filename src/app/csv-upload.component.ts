@@ -2,6 +2,10 @@ import { Component, ElementRef, Input, ViewChild } from '@angular/core';
 import { HttpClient } from '@angular/common/http';
 import { asElementData } from '@angular/core/src/view';
 
+import { switchMap, tap } from 'rxjs/operators';
+
+import { JobsService } from './jobs.service';
+
 // Modified slightly from https://stackoverflow.com/a/39862337/
 // by user "Brother Woodrow".
 @Component({
@@ -22,7 +26,7 @@ export class CSVUploadComponent {
     @ViewChild('fileInput') inputEl: ElementRef;
     msg: string;
     
-    constructor(private http: HttpClient) {}
+    constructor(private http: HttpClient, private jobs: JobsService) {}
     
     upload() {
         const inputEl: HTMLInputElement = this.inputEl.nativeElement;
@@ -30,6 +34,10 @@ export class CSVUploadComponent {
         formData.append('csv', inputEl.files[0]);
         formData.append('rid', this.rID);
         this.http.post(this.fileUploadURL, formData)
+          .pipe(
+            tap(() => this.msg = 'Adding members...'),  // it's a background job from here
+            switchMap(resp => this.jobs.result(resp))
+          )
           .subscribe(resp => this.msg = 'Members added successfully.', err => this.msg = err.error ? err.error : 'Error.');
         this.msg = 'Uploading...';
     }
@@ -0,0 +1,28 @@
+import { Injectable } from '@angular/core';
+import { HttpClient } from '@angular/common/http';
+
+import { exhaustMap, filter, switchMap, take } from 'rxjs/operators';
+import { Observable } from 'rxjs/Observable';
+import { of } from 'rxjs/observable/of';
+import { _throw } from 'rxjs/observable/throw';
+import { timer } from 'rxjs/observable/timer';
+
+// Waits on background jobs -- what the backend hands back (with a 202) for
+// anything that takes too long to do within the request, like live reports.
+@Injectable()
+export class JobsService {
+  private jobsURL = 'api/jobs';
+  
+  constructor(private http: HttpClient) {}
+  
+  result(resp: any, every = 1000): Observable<any> {
+    // Passes anything that isn't a job straight through, so callers don't have to check
+    if (!resp || resp.job === undefined) { return of(resp); }
+    return timer(0, every).pipe(
+      exhaustMap(() => this.http.get<any>(`${this.jobsURL}/${resp.job}`)),
+      filter(job => job.state === 'done' || job.state === 'failed'),
+      take(1),
+      switchMap(job => job.state === 'done' ? of(job.result) : _throw({error: job.error}))
+    );
+  }
+}
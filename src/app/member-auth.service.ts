@@ -79,8 +79,7 @@ export class MemberAuthService {
     this.globals.phone = details.phone;
     
     if (details.user_id) {
-      this.setupService.getAttrs(details.user_id);
-      this.setupService.getPerms(details.user_id);
+      this.setupService.bootstrap();
     }
   }
   
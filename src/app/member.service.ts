@@ -14,6 +14,7 @@ const httpOptions = HttpOptions;
 @Injectable()
 export class MemberService {
   private notifURL = 'api/member/notifications';
+  private eventsURL = 'api/member/events';
   private suggestionURL = 'api/member/suggest';
   private holdsURL = 'api/member/held';
   private clearHoldURL = 'api/member/clear-hold';
@@ -53,6 +54,23 @@ export class MemberService {
     .shareReplay();
   }
   
+  notifEvents(): Observable<any> {
+    // The signed-in member's notifications, pushed by the server whenever
+    // they change (see backend/events.py) rather than polled for.
+    // EventSource reconnects by itself after a dropped connection, so this
+    // only errors out if the server turns it away outright
+    return new Observable(observer => {
+      const source = new EventSource(this.eventsURL, {withCredentials: true});
+      source.addEventListener('notifications', (event: any) => observer.next(JSON.parse(event.data)));
+      source.onerror = err => {
+        if (source.readyState === EventSource.CLOSED) {
+          observer.error(err);
+        }
+      };
+      return () => source.close();
+    });
+  }
+  
   getSuggestions(): Observable<any> {
     return this.http.get<any>(this.suggestionURL);
   }
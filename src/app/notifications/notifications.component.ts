@@ -1,4 +1,5 @@
-import { Component, OnInit, Input } from '@angular/core';
+import { Component, OnInit, OnDestroy, Input } from '@angular/core';
+import { Subscription } from 'rxjs/Subscription';
 
 import { MemberService } from '../member.service';
 
@@ -9,7 +10,8 @@ import { Globals } from '../globals';
   templateUrl: './notifications.component.html',
   styleUrls: ['./notifications.component.css']
 })
-export class NotificationsComponent implements OnInit {
+export class NotificationsComponent implements OnInit, OnDestroy {
+  private events: Subscription;
   
   constructor(
     public globals: Globals,
@@ -21,6 +23,26 @@ export class NotificationsComponent implements OnInit {
   ngOnChanges() { }
   
   ngOnInit() {
+    if (!this.username || this.username === this.globals.username) {
+      // Own notifications are kept up to date as they change...
+      this.events = this.memberService.notifEvents()
+        .subscribe(
+          resp => this.globals.checkoutMessages = resp,
+          err => this.fetch()  // (e.g. a browser without EventSource, or a proxy that won't stream)
+        );
+    } else {
+      // ...whereas someone else's (at the checkout desk) are only fetched the once
+      this.fetch();
+    }
+  }
+  
+  ngOnDestroy() {
+    if (this.events) {
+      this.events.unsubscribe();
+    }
+  }
+  
+  fetch() {
     if (this.globals.checkoutMessages === null) {
       this.memberService.getNotifs(this.username)
         .subscribe(resp => this.globals.checkoutMessages = resp);
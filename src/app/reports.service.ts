@@ -1,13 +1,14 @@
 import { Injectable } from '@angular/core';
 import { HttpClient } from '@angular/common/http';
 
-import { catchError, map, tap } from 'rxjs/operators';
+import { catchError, map, switchMap, tap } from 'rxjs/operators';
 import { Observable } from 'rxjs/Observable';
 
 import { Role, HttpOptions } from './classes';
 const httpOptions = HttpOptions;
 
 import { Globals } from './globals';
+import { JobsService } from './jobs.service';
 
 // Handles fetching of library-specific reports.
 @Injectable()
@@ -17,7 +18,8 @@ export class ReportsService {
   
   constructor(
     private globals: Globals,
-    private http: HttpClient
+    private http: HttpClient,
+    private jobs: JobsService
   ) {}
   
   getReport(liveReports: boolean, chks= false, ovds= false, fins= false, hlds= false, itms= false) {
@@ -41,7 +43,8 @@ export class ReportsService {
           fines: fins,
           holds: hlds,
           items: itms
-        }});
+        }})
+      .pipe(switchMap(resp => this.jobs.result(resp)));  // live reports come back as a job to wait on
   }
   
   getLastReportDate() {
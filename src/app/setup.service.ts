@@ -3,37 +3,58 @@ import { HttpClient } from '@angular/common/http';
 
 import { catchError, map, tap } from 'rxjs/operators';
 import { Observable } from 'rxjs/Observable';
+import { of } from 'rxjs/observable/of';
 
 import { Role, HttpOptions } from './classes';
 const httpOptions = HttpOptions;
 
 import { Globals } from './globals';
+import { ButtonService } from './button.service';
 
 // Handles grabbing relevant member info on signin
 @Injectable()
 export class SetupService {
   private attrsURL = 'api/attrs';
   private permCheckURL = 'api/member/check-perms';
+  private bootstrapURL = 'api/bootstrap';
   
   constructor(
     private globals: Globals,
-    private http: HttpClient
+    private http: HttpClient,
+    private buttonService: ButtonService
   ) {}
   
-  getAttrs(uID) {
-    this.http.get<any>(this.attrsURL)
+  bootstrap() {
+    // Everything below (plus the sidebar/management buttons and the
+    // member's notifications) in the one request
+    this.http.get<any>(this.bootstrapURL)
       .subscribe(resp => {
-        this.globals.attrs = resp.names;
-        this.globals.locMediaTypes = resp.types;
-        this.globals.locGenres = resp.genres;
-        // set up header colors... unimplemented though :(
-        const rawColor = resp.locColor || 0xf7f7f7;
-        this.globals.locColor = this.toRGB(rawColor);
-        this.globals.locActiveColor = this.toRGB(rawColor - 0x382f2b);
-        this.globals.locDepressedColor = this.toRGB(rawColor - 0x6f6f6f);
+        this.saveAttrs(resp.attrs);
+        this.globals.perms = resp.perms.perms;
+        this.globals.checkoutMessages = resp.notifications;
+        this.buttonService.sideButtons = of(resp.buttons.home_sidebar);
+        if (resp.buttons.mgmt_header) {
+          this.buttonService.mgmtHeaderButtons = of(resp.buttons.mgmt_header);
+        }
       });
   }
   
+  getAttrs(uID) {
+    this.http.get<any>(this.attrsURL)
+      .subscribe(resp => this.saveAttrs(resp));
+  }
+  
+  saveAttrs(attrs) {
+    this.globals.attrs = attrs.names;
+    this.globals.locMediaTypes = attrs.types;
+    this.globals.locGenres = attrs.genres;
+    // set up header colors... unimplemented though :(
+    const rawColor = attrs.locColor || 0xf7f7f7;
+    this.globals.locColor = this.toRGB(rawColor);
+    this.globals.locActiveColor = this.toRGB(rawColor - 0x382f2b);
+    this.globals.locDepressedColor = this.toRGB(rawColor - 0x6f6f6f);
+  }
+  
   toRGB(num): string {
     // tslint:disable-next-line:no-bitwise
     return '#' + (num >>> 0).toString(16).slice(-6);
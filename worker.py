@@ -0,0 +1,84 @@
+"""
+Runs background jobs (see backend/jobs.py) -- the 'worker' process in
+the Procfile, alongside the web one. Everything it needs from the Sanic
+app is set up by hand here on a namespace in its place, with a pool of
+its own so that jobs never compete with web requests for connections.
+
+    python3 worker.py                                 # every job type
+    python3 worker.py members.import report.live      # just these
+
+Stops on SIGTERM (i.e. when Heroku restarts it), once the jobs it's in
+the middle of have finished.
+"""
+import asyncio
+import os
+import signal
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+
+import asyncpg
+import uvloop
+
+from backend import jobs, metrics
+from backend.bus import InvalidationBus
+from backend.pool import InstrumentedPool, init_connection
+from backend.versions import Versions
+
+asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+
+def http_session(app):
+    """As in server.py."""
+    if app.session is None:
+        import aiohttp
+        app.session = aiohttp.ClientSession()
+    return app.session
+
+
+async def set_up(loop):
+    app = SimpleNamespace(loop=loop, session=None, config={})
+    app.http_session = lambda: http_session(app)
+    app.sem = asyncio.Semaphore(4, loop=loop)
+    app.ppe = ProcessPoolExecutor(2)
+    app.aexec = metrics.instrument_executor(app, loop.run_in_executor)
+    # Enough for every job type to be running at once, plus each one's
+    # progress updates while it holds a connection
+    size = 2 * sum(jtype.concurrency for jtype in jobs.JOB_TYPES.values()) + 1
+    app.pg_pool = InstrumentedPool(await asyncpg.create_pool(dsn=os.getenv('DATABASE_URL'), max_size=size, init=init_connection, loop=loop))
+    app.acquire = app.pg_pool.acquire
+    app.pg_listener = await asyncpg.connect(dsn=os.getenv('DATABASE_URL'), loop=loop)
+    # Only ever publishes -- the web workers are the ones with caches to
+    # keep in step with whatever the jobs change
+    app.bus = InvalidationBus(app)
+    app.versions = Versions(app.bus)
+    return app
+
+
+async def tear_down(app):
+    if app.session is not None:
+        await app.session.close()
+    await app.pg_listener.close()
+    await app.pg_pool.close()
+    app.ppe.shutdown()
+
+
+async def main(loop, types):
+    app = await set_up(loop)
+    worker = jobs.Worker(app, types)
+    loop.add_signal_handler(signal.SIGTERM, lambda: loop.create_task(worker.stop()))
+    loop.add_signal_handler(signal.SIGINT, lambda: loop.create_task(worker.stop()))
+    print('Running jobs:', ', '.join(worker.types))
+    try:
+        await worker.run(app.pg_listener)
+        await worker.stop()
+    finally:
+        await tear_down(app)
+
+
+if __name__ == '__main__':
+    unknown = set(sys.argv[1:]) - set(jobs.JOB_TYPES)
+    if unknown:
+        sys.exit(f'Unknown job type(s): {", ".join(sorted(unknown))}')
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(main(loop, sys.argv[1:] or None))